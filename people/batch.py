@@ -0,0 +1,263 @@
+"""
+This file contains the columnar batch engine that generates synthetic person data.
+
+Rather than building one person at a time, every requested field is generated
+for all of the rows in a batch at once by its provider, see people/providers.py.
+Numerical fields (age, birthdate, deceased and gender) are derived from numpy
+arrays, whilst string fields are drawn from pools of values that are pre-sampled
+from faker.
+"""
+import numpy as np
+
+from people import metrics
+from people.context import GeneratorContext
+from people.pools import ValuePools
+from people.providers import BatchBuilder, FIELD_PROVIDERS
+
+OUTPUT_FIELD_ORDER = (
+    "name",
+    "email",
+    "gender",
+    "birthdate",
+    "phone",
+    "age",
+    "deceased",
+    "address",
+    "nationality",
+    "country",
+    "occupation",
+    "dependents",
+)
+
+AGE_DERIVED_FIELDS = {"age", "deceased", "occupation"}
+
+COUNTRY_DERIVED_FIELDS = {"nationality"}
+
+
+def generate_columns(
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray = None,
+    pools: ValuePools = None,
+    context: GeneratorContext = None,
+) -> dict[str, np.ndarray]:
+    """Generates every requested field for all of the rows of a batch at once
+
+    Args:
+        number (int): The number of rows in the batch
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray, optional): A numpy 1 dimensional array outlining the potential age range as specified by the user. Defaults to None.
+        pools (ValuePools, optional): The pools string fields are drawn from. Defaults to the sampled pools.
+        context (GeneratorContext, optional): The random state of this batch. Defaults to an unseeded context.
+
+    Returns:
+        dict[str, np.ndarray]: a mapping of field name to a column of length number, the dependents column holds the number of dependents of each row
+    """
+    if context is None:
+        context = GeneratorContext()
+    if pools is None:
+        pools = ValuePools()
+    batch = BatchBuilder(number, input_fields, age_list, pools, context)
+
+    output_fields = set(input_fields) & FIELD_PROVIDERS.keys()
+    if batch.age_list is not None:
+        output_fields.update(("age", "birthdate"))
+    elif output_fields & AGE_DERIVED_FIELDS:
+        output_fields.add("age")
+    if output_fields & COUNTRY_DERIVED_FIELDS:
+        output_fields.add("country")
+
+    return {
+        field: batch.column(field)
+        for field in OUTPUT_FIELD_ORDER
+        if field in output_fields
+    }
+
+
+class PersonBatch:
+    """A batch of generated people held as one array per field rather than as one
+    dictionary per person, rows only become dictionaries when the batch is encoded
+
+    Args:
+        number (int): the number of people in the batch
+        columns (dict[str, np.ndarray]): a column of length number per field, in OUTPUT_FIELD_ORDER
+        dependents (PersonBatch, optional): the dependents of every person, held as a single batch. Defaults to None.
+        offsets (np.ndarray, optional): the dependents of person i are the rows offsets[i] to offsets[i + 1] of dependents. Defaults to None.
+    """
+
+    __slots__ = ("number", "columns", "dependents", "offsets")
+
+    def __init__(
+        self,
+        number: int,
+        columns: dict[str, np.ndarray],
+        dependents: "PersonBatch" = None,
+        offsets: np.ndarray = None,
+    ):
+        self.number = number
+        self.columns = columns
+        self.dependents = dependents
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return self.number
+
+    def keys(self) -> list[str]:
+        """The keys of the people of the batch, in OUTPUT_FIELD_ORDER"""
+        keys = list(self.columns)
+        if self.dependents is not None:
+            keys.append("dependents")
+        return keys
+
+    def dependent_keys(self) -> list[str] | None:
+        """The keys of the dependents, None when the batch has no dependents"""
+        if self.dependents is None or not len(self.dependents):
+            return None
+        return self.dependents.keys()
+
+    def to_records(self) -> list[dict]:
+        """Converts the batch into the list of dictionaries returned by the API,
+        values are native python types
+        """
+        keys = list(self.columns)
+        values = [column.tolist() for column in self.columns.values()]
+        if self.dependents is not None:
+            children = self.dependents.to_records()
+            bounds = self.offsets.tolist()
+            keys.append("dependents")
+            values.append(
+                [children[start:stop] for start, stop in zip(bounds, bounds[1:])]
+            )
+        if not keys:
+            return [{} for _ in range(self.number)]
+
+        return [dict(zip(keys, row)) for row in zip(*values)]
+
+    def to_rows(self) -> list[list]:
+        """Converts the batch into one list of values per person, in the order of
+        keys, the dependents of a person are a list of rows
+        """
+        values = [column.tolist() for column in self.columns.values()]
+        if self.dependents is not None:
+            children = self.dependents.to_rows()
+            bounds = self.offsets.tolist()
+            values.append(
+                [children[start:stop] for start, stop in zip(bounds, bounds[1:])]
+            )
+        if not values:
+            return [[] for _ in range(self.number)]
+        return [list(row) for row in zip(*values)]
+
+    def slice(self, start: int, stop: int) -> "PersonBatch":
+        """Returns the people of rows start to stop of the batch, with their dependents"""
+        dependents = offsets = None
+        if self.dependents is not None:
+            offsets = self.offsets[start : stop + 1]
+            dependents = self.dependents.slice(int(offsets[0]), int(offsets[-1]))
+            offsets = offsets - offsets[0]
+        return PersonBatch(
+            stop - start,
+            {field: column[start:stop] for field, column in self.columns.items()},
+            dependents,
+            offsets,
+        )
+
+
+def dependent_offsets(counts: np.ndarray) -> np.ndarray:
+    """Converts the number of dependents of each parent into the offsets of PersonBatch"""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def generate_dependents(
+    counts: np.ndarray,
+    input_fields: list[str],
+    columns: dict[str, np.ndarray],
+    pools: ValuePools,
+    context: GeneratorContext,
+) -> PersonBatch:
+    """Generates the dependents of every row of a batch as one flat batch, which
+    is linked to the parents by the offsets computed from counts. Dependents share
+    the requested fields of their parent and always have a birthdate
+
+    Args:
+        counts (np.ndarray): The number of dependents of each parent
+        input_fields (list[str]): The fields requested for the parents
+        columns (dict[str, np.ndarray]): The columns generated for the parents
+        pools (ValuePools): The pools shared with the parents
+        context (GeneratorContext): The random state of the parents, see GeneratorContext.dependents
+
+    Returns:
+        PersonBatch: the dependents of all of the parents, in the order of their parents
+    """
+    dependent_fields = [field for field in input_fields if field != "dependents"]
+    if "birthdate" not in dependent_fields:
+        dependent_fields.append("birthdate")
+    if "age" in columns and "age" not in dependent_fields:
+        dependent_fields.append("age")
+
+    total = int(counts.sum())
+    return PersonBatch(
+        total,
+        generate_columns(
+            total,
+            dependent_fields,
+            pools=pools,
+            context=context.dependents(counts),
+        ),
+    )
+
+
+def generate_batch(
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray = None,
+    pools: ValuePools = None,
+    context: GeneratorContext = None,
+) -> PersonBatch:
+    """Generates a batch of synthetic people, together with their dependents
+
+    Args:
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray, optional): A numpy 1 dimensional array outlining the potential age range as specified by the user. Defaults to None.
+        pools (ValuePools, optional): The pools string fields are drawn from. Defaults to the sampled pools.
+        context (GeneratorContext, optional): The random state of this batch. Defaults to an unseeded context.
+
+    Returns:
+        PersonBatch: the generated people
+    """
+    if context is None:
+        context = GeneratorContext()
+    if pools is None:
+        pools = ValuePools()
+
+    with metrics.stage("generate"):
+        columns = generate_columns(number, input_fields, age_list, pools, context)
+        counts = columns.pop("dependents", None)
+        if counts is None:
+            return PersonBatch(number, columns)
+        return PersonBatch(
+            number,
+            columns,
+            dependents=generate_dependents(
+                counts, input_fields, columns, pools, context
+            ),
+            offsets=dependent_offsets(counts),
+        )
+
+
+def generate_records(
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray = None,
+    pools: ValuePools = None,
+    context: GeneratorContext = None,
+) -> list[dict]:
+    """Generates a batch of synthetic people as a list of dictionaries, see generate_batch
+
+    Returns:
+        list[dict]: a list of generated data
+    """
+    return generate_batch(number, input_fields, age_list, pools, context).to_records()
@@ -0,0 +1,302 @@
+"""
+This file contains the benchmark suite of the startup, generation, serialization and
+request handling.
+
+Every benchmark is timed over a number of repeats of which the fastest is kept, then
+run once more under tracemalloc to record its peak memory, except for the start of a
+fresh server process which is timed in a subprocess. The results are written as JSON
+and compared with a stored baseline, a benchmark that became slower or heavier than
+the baseline by more than a tolerance is reported as a regression.
+The suite is run with `python manage.py benchmark`.
+"""
+import asyncio
+import gc
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date
+from typing import Callable
+
+import numpy as np
+import ujson
+from django.conf import settings
+from django.test import AsyncClient, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from people.batch import generate_batch
+from people.context import GeneratorContext
+from people.dataclass import generate_persons
+from people.encoders import encode_people
+from people.fields import MANDATORY_FIELDS, USER_QUERY_FIELDS
+from people.serializers import PersonSerializer
+
+RESULTS_VERSION = 1
+
+FIELD_SETS = {
+    "minimal": sorted(MANDATORY_FIELDS),
+    "verbose": sorted(USER_QUERY_FIELDS - {"dependents"}),
+    "dependents": sorted(USER_QUERY_FIELDS),
+}
+
+SIZES = (100, 1000, 10000)
+
+SERIALIZER_SIZES = (100, 1000)
+
+LATENCY_SIZES = (10, 1000)
+
+LATENCY_REQUESTS = 20
+
+# The seed and reference date of every benchmark, so that each run generates the same data
+SEED = 0
+REFERENCE_DATE = date(2020, 1, 1)
+
+METRICS = ("seconds", "peak_bytes")
+
+# The start of a fresh process depends on the disk cache and the load of the machine
+# far more than the benchmarks run in process, so the startup benchmarks are compared
+# with at least this tolerance
+STARTUP_TOLERANCE = 1.0
+
+# Run in a fresh interpreter by startup_benchmarks, prints its timings as JSON
+STARTUP_SCRIPT = """
+import asyncio, resource, time
+
+start = time.perf_counter()
+import django
+
+django.setup()
+import synthetic.urls
+
+boot = time.perf_counter() - start
+boot_peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+import ujson
+from django.conf import settings
+from django.test import AsyncClient
+from django.test.utils import setup_test_environment
+
+setup_test_environment()
+body = ujson.dumps({"number": 10, "fields": ["name", "email", "gender", "birthdate", "nationality"]})
+start = time.perf_counter()
+response = asyncio.run(AsyncClient().generic("GET", "/api/persons/", body))
+assert response.status_code == 201, response.content
+first_request = time.perf_counter() - start
+peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+print(ujson.dumps({
+    "boot": boot,
+    "boot_peak_bytes": boot_peak_bytes,
+    "first_request": first_request,
+    "peak_bytes": peak_bytes,
+}))
+"""
+
+
+def measure(run: Callable, repeats: int) -> dict[str, float]:
+    """Times a function and records the peak memory it allocates
+
+    Args:
+        run (Callable): the benchmarked function, called without arguments
+        repeats (int): the number of timed calls, the fastest is kept
+
+    Returns:
+        dict[str, float]: the seconds of the fastest call and the peak traced bytes
+    """
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_bytes": peak_bytes}
+
+
+def context() -> GeneratorContext:
+    return GeneratorContext(SEED, REFERENCE_DATE)
+
+
+def generation_benchmarks(sizes: tuple[int], repeats: int) -> dict[str, dict]:
+    """Benchmarks generate_persons for every field set and size, the dependents
+    field set measures the overhead of generating dependents
+    """
+    results = {}
+    for field_set, fields in FIELD_SETS.items():
+        for number in sizes:
+            result = measure(
+                lambda: generate_persons(number, fields, context=context()),
+                repeats,
+            )
+            result["rows_per_second"] = number / result["seconds"]
+            results[f"generate/{field_set}/{number}"] = result
+    return results
+
+
+def serialization_benchmarks(sizes: tuple[int], repeats: int) -> dict[str, dict]:
+    """Benchmarks the validation by PersonSerializer of a strict request against
+    the single schema validation and encoding of encode_people
+    """
+    results = {}
+    for field_set, fields in FIELD_SETS.items():
+        for number in sizes:
+            people = generate_persons(number, fields, context=context())
+            batch = generate_batch(number, fields, context=context())
+            results[f"serializer/{field_set}/{number}"] = measure(
+                lambda: PersonSerializer(data=people, many=True).is_valid(
+                    raise_exception=True
+                ),
+                repeats,
+            )
+            results[f"encode/{field_set}/{number}"] = measure(
+                lambda: encode_people(batch), repeats
+            )
+    return results
+
+
+async def request_latencies(
+    client: AsyncClient, request_body: dict, requests: int
+) -> list[float]:
+    """Sends a request to /api/persons/ a number of times and returns the latency of each"""
+    content = ujson.dumps(request_body)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.generic("GET", "/api/persons/", content)
+        if response.status_code != 201:
+            raise RuntimeError(
+                f"The benchmarked request failed with {response.status_code}: {response.content!r}"
+            )
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def latency_benchmarks(sizes: tuple[int], requests: int) -> dict[str, dict]:
+    """Benchmarks the end to end latency of PersonAPIClass through an AsyncClient,
+    the response cache is disabled so that every request is generated
+    """
+    results = {}
+    setup_test_environment()
+    try:
+        with override_settings(PERSON_RESPONSE_CACHE_BACKEND=None):
+            client = AsyncClient()
+            for field_set, fields in FIELD_SETS.items():
+                for number in sizes:
+                    request_body = {"number": number, "fields": fields}
+                    latencies = np.array(
+                        asyncio.run(request_latencies(client, request_body, requests))
+                    )
+                    result = measure(
+                        lambda: asyncio.run(request_latencies(client, request_body, 1)),
+                        repeats=1,
+                    )
+                    result.update(
+                        seconds=float(np.median(latencies)),
+                        p95_seconds=float(np.percentile(latencies, 95)),
+                    )
+                    results[f"latency/{field_set}/{number}"] = result
+    finally:
+        teardown_test_environment()
+    return results
+
+
+def startup_benchmarks(repeats: int) -> dict[str, dict]:
+    """Benchmarks the start of a fresh server process, the time to set up django and
+    import the url configuration and views, then the time of the first request, which
+    pays for the resources that are only loaded on first use. The peak memory is
+    the maximum resident set size of the process
+    """
+    timings = []
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "DJANGO_SETTINGS_MODULE": "synthetic.settings"},
+            capture_output=True,
+            check=True,
+        )
+        timings.append(ujson.loads(completed.stdout.splitlines()[-1]))
+    fastest = min(timings, key=lambda timing: timing["boot"])
+    return {
+        "startup/boot": {
+            "seconds": min(timing["boot"] for timing in timings),
+            "peak_bytes": fastest["boot_peak_bytes"],
+        },
+        "startup/first_request": {
+            "seconds": min(timing["first_request"] for timing in timings),
+            "peak_bytes": fastest["peak_bytes"],
+        },
+    }
+
+
+def run_benchmarks(quick: bool = False, repeats: int = 3) -> dict:
+    """Runs the whole suite
+
+    Args:
+        quick (bool, optional): only runs the smaller sizes. Defaults to False.
+        repeats (int, optional): the number of timed calls per benchmark. Defaults to 3.
+
+    Returns:
+        dict: the results, keyed by benchmark name under 'benchmarks'
+    """
+    sizes = SIZES[:-1] if quick else SIZES
+    benchmarks = {}
+    benchmarks.update(startup_benchmarks(repeats))
+    benchmarks.update(generation_benchmarks(sizes, repeats))
+    benchmarks.update(serialization_benchmarks(SERIALIZER_SIZES, repeats))
+    benchmarks.update(
+        latency_benchmarks(
+            LATENCY_SIZES, LATENCY_REQUESTS // 2 if quick else LATENCY_REQUESTS
+        )
+    )
+    return {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "benchmarks": benchmarks,
+    }
+
+
+def compare_results(
+    results: dict,
+    baseline: dict,
+    tolerance: float,
+    startup_tolerance: float = STARTUP_TOLERANCE,
+) -> list[str]:
+    """Compares results with a baseline, benchmarks missing from either are skipped
+
+    Args:
+        results (dict): the results of run_benchmarks
+        baseline (dict): earlier results of run_benchmarks
+        tolerance (float): the allowed relative increase of each metric, 0.25 allows 25%
+        startup_tolerance (float, optional): the allowed relative increase of the startup benchmarks, when larger than tolerance. Defaults to STARTUP_TOLERANCE.
+
+    Returns:
+        list[str]: a description of every regression, empty when there is none
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        expected = baseline["benchmarks"].get(name)
+        if expected is None:
+            continue
+        allowed = tolerance
+        if name.startswith("startup/"):
+            allowed = max(tolerance, startup_tolerance)
+        for metric in METRICS:
+            if metric not in result or not expected.get(metric):
+                continue
+            ratio = result[metric] / expected[metric]
+            if ratio > 1 + allowed:
+                regressions.append(
+                    f"{name} {metric}: {result[metric]:.6g} against a baseline of {expected[metric]:.6g} ({ratio:.2f}x)"
+                )
+    return regressions
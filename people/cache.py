@@ -0,0 +1,257 @@
+"""
+This file contains the response cache of seeded requests.
+
+A seeded request always produces the same response, so its encoded body is stored
+under a key computed from the normalized request: the number of entries, the sorted
+fields, the resolved age range, the seed and the reference date. The key also
+serves as the ETag of the response, which lets clients revalidate with If-None-Match
+without the response being generated again.
+
+The cache is bounded by size and its storage is pluggable, see
+PERSON_RESPONSE_CACHE_BACKEND in synthetic/settings.py.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable
+
+import numpy as np
+import ujson
+from django.conf import settings
+from django.core.cache import caches
+
+from people.context import GeneratorContext
+
+# Bumped whenever a change to the generation alters the output of a given seed,
+# so that responses cached by an earlier version are not served
+CACHE_VERSION = 4
+
+response_cache = None
+response_cache_backend = None
+
+
+class MemoryBackend:
+    """Stores responses in process memory, least recently used responses are
+    evicted once the stored responses exceed max_bytes
+
+    Args:
+        max_bytes (int): the maximum total size of the stored responses
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_in_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            content = self.entries.get(key)
+            if content is not None:
+                self.entries.move_to_end(key)
+            return content
+
+    def set(self, key: str, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size_in_bytes -= len(previous)
+            self.entries[key] = content
+            self.size_in_bytes += len(content)
+            while self.size_in_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size_in_bytes -= len(evicted)
+
+
+class DjangoCacheBackend:
+    """Stores responses in one of the caches configured in settings.CACHES, which
+    lets several server processes share them, eviction is left to that cache
+
+    Args:
+        alias (str): the alias of the django cache
+        max_bytes (int): responses larger than this are not stored
+    """
+
+    def __init__(self, alias: str, max_bytes: int):
+        self.cache = caches[alias]
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> bytes | None:
+        return self.cache.get(key)
+
+    def set(self, key: str, content: bytes) -> None:
+        if len(content) <= self.max_bytes:
+            self.cache.set(key, content, timeout=None)
+
+
+class FileBackend:
+    """Stores each response in a file of a directory, files that were least recently
+    read or written are deleted once the directory exceeds max_bytes
+
+    Args:
+        directory (str): the directory the responses are stored in
+        max_bytes (int): the maximum total size of the stored responses
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            with open(self.path(key), "rb") as f:
+                content = f.read()
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return None
+        return content
+
+    def set(self, key: str, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+        temporary_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently used files until the directory fits max_bytes"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        size_in_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if size_in_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size_in_bytes -= size
+
+
+class ResponseCache:
+    """Counts the hits and misses of a cache backend
+
+    Args:
+        backend (MemoryBackend | DjangoCacheBackend | FileBackend): stores the responses
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: str) -> bytes | None:
+        content = self.backend.get(key)
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def set(self, key: str, content: bytes) -> None:
+        self.backend.set(key, content)
+
+    async def set_when_done(self, key: str, content: Awaitable[bytes]) -> bytes:
+        """Awaits a response that is being generated and stores it"""
+        content = await content
+        self.set(key, content)
+        return content
+
+    def stats(self) -> dict[str, int | float]:
+        """Returns the number of hits, misses and revalidated requests and the hit ratio,
+        revalidated requests count as hits as their response was not generated again
+        """
+        hits = self.hits + self.not_modified
+        lookups = hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+        }
+
+
+def create_backend(backend: str):
+    """Creates the named cache backend configured by settings
+
+    Args:
+        backend (str): either 'memory', 'django' or 'file'
+
+    Returns:
+        MemoryBackend | DjangoCacheBackend | FileBackend: the created backend
+    """
+    max_bytes = settings.PERSON_RESPONSE_CACHE_MAX_BYTES
+    if backend == "memory":
+        return MemoryBackend(max_bytes)
+    if backend == "django":
+        return DjangoCacheBackend(settings.PERSON_RESPONSE_CACHE_ALIAS, max_bytes)
+    if backend == "file":
+        return FileBackend(str(settings.PERSON_RESPONSE_CACHE_DIRECTORY), max_bytes)
+    raise ValueError(f"{backend} is not a supported response cache backend")
+
+
+def get_response_cache() -> ResponseCache | None:
+    """Returns the response cache, created on first use from
+    settings.PERSON_RESPONSE_CACHE_BACKEND, or None when caching is disabled
+    """
+    global response_cache, response_cache_backend
+    backend = settings.PERSON_RESPONSE_CACHE_BACKEND
+    if backend is None:
+        return None
+    if response_cache is None or response_cache_backend != backend:
+        response_cache = ResponseCache(create_backend(backend))
+        response_cache_backend = backend
+    return response_cache
+
+
+def request_key(
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray,
+    context: GeneratorContext,
+    page: tuple[int, int] = None,
+    representation: tuple[str, bool] = None,
+) -> str:
+    """Computes the key of a seeded request from its normalized parameters
+
+    Args:
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The seeded random state of the request
+        page (tuple[int, int], optional): the offset and limit of a page of the request. Defaults to None.
+        representation (tuple[str, bool], optional): the media type and compactness of the body. Defaults to JSON.
+
+    Returns:
+        str: a hexadecimal digest identifying the response
+    """
+    normalized = {
+        "version": CACHE_VERSION,
+        "number": number,
+        "fields": sorted(input_fields),
+        "ages": [int(age_list.min()), int(age_list.max())]
+        if isinstance(age_list, np.ndarray) and len(age_list)
+        else None,
+        "seed": str(context.seed_sequence.entropy),
+        "reference_date": context.today.isoformat(),
+        "locales": context.locales,
+        "age_distribution": context.ages.key if context.ages is not None else None,
+        "page": page,
+        "representation": representation,
+    }
+    return hashlib.sha256(
+        ujson.dumps(normalized, sort_keys=True).encode("utf-8")
+    ).hexdigest()
@@ -0,0 +1,116 @@
+"""
+This file contains the compression of responses with the Content-Encoding negotiated
+from the Accept-Encoding header of a request, either br (brotli) or gzip.
+
+Encoded bodies are compressed at once, whilst streamed bodies are compressed chunk
+by chunk: every chunk is compressed and flushed as it is produced, so the client
+receives each chunk without waiting for the whole body and the compressor only ever
+holds its window rather than a buffer of the whole response.
+"""
+import gzip
+import zlib
+from typing import Iterator
+
+import brotli
+from django.conf import settings
+
+# The supported encodings in order of preference
+ENCODINGS = ("br", "gzip")
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """Picks the encoding of a response from the Accept-Encoding header of its request
+
+    Args:
+        accept_encoding (str): the header, for example 'gzip, deflate, br'
+
+    Returns:
+        str | None: either 'br' or 'gzip', None when neither is accepted
+    """
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, parameters = coding.strip().partition(";")
+        quality = 1.0
+        parameter, _, value = parameters.strip().partition("=")
+        if parameter.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    accepted = [
+        encoding
+        for encoding in ENCODINGS
+        if qualities.get(encoding, qualities.get("*", 0.0)) > 0
+    ]
+    if not accepted:
+        return None
+    return max(
+        accepted,
+        key=lambda encoding: qualities.get(encoding, qualities.get("*", 0.0)),
+    )
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compresses a whole body with the given encoding"""
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.PERSON_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.PERSON_GZIP_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """Compresses a body chunk by chunk, each compressed chunk can be decompressed
+    as soon as it is received
+
+    Args:
+        encoding (str): either 'br' or 'gzip'
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=settings.PERSON_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(
+                settings.PERSON_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compresses a chunk and flushes it"""
+        if self.encoding == "br":
+            return self.compressor.process(chunk) + self.compressor.flush()
+        return self.compressor.compress(chunk) + self.compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        """Ends the compressed body"""
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+def compress_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    """Compresses a streamed body chunk by chunk, closing the stream when closed
+
+    Args:
+        chunks (Iterator[bytes]): the chunks of the body
+        encoding (str): either 'br' or 'gzip'
+
+    Yields:
+        bytes: the compressed chunks
+    """
+    compressor = StreamCompressor(encoding)
+    chunks = iter(chunks)
+    try:
+        for chunk in chunks:
+            if chunk:
+                compressed = compressor.compress(chunk)
+                if compressed:
+                    yield compressed
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
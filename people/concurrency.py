@@ -0,0 +1,305 @@
+"""
+This file contains the admission control and the executor of request generation.
+
+The generation of a request is CPU bound, so it runs on a bounded pool of threads
+rather than on the event loop, which stays free to accept and answer other
+requests. Requests are admitted by a semaphore counting the rows being generated:
+a request waits until its rows fit within PERSON_ADMISSION_ROWS, at most
+PERSON_ADMISSION_QUEUE requests wait at once and none waits longer than
+PERSON_ADMISSION_TIMEOUT. Requests beyond these limits are turned away with 429 or
+503 and a Retry-After header rather than queued without bound.
+
+When a client disconnects, CancelOnDisconnect cancels the task handling its request
+and the generation thread stops at the next column or chunk, see check_cancelled.
+This also holds whilst a response is streamed, as every chunk of a streamed body
+is produced on the executor by OffloadedStream.
+"""
+import asyncio
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from django.conf import settings
+
+# The mean number of dependents per person, see provide_dependent_counts in people/providers.py
+MEAN_DEPENDENTS = 1.5
+
+admission = None
+cpu_executor = None
+
+# The event that is set once the request of the current generation thread is cancelled
+cancel_event = contextvars.ContextVar("cancel_event", default=None)
+
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted
+
+    Args:
+        status (int): either 429 when too many requests are waiting or 503 when the wait timed out
+        retry_after (int): the seconds after which the client may retry
+    """
+
+    def __init__(self, status: int, retry_after: int):
+        super().__init__(status, retry_after)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class GenerationCancelled(Exception):
+    """Raised within a generation thread whose request has been cancelled"""
+
+
+class RowAdmission:
+    """A semaphore whose permits are rows, requests are admitted in order of arrival
+    once the rows they request fit alongside the rows of the admitted requests.
+    A request larger than the capacity is admitted alone
+
+    Args:
+        capacity (int): the number of rows that may be generated at once
+        max_waiting (int): the number of requests that may wait for admission
+        timeout (float): the seconds a request may wait for admission
+        retry_after (int): the seconds after which a turned away client may retry
+    """
+
+    def __init__(
+        self, capacity: int, max_waiting: int, timeout: float, retry_after: int
+    ):
+        self.capacity = capacity
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = deque()
+        self.lock = threading.Lock()
+
+    async def acquire(self, rows: int) -> int:
+        """Waits until a request is admitted
+
+        Args:
+            rows (int): the number of rows of the request
+
+        Raises:
+            Overloaded: if too many requests are waiting or the wait timed out
+
+        Returns:
+            int: the permits held by the request, to be given back to release
+        """
+        rows = max(1, min(rows, self.capacity))
+        with self.lock:
+            if not self.waiting and self.in_flight + rows <= self.capacity:
+                self.in_flight += rows
+                return rows
+            if len(self.waiting) >= self.max_waiting:
+                raise Overloaded(429, self.retry_after)
+            waiter = (rows, asyncio.get_running_loop().create_future())
+            self.waiting.append(waiter)
+
+        try:
+            await asyncio.wait_for(waiter[1], self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            with self.lock:
+                admitted = waiter not in self.waiting
+                if not admitted:
+                    self.waiting.remove(waiter)
+            if admitted:
+                self.release(rows)
+            if isinstance(error, asyncio.TimeoutError):
+                raise Overloaded(503, self.retry_after) from None
+            raise
+        return rows
+
+    def release(self, rows: int) -> None:
+        """Gives back the permits of a request and admits the waiting requests that fit"""
+        with self.lock:
+            self.in_flight -= rows
+            while self.waiting and (
+                self.in_flight == 0
+                or self.in_flight + self.waiting[0][0] <= self.capacity
+            ):
+                waiting_rows, future = self.waiting.popleft()
+                self.in_flight += waiting_rows
+                future.get_loop().call_soon_threadsafe(admit, future)
+
+    def stats(self) -> dict[str, int]:
+        """Returns the rows being generated and the number of waiting requests"""
+        with self.lock:
+            return {"in_flight_rows": self.in_flight, "waiting": len(self.waiting)}
+
+
+def admit(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def get_admission() -> RowAdmission:
+    """Returns the admission semaphore of this process, created on first use"""
+    global admission
+    if admission is None:
+        admission = RowAdmission(
+            settings.PERSON_ADMISSION_ROWS,
+            settings.PERSON_ADMISSION_QUEUE,
+            settings.PERSON_ADMISSION_TIMEOUT,
+            settings.PERSON_RETRY_AFTER,
+        )
+    return admission
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Returns the pool of PERSON_CPU_WORKERS threads requests are generated on"""
+    global cpu_executor
+    if cpu_executor is None:
+        cpu_executor = ThreadPoolExecutor(
+            max_workers=settings.PERSON_CPU_WORKERS, thread_name_prefix="generation"
+        )
+    return cpu_executor
+
+
+def requested_rows(request_body: dict) -> int:
+    """Estimates the rows a request generates, dependents included, from its unvalidated body"""
+    if not isinstance(request_body, dict):
+        return 1
+    specs = request_body.get("requests")
+    if isinstance(specs, list):
+        # The specs of a batch request, see people/multiplex.py
+        return sum(requested_rows(spec) for spec in specs)
+    number = request_body.get("number")
+    if not isinstance(number, int) or isinstance(number, bool) or number < 1:
+        return 1
+    if any(field in request_body for field in ("offset", "limit", "cursor")):
+        # Only the rows of a page are generated, see people/pages.py
+        limit = request_body.get("limit", settings.REST_FRAMEWORK["PAGE_SIZE"])
+        if isinstance(limit, int) and not isinstance(limit, bool):
+            number = min(number, max(limit, 1))
+    fields = request_body.get("fields")
+    if isinstance(fields, list) and "dependents" in fields:
+        return int(number * (1 + MEAN_DEPENDENTS))
+    return number
+
+
+async def run_cpu(function: Callable, *args):
+    """Runs a function on the CPU executor within a copy of the current context.
+    Should the awaiting task be cancelled, the function is told to stop through
+    check_cancelled as the thread itself cannot be interrupted
+
+    Args:
+        function (Callable): the function to run
+        args: the arguments of the function
+
+    Returns:
+        the result of the function
+    """
+    cancelled = threading.Event()
+    context = contextvars.copy_context()
+    context.run(cancel_event.set, cancelled)
+    future = asyncio.get_running_loop().run_in_executor(
+        get_cpu_executor(), context.run, function, *args
+    )
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        raise
+
+
+def check_cancelled() -> None:
+    """Raises GenerationCancelled if the request of the current thread was cancelled"""
+    cancelled = cancel_event.get()
+    if cancelled is not None and cancelled.is_set():
+        raise GenerationCancelled()
+
+
+class CancelOnDisconnect:
+    """ASGI middleware cancelling the handling of a HTTP request once its client
+    disconnects. Django reads the whole body of a request before calling the view and
+    does not listen to the connection afterwards, so the middleware listens from then on
+
+    Args:
+        application: the wrapped ASGI application
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.application(scope, receive, send)
+
+        body_received = asyncio.Event()
+        disconnected = False
+
+        async def receive_body():
+            message = await receive()
+            if message["type"] == "http.disconnect" or not message.get(
+                "more_body", False
+            ):
+                body_received.set()
+            return message
+
+        handler = asyncio.ensure_future(self.application(scope, receive_body, send))
+
+        async def watch():
+            nonlocal disconnected
+            await body_received.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    handler.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
+
+
+class OffloadedStream:
+    """Iterates a streamed response body and releases the admission of its request
+    once Django closes the response, whether or not the body was fully sent. When
+    iterated asynchronously, as by people/streaming.py, every chunk is produced on
+    the CPU executor rather than on the event loop
+
+    Args:
+        content (Iterator[bytes]): the streamed body
+        rows (int): the permits held by the request
+    """
+
+    def __init__(self, content, rows: int):
+        self.content = iter(content)
+        self.rows = rows
+        self.released = False
+        # Held whilst a chunk is produced, so that the stream is only closed once
+        # a generation thread told to stop by check_cancelled has stopped
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        with self.lock:
+            return next(self.content)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        chunk = await run_cpu(next, self, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self) -> None:
+        with self.lock:
+            close = getattr(self.content, "close", None)
+            if close is not None:
+                close()
+        if not self.released:
+            self.released = True
+            get_admission().release(self.rows)
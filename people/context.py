@@ -0,0 +1,246 @@
+"""
+This file contains the per request random state used to generate synthetic people.
+
+A GeneratorContext owns a numpy SeedSequence from which every source of randomness
+of a request is derived, the faker value pools the rows draw from being the same for
+every request, see people/pools.py. Rows are addressable, every random value of row
+i is drawn from a Philox generator keyed by the seed, the field and the draw, whose
+counter is i. A row therefore only depends on the seed and its index, so the same
+seed produces identical output whether the rows are generated at once, in chunks,
+streamed, spread over several workers or requested a page at a time, and any row
+can be generated on its own.
+
+A context may also carry the locales of a request, the weights with which each row
+is assigned a faker locale, see provide_locale in people/providers.py, and the
+distribution the ages of its people are drawn from, see people/distributions.py.
+"""
+import threading
+import zlib
+from datetime import date
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from faker import Faker
+
+    from people.distributions import AgeDistribution
+
+CHUNK_SIZE = 10000
+
+ROW_KEY = 0
+DEPENDENT_KEY = 2
+
+# The number of 64 bit words in a Philox block, the block at counter c holds the
+# words of rows 4c to 4c + 3
+WORDS_PER_BLOCK = 4
+
+# The position of a draw within a field is held in the upper 64 bits of the 256 bit
+# Philox counter, above the block of the row
+DRAW_COUNTER_SHIFT = 192
+
+# The dependents of a person are addressed as the rows DEPENDENT_STRIDE * i to
+# DEPENDENT_STRIDE * i + DEPENDENT_STRIDE - 1, so a person has fewer dependents
+DEPENDENT_STRIDE = 4
+
+ROW_KEY_CACHE_SIZE = 4096
+
+local_state = threading.local()
+
+
+def thread_faker(locale: str = None) -> "Faker":
+    """Returns the faker instance of the current thread for a locale, faker instances
+    are costly to construct so one is kept per thread and locale and reseeded before
+    every use. Faker is only imported here as importing it slows down the start of
+    every process
+
+    Args:
+        locale (str, optional): a faker locale such as 'de_DE'. Defaults to faker's default locale.
+
+    Returns:
+        Faker: the faker instance of the current thread
+    """
+    fakers = getattr(local_state, "fakers", None)
+    if fakers is None:
+        fakers = local_state.fakers = {}
+    faker = fakers.get(locale)
+    if faker is None:
+        from faker import Faker
+
+        faker = fakers[locale] = Faker(locale)
+    return faker
+
+
+@lru_cache(maxsize=ROW_KEY_CACHE_SIZE)
+def row_key(entropy: int, spawn_key: tuple[int], field: str) -> np.ndarray:
+    """Derives the Philox key of a field from the seed sequence of a context, keys
+    are memoized as deriving one costs more than generating a small batch's column
+    """
+    return np.random.SeedSequence(
+        entropy, spawn_key=spawn_key + (ROW_KEY, zlib.crc32(field.encode("utf-8")))
+    ).generate_state(2, np.uint64)
+
+
+class RowGenerator:
+    """Draws the random values of the rows of a batch for a single field, a subset of
+    the numpy Generator interface. Each draw uses a numpy Generator on a Philox bit
+    generator keyed by the seed and the field, whose counter holds the position of
+    the draw in its upper bits and the index of the first row in its lower bits, so
+    that the value of a row does not depend on the other rows of the batch. Providers
+    must therefore draw unconditionally and in the same order, and draw one value per row
+
+    Args:
+        key (np.ndarray): the Philox key of the field, see row_key
+        start (int): the index of the first addressed row
+        span (int): the number of addressed rows from start
+        rows (np.ndarray, optional): the addressed rows of the batch, relative to start. Defaults to every row.
+    """
+
+    def __init__(
+        self,
+        key: np.ndarray,
+        start: int,
+        span: int,
+        rows: np.ndarray = None,
+    ):
+        self.key = key
+        self.start = start
+        self.span = span
+        self.rows = rows
+        self.number = span if rows is None else len(rows)
+        self.draws = 0
+
+    def uniforms(self, size: int = None) -> np.ndarray:
+        """Draws a float in [0, 1) per row of the batch"""
+        if size is not None and size != self.number:
+            raise ValueError(f"Draws are of one value per row, not of {size} values")
+        block, skip = divmod(self.start, WORDS_PER_BLOCK)
+        counter = block + (self.draws << DRAW_COUNTER_SHIFT)
+        self.draws += 1
+        generator = np.random.Generator(np.random.Philox(key=self.key, counter=counter))
+        values = generator.random(skip + self.span)[skip:]
+        return values if self.rows is None else values[self.rows]
+
+    def random(self, size: int = None) -> np.ndarray:
+        return self.uniforms(size)
+
+    def integers(self, low: int, high: int = None, size: int = None) -> np.ndarray:
+        """Draws an integer in [low, high) per row, or in [0, low) when high is omitted"""
+        if high is None:
+            low, high = 0, low
+        return low + (self.uniforms(size) * (high - low)).astype(np.int64)
+
+    def choice(
+        self, a: int | np.ndarray, size: int = None, p: np.ndarray = None
+    ) -> np.ndarray:
+        """Draws an element of a per row, with the probabilities p when given"""
+        a = np.arange(a) if isinstance(a, int) else np.asarray(a)
+        if p is None:
+            return a[self.integers(0, len(a), size)]
+        indices = np.searchsorted(np.cumsum(p), self.uniforms(size), side="right")
+        return a[np.minimum(indices, len(a) - 1)]
+
+
+class GeneratorContext:
+    """The random state of a single request, or of some of its rows
+
+    Args:
+        seed (int, optional): the seed of the request, a random seed is used when omitted. Defaults to None.
+        today (date, optional): the date that ages and birthdates are relative to. Defaults to today.
+        seed_sequence (np.random.SeedSequence, optional): used in place of seed when deriving a context. Defaults to None.
+        locales (dict[str, float], optional): the normalized weight of each faker locale. Defaults to faker's default locale.
+        ages (AgeDistribution, optional): the distribution of the ages of the people. Defaults to uniformly distributed birthdates.
+        start (int, optional): the index of the first row of the context. Defaults to 0.
+        span (int, optional): the number of addressed rows from start when rows is given. Defaults to None.
+        rows (np.ndarray, optional): the addressed rows of the context, relative to start. Defaults to consecutive rows.
+    """
+
+    def __init__(
+        self,
+        seed: int = None,
+        today: date = None,
+        seed_sequence: np.random.SeedSequence = None,
+        locales: dict[str, float] = None,
+        ages: "AgeDistribution" = None,
+        start: int = 0,
+        span: int = None,
+        rows: np.ndarray = None,
+    ):
+        self.seed_sequence = seed_sequence or np.random.SeedSequence(seed)
+        self.today = today or date.today()
+        self.seeded = seed is not None
+        self.locales = locales
+        self.ages = ages
+        self.start = start
+        self.span = span
+        self.rows = rows
+
+    def derive(self, *key: int) -> np.random.SeedSequence:
+        """Derives an independent seed sequence from this context for the given key"""
+        return np.random.SeedSequence(
+            self.seed_sequence.entropy,
+            spawn_key=self.seed_sequence.spawn_key + key,
+        )
+
+    def at(self, start: int) -> "GeneratorContext":
+        """Returns the context of the rows of the request from the given index
+
+        Args:
+            start (int): the index of the first row, such as the first row of a chunk or page
+
+        Returns:
+            GeneratorContext: a context whose rows only depend on the seed and their index
+        """
+        context = GeneratorContext(
+            today=self.today,
+            seed_sequence=self.seed_sequence,
+            locales=self.locales,
+            ages=self.ages,
+            start=self.start + start,
+        )
+        context.seeded = self.seeded
+        return context
+
+    def dependents(self, counts: np.ndarray) -> "GeneratorContext":
+        """Returns the context of the dependents of consecutive rows, dependent j of
+        row i is addressed as row DEPENDENT_STRIDE * i + j of the dependents
+
+        Args:
+            counts (np.ndarray): the number of dependents of each row of this context
+
+        Returns:
+            GeneratorContext: a context of counts.sum() rows, in the order of their parents
+        """
+        first_dependents = np.repeat(np.cumsum(counts) - counts, counts)
+        parents = np.repeat(np.arange(len(counts)), counts)
+        context = GeneratorContext(
+            today=self.today,
+            seed_sequence=self.derive(DEPENDENT_KEY),
+            locales=self.locales,
+            ages=self.ages,
+            start=self.start * DEPENDENT_STRIDE,
+            span=len(counts) * DEPENDENT_STRIDE,
+            rows=parents * DEPENDENT_STRIDE
+            + np.arange(int(counts.sum()))
+            - first_dependents,
+        )
+        context.seeded = self.seeded
+        return context
+
+    def row_generator(self, field: str, number: int) -> RowGenerator:
+        """Returns the generator of the values of a field for the rows of a batch
+
+        Args:
+            field (str): the name of the field, or of an internal column
+            number (int): the number of rows of the batch, when the rows are consecutive
+
+        Returns:
+            RowGenerator: a generator whose draws hold a value per row
+        """
+        return RowGenerator(
+            row_key(self.seed_sequence.entropy, self.seed_sequence.spawn_key, field),
+            self.start,
+            number if self.rows is None else self.span,
+            self.rows,
+        )
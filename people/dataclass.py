@@ -1,198 +1,127 @@
-import os
-import csv
-from dataclasses import dataclass, field, asdict
-from pprint import pprint
-from datetime import date, timedelta
-from dateutil.relativedelta import relativedelta
-
-from django.conf import settings
-from faker import Faker
-import pycountry
-import numpy as np
-
-from people.fields import (
-    MANDATORY_FIELDS,
-    OUTPUT_TO_INPUT_FIELD_MAPPING,
-    INPUT_TO_OUTPUT_FIELD_MAPPING,
-)
-
-csv_path = os.path.join(settings.BASE_DIR, "demonyms.csv")
-with open(csv_path, "r") as f:
-    contents = csv.reader(f)
-    nationalities = {x[1]: x[0] for x in contents}
-list_nationalities = list(nationalities.values())
-
-generator = Faker()
-
-
-@dataclass
-class Person:
-    """
-    A dataclass that represents a person, attributes and helper methods are specified
-    """
-
-    skeleton: dict = field(init=True)
-    fields: list = field(init=True)
-
-    name: str = field(default=None)
-    email: str = field(default=None)
-    birthdate: date = field(default=None)
-
-    gender: str = field(default=None)
-    age: int = field(default=None)
-    deceased: bool = field(default=None)
-
-    address: str = field(init=False, default=None)
-    phone: str = field(init=False, default=None)
-    occupation: str = field(init=False, default=None)
-
-    country: str = field(init=False, default=None)
-    nationality: str = field(init=False, default=None)
-
-    dependents: list = field(default=None)
-
-    def __post_init__(self):
-        """
-        Invoked after dataclass initialization, iterates over the dictionary of attributes
-        specified for this instance and ensures they are initialized through the use of
-        the helper methods
-        """
-        for key, value in self.skeleton.items():
-            attribute_name = OUTPUT_TO_INPUT_FIELD_MAPPING.get(key)
-            if attribute_name is None:
-                attribute_name = key
-            setattr(self, attribute_name, value)
-
-        for attr in self.fields:
-            if not getattr(self, attr):
-                try:
-                    getattr(self, f"create_{attr}")()
-                except AttributeError as exception:
-                    print(
-                        f"\nAttempted to set attribute {attr}\nException:\n{exception}\n"
-                    )
-
-        self.skeleton = None
-        self.fields = None
-
-    def create_age(self) -> None:
-        """
-        Creates the age attribute by accounting for birthdate of this instance
-        """
-        today = date.today()
-        self.age = (
-            today.year
-            - self.birthdate.year
-            - ((today.month, today.day) < (self.birthdate.month, self.birthdate.day))
-        )
+from typing import Iterator
 
-    def create_deceased(self):
-        """
-        Human age in the context of of this API is constrained to 0 <= 𝑥 <= 120
-        Evaluating the sin((π/240)*𝑥) gives the probability of an individual being deceased
-        """
-        if not getattr(self, "age"):
-            self.create_age()
-        probability_deceased = np.sin((np.pi / 240) * self.age)
-        self.deceased = np.random.choice(
-            [True, False], p=[probability_deceased, 1 - probability_deceased]
-        )
-
-    def create_phone(self) -> None:
-        """
-        Randomly generates a string phone number
-        """
-        self.phone = generator.phone_number()
-
-    def create_occupation(self) -> None:
-        """
-        Creates a occupation based on this instances age
-        """
-        if not getattr(self, "age"):
-            self.create_age()
-        occupation = generator.job()
-        if self.age < 16:
-            occupation = "Student"
-        elif self.age < 24:
-            occupation = np.random.choice(["Student", occupation], p=[0.7, 0.3])
-        self.occupation = occupation
-
-    def create_country(self) -> None:
-        """
-        If this instance has an address attribute, use the two letter code
-        to deduce the country else generate the country randomly
-        """
-        country_data = None
-        if getattr(self, "address"):
-            two_letter_code = self.address.split()[-2]
-            country_data = pycountry.countries.get(alpha_2=two_letter_code)
-        self.country = country_data.name if country_data else generator.country()
-
-    def create_nationality(self) -> None:
-        """
-        Assign this attributes nationality to either the country of residence or randomly
-        """
-        if not getattr(self, "country"):
-            self.create_country()
-        country_nationality = nationalities[self.country]
-        random_nationality = np.random.choice(list_nationalities)
-        self.nationality = np.random.choice(
-            [country_nationality, random_nationality], p=[0.7, 0.3]
-        )
-
-    def create_dependents(self) -> None:
-        """
-        Upon invocation a random number of people are assigned as dependents of this instance
-        """
-        number_of_dependents = np.random.choice(np.arange(4))
-        copy_fields = list(self.fields)
-        copy_fields.remove("dependents")
-        if "birthdate" not in copy_fields:
-            copy_fields.append("birthdate")
-        if getattr(self, "age") and "age" not in copy_fields:
-            copy_fields.append("age")
-
-        output_fields = []
-        for field in copy_fields:
-            potential = field
-            if field in INPUT_TO_OUTPUT_FIELD_MAPPING.keys():
-                potential = INPUT_TO_OUTPUT_FIELD_MAPPING[field]
-            output_fields.append(potential)
-
-        self.dependents = generate_persons(
-            number_of_dependents, copy_fields, output_fields
-        )
+from people.batch import PersonBatch, generate_batch
+from people.concurrency import check_cancelled
+from people.context import CHUNK_SIZE, GeneratorContext
+from people.exporters import write_export
+from people.pools import ValuePools, request_pools
 
 
 def generate_persons(
     number: int,
     input_fields: list[str],
-    output_fields: list[str],
+    *,
     age_list: list[int] = None,
+    context: GeneratorContext = None,
 ) -> list[dict]:
-    """Creates a list of synthetic person entries
+    """Creates a list of synthetic person entries, every field is generated
+    for the whole batch at once by the columnar engine in people.batch
 
     Args:
         number (int): The number of entries generated
         input_fields (list[str]): A list of desired fields as specified by the user input
-        output_fields (list[str]): A list of desired fields conforming to the faker specification
         age_list (list[int], optional): A numpy 1 dimensional array outlining the potential age range as specified by the user. Defaults to None.
+        context (GeneratorContext, optional): The random state of the request, seeded contexts give reproducible entries. Defaults to an unseeded context.
 
     Returns:
         list[dict]: a list of generated data
     """
     people = []
-    dictionary_factory = lambda x: {k: v for (k, v) in x if v is not None}
-    for i in range(number):
-        skeleton = generator.profile(fields=output_fields)
+    for chunk in iter_persons(number, input_fields, age_list=age_list, context=context):
+        people.extend(chunk.to_records())
+    return people
 
-        if isinstance(age_list, np.ndarray):
-            age = np.random.choice(age_list)
-            skeleton["age"] = age
-            skeleton["birthdate"] = date.today() - relativedelta(years=age)
 
-        person = Person(skeleton=skeleton, fields=input_fields)
+def export_persons(
+    number: int,
+    input_fields: list[str],
+    export_format: str,
+    path: str,
+    age_list: list[int] = None,
+    context: GeneratorContext = None,
+) -> None:
+    """Writes synthetic person entries to a tabular file chunk by chunk,
+    see people/exporters.py for the layout of each format
+
+    Args:
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        export_format (str): either 'csv', 'arrow' or 'npz'
+        path (str): the path of the written file
+        age_list (list[int], optional): A numpy 1 dimensional array outlining the potential age range as specified by the user. Defaults to None.
+        context (GeneratorContext, optional): The random state of the request, seeded contexts give reproducible entries. Defaults to an unseeded context.
+    """
+    write_export(
+        iter_persons(number, input_fields, age_list=age_list, context=context),
+        export_format,
+        path,
+    )
 
-        people.append(asdict(person, dict_factory=dictionary_factory))
 
-    return people
+def iter_persons(
+    number: int,
+    input_fields: list[str],
+    *,
+    age_list: list[int] = None,
+    context: GeneratorContext = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[PersonBatch]:
+    """Lazily creates synthetic person entries in chunks, so that only a single chunk
+    is held in memory at a time, the faker value pools are shared by every chunk.
+    Chunks are columnar batches that only become dictionaries when they are encoded.
+    Every row is addressed by its index, so for a given seed the entries do not
+    depend on the chunk size or on how the chunks are consumed
+
+    Args:
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (list[int], optional): A numpy 1 dimensional array outlining the potential age range as specified by the user. Defaults to None.
+        context (GeneratorContext, optional): The random state of the request, seeded contexts give reproducible entries. Defaults to an unseeded context.
+        chunk_size (int, optional): The maximum number of entries per chunk. Defaults to CHUNK_SIZE.
+
+    Yields:
+        PersonBatch: a chunk of generated data
+    """
+    if context is None:
+        context = GeneratorContext()
+    pools = request_pools(context)
+    for index in range(-(-number // chunk_size)):
+        check_cancelled()
+        yield generate_chunk(
+            index, number, input_fields, age_list, pools, context, chunk_size
+        )
+
+
+def generate_chunk(
+    index: int,
+    number: int,
+    input_fields: list[str],
+    age_list: list[int],
+    pools: ValuePools,
+    context: GeneratorContext,
+    chunk_size: int = CHUNK_SIZE,
+) -> PersonBatch:
+    """Creates the entries of a single chunk of a request, the chunk only depends on the
+    indices of its rows and the context so chunks can be generated in any order or in
+    other processes
+
+    Args:
+        index (int): The position of the chunk within the request
+        number (int): The number of entries of the whole request
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (list[int]): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        pools (ValuePools): The value pools of the request
+        context (GeneratorContext): The random state of the whole request
+        chunk_size (int, optional): The maximum number of entries per chunk. Defaults to CHUNK_SIZE.
+
+    Returns:
+        PersonBatch: the generated data of the chunk
+    """
+    start = index * chunk_size
+    return generate_batch(
+        min(chunk_size, number - start),
+        input_fields,
+        age_list,
+        pools,
+        context.at(start),
+    )
@@ -0,0 +1,151 @@
+"""
+This file contains the vectorized derivations of the age related fields.
+
+Each function takes the arrays of a whole batch and returns a column in a single
+numpy pass, they are used by the batch engine and can also be called directly.
+"""
+from datetime import date
+
+import numpy as np
+
+EXCLUSIVE_UPPER_AGE_LIMIT = 115
+
+STUDENT_AGE_LIMIT = 16
+
+YOUNG_ADULT_AGE_LIMIT = 24
+
+YOUNG_ADULT_STUDENT_PROBABILITY = 0.7
+
+
+def date_parts(dates: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Splits a datetime64[D] array into its year, month and day components"""
+    months = dates.astype("datetime64[M]")
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    month_numbers = months.astype(int) % 12 + 1
+    days = (dates - months.astype("datetime64[D]")).astype(int) + 1
+    return years, month_numbers, days
+
+
+def ages_from_birthdates(birthdates: np.ndarray, today: date = None) -> np.ndarray:
+    """Computes the age in whole years of each birthdate
+
+    Args:
+        birthdates (np.ndarray): a datetime64[D] array of birthdates
+        today (date, optional): the date the ages are computed on. Defaults to today.
+
+    Returns:
+        np.ndarray: an integer array of ages
+    """
+    today = today or date.today()
+    years, months, days = date_parts(birthdates)
+    before_birthday = (today.month < months) | (
+        (today.month == months) & (today.day < days)
+    )
+    return today.year - years - before_birthday
+
+
+def birthdates_from_ages(ages: np.ndarray, today: date = None) -> np.ndarray:
+    """Computes the birthdates of people who are exactly `ages` years old today,
+    the 29th of February is clamped to the 28th in common years as relativedelta does
+
+    Args:
+        ages (np.ndarray): an integer array of ages
+        today (date, optional): the date the birthdates are relative to. Defaults to today.
+
+    Returns:
+        np.ndarray: a datetime64[D] array of birthdates
+    """
+    today = today or date.today()
+    months = (today.year - ages - 1970) * 12 + (today.month - 1)
+    month_starts = months.astype("datetime64[M]").astype("datetime64[D]")
+    next_month_starts = (months + 1).astype("datetime64[M]").astype("datetime64[D]")
+    month_lengths = (next_month_starts - month_starts).astype(int)
+    return month_starts + np.minimum(today.day, month_lengths) - 1
+
+
+def birthdates_within_ages(
+    ages: np.ndarray, today: date = None, rng: np.random.Generator = None
+) -> np.ndarray:
+    """Draws the birthdate of each person uniformly among the days on which they
+    would be `ages` years old today, as a day offset from their latest such birthdate
+
+    Args:
+        ages (np.ndarray): an integer array of ages
+        today (date, optional): the date the birthdates are relative to. Defaults to today.
+        rng (np.random.Generator, optional): the generator the offsets are drawn from. Defaults to an unseeded generator.
+
+    Returns:
+        np.ndarray: a datetime64[D] array of birthdates
+    """
+    today = today or date.today()
+    rng = rng or np.random.default_rng()
+    ages = np.asarray(ages)
+    latest = birthdates_from_ages(ages, today)
+    spans = (latest - birthdates_from_ages(ages + 1, today)).astype(np.int64)
+    offsets = (rng.random(len(ages)) * spans).astype(np.int64)
+    return latest - offsets
+
+
+def random_birthdates(
+    number: int, today: date = None, rng: np.random.Generator = None
+) -> np.ndarray:
+    """Generates birthdates uniformly between EXCLUSIVE_UPPER_AGE_LIMIT years ago and today,
+    which is the same range used by faker's date_of_birth
+
+    Args:
+        number (int): the number of birthdates
+        today (date, optional): the latest possible birthdate. Defaults to today.
+        rng (np.random.Generator, optional): the generator the dates are drawn from. Defaults to an unseeded generator.
+
+    Returns:
+        np.ndarray: a datetime64[D] array of birthdates
+    """
+    today = today or date.today()
+    rng = rng or np.random.default_rng()
+    earliest = birthdates_from_ages(np.array([EXCLUSIVE_UPPER_AGE_LIMIT]), today)[0]
+    span = int((np.datetime64(today) - earliest).astype(int))
+    offsets = rng.integers(0, span + 1, size=number)
+    return np.datetime64(today) - offsets
+
+
+def deceased_from_ages(ages: np.ndarray, rng: np.random.Generator = None) -> np.ndarray:
+    """Decides whether each person is deceased, human age in the context of this API
+    is constrained to 0 <= 𝑥 <= 120 and sin((π/240)*𝑥) gives the probability of an
+    individual of age 𝑥 being deceased, rising from 0 at birth to 0.5 at 40 and to
+    1 at 120
+
+    Args:
+        ages (np.ndarray): an integer array of ages
+        rng (np.random.Generator, optional): the generator the outcomes are drawn from. Defaults to an unseeded generator.
+
+    Returns:
+        np.ndarray: a boolean array, True where the person is deceased
+    """
+    rng = rng or np.random.default_rng()
+    probability_deceased = np.sin((np.pi / 240) * np.asarray(ages))
+    return rng.random(len(probability_deceased)) < probability_deceased
+
+
+def occupations_from_ages(
+    ages: np.ndarray, jobs: np.ndarray, rng: np.random.Generator = None
+) -> np.ndarray:
+    """Assigns an occupation to each person based on their age, people younger than
+    STUDENT_AGE_LIMIT are students, those younger than YOUNG_ADULT_AGE_LIMIT are
+    students with a probability of YOUNG_ADULT_STUDENT_PROBABILITY and everyone
+    else holds the job that was drawn for them
+
+    Args:
+        ages (np.ndarray): an integer array of ages
+        jobs (np.ndarray): an object array holding a random job title per person
+        rng (np.random.Generator, optional): the generator the outcomes are drawn from. Defaults to an unseeded generator.
+
+    Returns:
+        np.ndarray: an object array of occupations
+    """
+    rng = rng or np.random.default_rng()
+    ages = np.asarray(ages)
+    is_student = (ages < STUDENT_AGE_LIMIT) | (
+        (ages < YOUNG_ADULT_AGE_LIMIT)
+        & (rng.random(len(ages)) < YOUNG_ADULT_STUDENT_PROBABILITY)
+    )
+    return np.where(is_student, "Student", np.asarray(jobs, dtype=object))
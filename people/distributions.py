@@ -0,0 +1,139 @@
+"""
+This file contains the age distributions people are generated from.
+
+An AgeDistribution holds the probability of every whole age below
+EXCLUSIVE_UPPER_AGE_LIMIT. The ages of a whole batch are sampled at once by inverse
+transform sampling: a uniform number is drawn per row and located within the
+cumulative distribution with np.searchsorted, so a distribution costs the same to
+sample whatever its shape. The birthdate of each person is then drawn uniformly
+among the days on which they would be that age, see birthdates_within_ages in
+people/derivations.py.
+
+Distributions are either named, such as the population pyramids of AGE_PYRAMIDS,
+or a histogram of age bands supplied with a request.
+"""
+from functools import cache
+
+import numpy as np
+
+from people.derivations import EXCLUSIVE_UPPER_AGE_LIMIT
+
+# Approximate population pyramids, the share of the population within each five
+# year band of ages from 0 to 4, 5 to 9 and so on, the last band holds the ages
+# from 100 to EXCLUSIVE_UPPER_AGE_LIMIT - 1
+PYRAMID_EDGES = tuple(range(0, 105, 5)) + (EXCLUSIVE_UPPER_AGE_LIMIT,)
+
+# fmt: off
+AGE_PYRAMIDS = {
+    "world": (
+        8.6, 8.5, 8.2, 7.9, 7.6, 7.6, 7.8, 7.2, 6.5, 6.1, 5.6,
+        4.9, 4.1, 3.4, 2.6, 1.6, 1.0, 0.5, 0.2, 0.05, 0.01,
+    ),
+    "europe": (
+        4.7, 5.1, 5.2, 5.1, 5.4, 5.8, 6.3, 6.6, 6.8, 7.2, 7.3,
+        7.0, 6.2, 5.6, 5.0, 3.7, 2.9, 1.8, 0.8, 0.2, 0.03,
+    ),
+}
+# fmt: on
+
+DISTRIBUTION_NAMES = ("uniform",) + tuple(AGE_PYRAMIDS)
+
+
+class AgeDistribution:
+    """The probability of each whole age from 0 to EXCLUSIVE_UPPER_AGE_LIMIT - 1
+
+    Args:
+        weights (np.ndarray): the relative weight of each age, which must not all be 0
+        key (tuple): identifies the distribution in cache keys and batch groups
+    """
+
+    def __init__(self, weights: np.ndarray, key: tuple):
+        weights = np.asarray(weights, dtype=float)
+        self.probabilities = weights / weights.sum()
+        self.cdf = np.cumsum(self.probabilities)
+        self.cdf[-1] = 1.0
+        self.key = key
+
+    def restrict(self, age_list: np.ndarray) -> "AgeDistribution":
+        """Conditions the distribution on the age limits of a request
+
+        Args:
+            age_list (np.ndarray): the potential ages as specified by the user
+
+        Raises:
+            ValueError: if none of the potential ages is probable
+
+        Returns:
+            AgeDistribution: the distribution of the potential ages only
+        """
+        weights = np.zeros_like(self.probabilities)
+        weights[age_list] = self.probabilities[age_list]
+        if not weights.any():
+            raise ValueError("None of the ages within the limits is probable")
+        return AgeDistribution(
+            weights, self.key + (int(age_list.min()), int(age_list.max()))
+        )
+
+    def sample(self, number: int, rng: np.random.Generator) -> np.ndarray:
+        """Draws the ages of a batch by inverse transform sampling, ages without any
+        probability are never drawn
+
+        Args:
+            number (int): the number of ages
+            rng (np.random.Generator): the generator the uniform numbers are drawn from
+
+        Returns:
+            np.ndarray: an integer array of ages
+        """
+        ages = np.searchsorted(self.cdf, rng.random(number), side="right")
+        return np.minimum(ages, len(self.cdf) - 1)
+
+
+def histogram(edges: list[int], weights: list[float], key: tuple) -> AgeDistribution:
+    """Builds a distribution from the weights of age bands, the ages within a band
+    are equally likely
+
+    Args:
+        edges (list[int]): the increasing bounds of the bands, band i holds the ages from edges[i] to edges[i + 1] - 1
+        weights (list[float]): the relative weight of each band
+        key (tuple): identifies the distribution
+
+    Returns:
+        AgeDistribution: the distribution of the bands
+    """
+    edges = np.asarray(edges)
+    widths = np.diff(edges)
+    age_weights = np.zeros(EXCLUSIVE_UPPER_AGE_LIMIT)
+    age_weights[edges[0] : edges[-1]] = np.repeat(
+        np.asarray(weights, dtype=float) / widths, widths
+    )
+    return AgeDistribution(age_weights, key)
+
+
+@cache
+def named_distribution(name: str) -> AgeDistribution:
+    """Returns one of the DISTRIBUTION_NAMES, built on first use
+
+    Raises:
+        KeyError: if the name is not one of DISTRIBUTION_NAMES
+    """
+    if name == "uniform":
+        return AgeDistribution(np.ones(EXCLUSIVE_UPPER_AGE_LIMIT), (name,))
+    return histogram(PYRAMID_EDGES, AGE_PYRAMIDS[name], (name,))
+
+
+def age_distribution(
+    distribution: AgeDistribution | None, age_list: np.ndarray | None
+) -> AgeDistribution | None:
+    """The distribution the ages of a batch are drawn from
+
+    Args:
+        distribution (AgeDistribution | None): the distribution of the request, or None
+        age_list (np.ndarray | None): the potential ages as specified by the user, or None
+
+    Returns:
+        AgeDistribution | None: the distribution restricted to the age limits, a uniform one when the request only has age limits and None when it has neither, in which case birthdates are drawn uniformly
+    """
+    if age_list is None:
+        return distribution
+    return (distribution or named_distribution("uniform")).restrict(age_list)
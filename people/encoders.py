@@ -0,0 +1,305 @@
+"""
+This file contains the fast output path for generated person data.
+
+The people produced by the batch engine are already well typed, so instead of
+validating every row with DRF the keys of the batch are checked once per request
+against the field definitions of PersonSerializer and the rows are then encoded
+straight to bytes. Columnar batches are only converted to dictionaries here.
+
+Bodies can also be encoded as MessagePack, and in a compact form that sends the keys
+of the people once followed by one array of values per person, see frame_body.
+"""
+from datetime import date
+from typing import Iterable, Iterator
+
+import msgpack
+import ujson
+from rest_framework import serializers
+
+from people import metrics
+from people.batch import PersonBatch
+from people.providers import GENDERS
+from people.serializers import PersonSerializer
+
+# The media types a body can be encoded as, negotiated from the Accept header
+BODY_CONTENT_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+
+class SchemaError(Exception):
+    """Raised when a batch of generated people does not conform to a serializer
+
+    Args:
+        Exception : Contains a human readable description of the mismatch
+    """
+
+
+def validate_schema(
+    keys: Iterable[str],
+    serializer: serializers.Serializer,
+    dependent_keys: Iterable[str] = None,
+) -> None:
+    """Checks the keys of a batch against the fields declared on a serializer,
+    every key must be declared, every required field must be present and
+    generated choice values must be amongst the declared choices
+
+    Args:
+        keys (Iterable[str]): the keys of the generated people
+        serializer (serializers.Serializer): a serializer instance such as PersonSerializer()
+        dependent_keys (Iterable[str], optional): the keys of the generated dependents. Defaults to None.
+
+    Raises:
+        SchemaError: if the batch does not conform to the serializer
+    """
+    keys = set(keys)
+    declared = serializer.fields
+
+    undeclared = keys.difference(declared.keys())
+    if undeclared:
+        raise SchemaError(f"{sorted(undeclared)} are not declared fields")
+
+    missing = {name for name, field in declared.items() if field.required} - keys
+    if missing:
+        raise SchemaError(f"{sorted(missing)} are required fields")
+
+    gender_field = declared.get("gender")
+    if isinstance(gender_field, serializers.ChoiceField) and not set(GENDERS).issubset(
+        gender_field.choices
+    ):
+        raise SchemaError(f"{GENDERS} are not all valid gender choices")
+
+    if dependent_keys is not None:
+        validate_schema(dependent_keys, declared["dependents"].child)
+
+
+def encode_default(value) -> str:
+    """Encodes the values that ujson does not natively support"""
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def validate_people(people: PersonBatch | list[dict]) -> None:
+    """Validates the schema of a batch once, using its keys and those of its dependents
+
+    Args:
+        people (PersonBatch | list[dict]): the generated people
+
+    Raises:
+        SchemaError: if the batch does not conform to PersonSerializer
+    """
+    if not people:
+        return
+    if isinstance(people, PersonBatch):
+        validate_schema(people.keys(), PersonSerializer(), people.dependent_keys())
+        return
+
+    dependent = next(
+        (
+            dependents[0]
+            for person in people
+            if (dependents := person.get("dependents"))
+        ),
+        None,
+    )
+    validate_schema(
+        people[0].keys(),
+        PersonSerializer(),
+        dependent.keys() if dependent else None,
+    )
+
+
+def as_records(people: PersonBatch | list[dict]) -> list[dict]:
+    """Returns the people of a batch as the dictionaries that are encoded"""
+    if isinstance(people, PersonBatch):
+        return people.to_records()
+    return people
+
+
+def encode_people(people: PersonBatch | list[dict]) -> bytes:
+    """Validates the schema of a batch once and encodes it to a JSON array
+
+    Args:
+        people (PersonBatch | list[dict]): the generated people
+
+    Raises:
+        SchemaError: if the batch does not conform to PersonSerializer
+
+    Returns:
+        bytes: the encoded JSON array
+    """
+    with metrics.stage("encode"):
+        validate_people(people)
+        return ujson.dumps(as_records(people), default=encode_default).encode("utf-8")
+
+
+def encode_ndjson(people: PersonBatch | list[dict]) -> bytes:
+    """Validates the schema of a batch once and encodes it as newline delimited JSON
+
+    Args:
+        people (PersonBatch | list[dict]): the generated people
+
+    Raises:
+        SchemaError: if the batch does not conform to PersonSerializer
+
+    Returns:
+        bytes: one encoded JSON object per line
+    """
+    with metrics.stage("encode"):
+        validate_people(people)
+        return "".join(
+            f"{ujson.dumps(person, default=encode_default)}\n"
+            for person in as_records(people)
+        ).encode("utf-8")
+
+
+def encode_elements(
+    people: PersonBatch | list[dict], stream_format: str = "json"
+) -> bytes:
+    """Encodes a chunk of people as a fragment of a streamed body, either the comma
+    separated elements of a JSON array or newline delimited JSON
+
+    Args:
+        people (PersonBatch | list[dict]): the generated people
+        stream_format (str, optional): either 'json' or 'ndjson'. Defaults to 'json'.
+
+    Raises:
+        SchemaError: if the batch does not conform to PersonSerializer
+
+    Returns:
+        bytes: the encoded fragment, empty when there are no people
+    """
+    if stream_format == "ndjson":
+        return encode_ndjson(people)
+    return encode_people(people)[1:-1]
+
+
+def frame_elements(
+    fragments: Iterable[bytes], stream_format: str = "json"
+) -> Iterator[bytes]:
+    """Frames encoded fragments into a complete body, fragments of a JSON array
+    are separated by commas and enclosed in brackets
+
+    Args:
+        fragments (Iterable[bytes]): fragments produced by encode_elements
+        stream_format (str, optional): either 'json' or 'ndjson'. Defaults to 'json'.
+
+    Yields:
+        bytes: the framed body
+    """
+    if stream_format == "ndjson":
+        yield from fragments
+        return
+
+    yield b"["
+    separator = b""
+    for fragment in fragments:
+        if fragment:
+            yield separator + fragment
+            separator = b","
+    yield b"]"
+
+
+def encode_batches(batches: Iterable[PersonBatch]) -> bytes:
+    """Encodes chunks of people to a single JSON array, so that only one chunk is
+    converted to dictionaries at a time
+
+    Args:
+        batches (Iterable[PersonBatch]): chunks of generated people, as yielded by iter_persons
+
+    Raises:
+        SchemaError: if a chunk does not conform to PersonSerializer
+
+    Returns:
+        bytes: the encoded JSON array
+    """
+    return b"".join(frame_elements(encode_elements(batch) for batch in batches))
+
+
+def encode_values(people: PersonBatch, media: str, compact: bool = False) -> bytes:
+    """Validates the schema of a batch once and encodes its people as a fragment of
+    a body, either the comma separated elements of a JSON array or the consecutive
+    elements of a MessagePack array
+
+    Args:
+        people (PersonBatch): the generated people
+        media (str): either 'json' or 'msgpack'
+        compact (bool, optional): encode each person as an array of values rather than an object. Defaults to False.
+
+    Raises:
+        SchemaError: if the batch does not conform to PersonSerializer
+
+    Returns:
+        bytes: the encoded fragment, empty when there are no people
+    """
+    with metrics.stage("encode"):
+        validate_people(people)
+        values = people.to_rows() if compact else people.to_records()
+        if media == "msgpack":
+            packer = msgpack.Packer(default=encode_default)
+            return b"".join(packer.pack(value) for value in values)
+        return ujson.dumps(values, default=encode_default).encode("utf-8")[1:-1]
+
+
+def frame_body(
+    batches: Iterable[PersonBatch], number: int, media: str, compact: bool = False
+) -> Iterator[bytes]:
+    """Encodes chunks of people into a complete body, chunk by chunk. A compact body
+    is an object holding the keys of the people, the keys of their dependents and
+    the rows of values of the people
+
+    Args:
+        batches (Iterable[PersonBatch]): chunks of generated people, as yielded by iter_persons
+        number (int): the number of people of all of the chunks
+        media (str): either 'json' or 'msgpack'
+        compact (bool, optional): send the keys once rather than with every person. Defaults to False.
+
+    Raises:
+        SchemaError: if a chunk does not conform to PersonSerializer
+
+    Yields:
+        bytes: the encoded body
+    """
+    packer = msgpack.Packer()
+    separator = b""
+    header_sent = False
+    for batch in batches:
+        fragment = encode_values(batch, media, compact)
+        if not header_sent:
+            yield encode_header(batch, number, media, compact, packer)
+            header_sent = True
+        if fragment:
+            yield fragment if media == "msgpack" else separator + fragment
+            separator = b","
+    if not header_sent:
+        yield encode_header(PersonBatch(0, {}), number, media, compact, packer)
+    if media == "json":
+        yield b"]}" if compact else b"]"
+
+
+def encode_header(
+    batch: PersonBatch,
+    number: int,
+    media: str,
+    compact: bool,
+    packer: msgpack.Packer,
+) -> bytes:
+    """Encodes the start of a body, up to its first person"""
+    if not compact:
+        return packer.pack_array_header(number) if media == "msgpack" else b"["
+    keys = batch.keys()
+    dependent_keys = batch.dependents.keys() if batch.dependents is not None else None
+    if media == "msgpack":
+        return (
+            packer.pack_map_header(3)
+            + packer.pack("keys")
+            + packer.pack(keys)
+            + packer.pack("dependent_keys")
+            + packer.pack(dependent_keys)
+            + packer.pack("rows")
+            + packer.pack_array_header(number)
+        )
+    header = ujson.dumps({"keys": keys, "dependent_keys": dependent_keys})
+    return header[:-1].encode("utf-8") + b',"rows":['
@@ -0,0 +1,346 @@
+"""
+This file contains the tabular export formats of generated person data.
+
+Rather than a nested JSON array, the columns of each generated chunk are written
+straight to CSV, Arrow IPC (Feather) or NumPy .npz, without ever building a
+dictionary per person. People get an 'id' column holding their position within
+the request and their dependents are written to a separate table whose
+'parent_id' column refers to it. As a CSV or Arrow file holds a single table, both
+tables are then returned within a zip archive.
+"""
+import csv
+import io
+import itertools
+import tempfile
+import zipfile
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from people.batch import PersonBatch
+from people.encoders import validate_people
+
+EXPORT_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.file",
+    "npz": "application/octet-stream",
+}
+
+ZIP_CONTENT_TYPE = "application/zip"
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkSink:
+    """A write only file object whose written bytes are collected until drained,
+    it is not seekable so zipfile writes its entries as a stream
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        """Returns and forgets the bytes written since the last drain"""
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def people_table(batch: PersonBatch, start: int) -> dict[str, np.ndarray]:
+    """Returns the columns of the people of a batch, preceded by their id
+
+    Args:
+        batch (PersonBatch): a chunk of generated people
+        start (int): the id of the first person of the chunk
+
+    Returns:
+        dict[str, np.ndarray]: the columns of the people table
+    """
+    return {"id": np.arange(start, start + len(batch)), **batch.columns}
+
+
+def dependents_table(batch: PersonBatch, start: int) -> dict[str, np.ndarray]:
+    """Returns the columns of the dependents of a batch, preceded by the id of their parent
+
+    Args:
+        batch (PersonBatch): a chunk of generated people with dependents
+        start (int): the id of the first person of the chunk
+
+    Returns:
+        dict[str, np.ndarray]: the columns of the dependents table
+    """
+    parent_ids = start + np.repeat(np.arange(len(batch)), np.diff(batch.offsets))
+    return {"parent_id": parent_ids, **batch.dependents.columns}
+
+
+class CsvWriter:
+    """Writes a table to a binary file as CSV, one chunk of rows at a time"""
+
+    extension = "csv"
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.header_written = False
+
+    def write(self, table: dict[str, np.ndarray]) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self.header_written:
+            writer.writerow(table)
+            self.header_written = True
+        columns = [
+            column.astype(str).tolist() if column.dtype.kind == "M" else column.tolist()
+            for column in table.values()
+        ]
+        writer.writerows(zip(*columns))
+        self.sink.write(buffer.getvalue().encode("utf-8"))
+
+    def close(self) -> None:
+        pass
+
+
+class ArrowWriter:
+    """Writes a table to a binary file in the Arrow IPC file format, also known as
+    Feather version 2, each chunk of rows is written as a record batch
+    """
+
+    extension = "arrow"
+
+    def __init__(self, sink):
+        import pyarrow
+
+        self.pyarrow = pyarrow
+        self.sink = pyarrow.PythonFile(sink, mode="w")
+        self.writer = None
+
+    def write(self, table: dict[str, np.ndarray]) -> None:
+        pa = self.pyarrow
+        arrays = [pa.array(column) for column in table.values()]
+        record_batch = pa.record_batch(arrays, names=list(table))
+        if self.writer is None:
+            self.writer = pa.ipc.new_file(self.sink, record_batch.schema)
+        self.writer.write_batch(record_batch)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ColumnSpool:
+    """Spools the rows of a column to a temporary file chunk by chunk, keeping the
+    dtype and length of every chunk so that they can be read back one at a time
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.chunks = []
+
+    def append(self, column: np.ndarray) -> None:
+        column = np.ascontiguousarray(column)
+        self.chunks.append((column.dtype, len(column)))
+        self.file.write(column.tobytes())
+
+    def dtype(self) -> np.dtype:
+        """The dtype holding every chunk, such as the widest string width"""
+        return np.result_type(*(dtype for dtype, _ in self.chunks))
+
+    def __len__(self) -> int:
+        return sum(length for _, length in self.chunks)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        self.file.seek(0)
+        for dtype, length in self.chunks:
+            yield np.frombuffer(self.file.read(dtype.itemsize * length), dtype=dtype)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class NpzWriter:
+    """Writes tables to a binary file as a NumPy .npz archive of one array per column,
+    strings are stored as fixed width unicode arrays and dates as datetime64[D].
+    Each array of an archive is a contiguous member of the zip file, so the rows of
+    every column are spooled to a temporary file as they are written. Once every
+    chunk has been written, each member is written with the header of its array,
+    holding the total length and width of the column, followed by its rows one
+    spooled chunk at a time, so only a single chunk is ever held in memory
+    """
+
+    extension = "npz"
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.columns = {}
+
+    def write(self, table: dict[str, np.ndarray], prefix: str = "") -> None:
+        for name, column in table.items():
+            if column.dtype == object:
+                column = np.array(column.tolist(), dtype=str)
+            self.spool(prefix + name, column)
+
+    def spool(self, name: str, column: np.ndarray) -> None:
+        spool = self.columns.get(name)
+        if spool is None:
+            spool = self.columns[name] = ColumnSpool()
+        spool.append(column)
+
+    def write_members(self) -> Iterator[None]:
+        """Writes the spooled columns into the archive, yielding after every chunk"""
+        with zipfile.ZipFile(self.sink, "w") as archive:
+            for name, spool in self.columns.items():
+                dtype = spool.dtype()
+                header = {
+                    "descr": np.lib.format.dtype_to_descr(dtype),
+                    "fortran_order": False,
+                    "shape": (len(spool),),
+                }
+                with archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, header)
+                    for chunk in spool:
+                        member.write(chunk.astype(dtype, copy=False).tobytes())
+                        yield
+                spool.close()
+
+    def close(self) -> None:
+        for _ in self.write_members():
+            pass
+        self.discard()
+
+    def discard(self) -> None:
+        """Removes the spooled columns"""
+        for spool in self.columns.values():
+            spool.close()
+
+
+TABLE_WRITERS = {"csv": CsvWriter, "arrow": ArrowWriter, "npz": NpzWriter}
+
+
+def export_batches(
+    batches: Iterable[PersonBatch], export_format: str
+) -> tuple[Iterator[bytes], str, str]:
+    """Exports chunks of generated people to a tabular format, the schema of the
+    first chunk is validated before anything is written
+
+    Args:
+        batches (Iterable[PersonBatch]): chunks of generated people, as yielded by iter_persons
+        export_format (str): either 'csv', 'arrow' or 'npz'
+
+    Raises:
+        SchemaError: if the people do not conform to PersonSerializer
+
+    Returns:
+        tuple[Iterator[bytes], str, str]: the exported body, its content type and a file name
+    """
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is not None:
+        validate_people(first)
+        batches = itertools.chain([first], batches)
+    with_dependents = first is not None and first.dependents is not None
+
+    if export_format == "npz":
+        return (
+            iter_npz(batches),
+            EXPORT_CONTENT_TYPES[export_format],
+            "people.npz",
+        )
+    if with_dependents:
+        return (
+            iter_zipped_tables(batches, export_format),
+            ZIP_CONTENT_TYPE,
+            "people.zip",
+        )
+    return (
+        iter_table(batches, export_format),
+        EXPORT_CONTENT_TYPES[export_format],
+        f"people.{TABLE_WRITERS[export_format].extension}",
+    )
+
+
+def iter_table(batches: Iterable[PersonBatch], export_format: str) -> Iterator[bytes]:
+    """Writes the people of each chunk to a single table as it is generated"""
+    sink = ChunkSink()
+    writer = TABLE_WRITERS[export_format](sink)
+    start = 0
+    for batch in batches:
+        writer.write(people_table(batch, start))
+        start += len(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def iter_zipped_tables(
+    batches: Iterable[PersonBatch], export_format: str
+) -> Iterator[bytes]:
+    """Writes the people and dependents tables into a zip archive, the people table
+    is streamed as it is generated whilst the dependents table is spooled to a
+    temporary file and appended once every chunk has been written
+    """
+    sink = ChunkSink()
+    writer_class = TABLE_WRITERS[export_format]
+    with tempfile.TemporaryFile() as spool, zipfile.ZipFile(sink, "w") as archive:
+        dependents_writer = writer_class(spool)
+        with archive.open(f"people.{writer_class.extension}", "w") as member:
+            people_writer = writer_class(member)
+            start = 0
+            for batch in batches:
+                people_writer.write(people_table(batch, start))
+                dependents_writer.write(dependents_table(batch, start))
+                start += len(batch)
+                yield sink.drain()
+            people_writer.close()
+        dependents_writer.close()
+
+        spool.seek(0)
+        with archive.open(f"dependents.{writer_class.extension}", "w") as member:
+            while data := spool.read(COPY_BUFFER_SIZE):
+                member.write(data)
+                yield sink.drain()
+    yield sink.drain()
+
+
+def iter_npz(batches: Iterable[PersonBatch]) -> Iterator[bytes]:
+    """Spools the columns of every chunk and then writes them as a .npz archive,
+    the archive is streamed as each member is written. The columns of the dependents
+    table are prefixed by 'dependents/'
+    """
+    sink = ChunkSink()
+    writer = NpzWriter(sink)
+    try:
+        start = 0
+        for batch in batches:
+            writer.write(people_table(batch, start))
+            if batch.dependents is not None:
+                writer.write(dependents_table(batch, start), prefix="dependents/")
+            start += len(batch)
+        for _ in writer.write_members():
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.discard()
+    yield sink.drain()
+
+
+def write_export(batches: Iterable[PersonBatch], export_format: str, path: str) -> None:
+    """Exports chunks of generated people to a file, see export_batches
+
+    Args:
+        batches (Iterable[PersonBatch]): chunks of generated people, as yielded by iter_persons
+        export_format (str): either 'csv', 'arrow' or 'npz'
+        path (str): the path of the written file
+    """
+    body, _, _ = export_batches(batches, export_format)
+    with open(path, "wb") as f:
+        for data in body:
+            f.write(data)
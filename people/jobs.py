@@ -0,0 +1,398 @@
+"""
+This file contains the background jobs that generate requests too large to be
+answered within a single HTTP request.
+
+A job generates its entries shard by shard, over the process pool when it has been
+started, and writes them into a memory mapped output file that is preallocated from
+the size of the first shard. The registry of jobs is kept in process, the output of
+a job is deleted once it has expired or the job is deleted.
+
+Jobs run on a pool of PERSON_JOB_WORKERS threads, further jobs are queued until a
+thread is free. At most PERSON_JOB_MAX_ACTIVE jobs are queued or running at once,
+the creation of another job is refused with JobLimitReached.
+"""
+import mmap
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
+import numpy as np
+from django.conf import settings
+
+from people import parallel
+from people.context import CHUNK_SIZE, GeneratorContext
+
+JOB_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+INITIAL_OUTPUT_BYTES = 1024 * 1024
+
+READ_BUFFER_SIZE = 1024 * 1024
+
+job_registry = None
+
+
+class JobLimitReached(Exception):
+    """Raised when a job is created whilst the maximum number of jobs are queued or
+    running
+    """
+
+
+class MappedOutput:
+    """A file that is written through a memory map, the file is grown whenever a
+    write does not fit and truncated to the written bytes once closed
+
+    Args:
+        path (str): the path of the created file
+        size (int): the number of bytes initially allocated
+    """
+
+    def __init__(self, path: str, size: int = INITIAL_OUTPUT_BYTES):
+        self.file = open(path, "w+b")
+        self.size = 0
+        self.offset = 0
+        self.map = None
+        self.reserve(size)
+
+    def reserve(self, size: int) -> None:
+        """Grows the file, and its memory map, to hold at least size bytes"""
+        if size <= self.size:
+            return
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.size = size
+
+    def write(self, data: bytes) -> None:
+        end = self.offset + len(data)
+        if end > self.size:
+            self.reserve(max(end, 2 * self.size))
+        self.map[self.offset : end] = data
+        self.offset = end
+
+    def close(self) -> None:
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(self.offset)
+        self.file.close()
+
+
+class Job:
+    """A request that is generated in the background into an output file
+
+    Args:
+        job_id (str): the identifier of the job
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The random state of the request
+        job_format (str): either 'ndjson' or 'json'
+        path (str): the path of the output file
+        ttl (float): the number of seconds the output is kept once the job has ended
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        number: int,
+        input_fields: list[str],
+        age_list: np.ndarray,
+        context: GeneratorContext,
+        job_format: str,
+        path: str,
+        ttl: float,
+    ):
+        self.id = job_id
+        self.number = number
+        self.input_fields = input_fields
+        self.age_list = age_list
+        self.context = context
+        self.format = job_format
+        self.path = path
+        self.ttl = ttl
+        self.status = "queued"
+        self.error = None
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.created_at = time.time()
+        self.ended_at = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.future: Future | None = None
+
+    @property
+    def content_type(self) -> str:
+        return JOB_CONTENT_TYPES[self.format]
+
+    @property
+    def expires_at(self) -> float | None:
+        """When the output of the job is deleted, None whilst it is running"""
+        return None if self.ended_at is None else self.ended_at + self.ttl
+
+    def to_dict(self) -> dict:
+        """The state of the job as returned by the API"""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "format": self.format,
+            "number": self.number,
+            "rows_written": self.rows_written,
+            "bytes_written": self.bytes_written,
+            "progress": self.rows_written / self.number if self.number else 1.0,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "error": self.error,
+        }
+
+    def iter_shards(self) -> Iterator[tuple[int, bytes]]:
+        """Generates the shards of the job in order, over the process pool when it
+        has been started and within this thread otherwise
+
+        Yields:
+            tuple[int, bytes]: the number of entries of a shard and its encoded fragment
+        """
+        shards = parallel.shard_chunks(self.number)
+        if parallel.executor is not None:
+            fragments = parallel.iter_encoded(
+                self.number, self.input_fields, self.age_list, self.context, self.format
+            )
+        else:
+            fragments = (
+                parallel.generate_shard(
+                    shard,
+                    self.number,
+                    self.input_fields,
+                    self.age_list,
+                    self.context,
+                    self.format,
+                )
+                for shard in shards
+            )
+        try:
+            for shard, fragment in zip(shards, fragments):
+                rows = (
+                    min(shard.stop * CHUNK_SIZE, self.number) - shard.start * CHUNK_SIZE
+                )
+                yield rows, fragment
+        finally:
+            fragments.close()
+
+    def run(self) -> None:
+        """Runs the job unless it was cancelled whilst queued"""
+        try:
+            if not self.cancelled.is_set():
+                self.status = "running"
+                self.write_output()
+            self.status = "cancelled" if self.cancelled.is_set() else "finished"
+        except Exception as exception:
+            self.status = "failed"
+            self.error = str(exception)
+        finally:
+            self.ended_at = time.time()
+            self.done.set()
+
+    def write_output(self) -> None:
+        """Writes the shards of the job to its output file until done or cancelled"""
+        output = MappedOutput(self.path)
+        try:
+            separator = b""
+            if self.format == "json":
+                output.write(b"[")
+            for rows, fragment in self.iter_shards():
+                if self.cancelled.is_set():
+                    break
+                if fragment:
+                    if self.rows_written == 0:
+                        output.reserve(
+                            int(1.05 * len(fragment) * self.number / rows) + 2
+                        )
+                    output.write(separator + fragment)
+                    if self.format == "json":
+                        separator = b","
+                self.rows_written += rows
+                self.bytes_written = output.offset
+            if self.format == "json":
+                output.write(b"]")
+        finally:
+            output.close()
+        self.bytes_written = os.path.getsize(self.path)
+
+    def cancel(self) -> None:
+        """Stops the job after the shard that is being written"""
+        self.cancelled.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Waits for the job to end
+
+        Returns:
+            bool: whether the job has ended within the timeout
+        """
+        return self.done.wait(timeout)
+
+
+class JobRegistry:
+    """Keeps track of the jobs of this process and deletes them once expired
+
+    Args:
+        directory (str): the directory the output files are written to
+        ttl (float): the number of seconds the output of a job is kept once the job has ended
+        workers (int): the number of jobs that run at once
+        max_active (int): the number of jobs that may be queued or running at once
+    """
+
+    def __init__(self, directory: str, ttl: float, workers: int, max_active: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_active = max_active
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        os.makedirs(directory, exist_ok=True)
+
+    def create(
+        self,
+        number: int,
+        input_fields: list[str],
+        age_list: np.ndarray,
+        context: GeneratorContext,
+        job_format: str,
+    ) -> Job:
+        """Creates a job and queues it, see Job
+
+        Raises:
+            JobLimitReached: if max_active jobs are already queued or running
+
+        Returns:
+            Job: the queued job
+        """
+        self.expire()
+        job_id = uuid.uuid4().hex
+        job = Job(
+            job_id,
+            number,
+            input_fields,
+            age_list,
+            context,
+            job_format,
+            os.path.join(self.directory, f"{job_id}.{job_format}"),
+            self.ttl,
+        )
+        with self.lock:
+            active = sum(job.ended_at is None for job in self.jobs.values())
+            if active >= self.max_active:
+                raise JobLimitReached(f"{active} jobs are already queued or running")
+            self.jobs[job_id] = job
+            job.future = self.executor.submit(job.run)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self.expire()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        self.expire()
+        with self.lock:
+            return list(self.jobs.values())
+
+    def delete(self, job_id: str) -> Job | None:
+        """Cancels a job, waits for it to stop and deletes its output
+
+        Returns:
+            Job | None: the deleted job, None if there is no such job
+        """
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            job.cancel()
+            if job.future.cancel():
+                # The job was still queued, it ends without writing any output
+                job.run()
+            job.wait()
+            self.remove_output(job)
+        return job
+
+    def expire(self) -> None:
+        """Deletes the jobs whose output has expired"""
+        now = time.time()
+        with self.lock:
+            expired = [
+                job
+                for job in self.jobs.values()
+                if job.expires_at is not None and job.expires_at <= now
+            ]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            self.remove_output(job)
+
+    def remove_output(self, job: Job) -> None:
+        try:
+            os.remove(job.path)
+        except FileNotFoundError:
+            pass
+
+
+def get_job_registry() -> JobRegistry:
+    """Returns the job registry of this process, created on first use"""
+    global job_registry
+    if job_registry is None:
+        job_registry = JobRegistry(
+            str(settings.PERSON_JOB_DIRECTORY),
+            settings.PERSON_JOB_TTL,
+            settings.PERSON_JOB_WORKERS,
+            settings.PERSON_JOB_MAX_ACTIVE,
+        )
+    return job_registry
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parses a single byte range of a Range header
+
+    Args:
+        header (str): the value of the Range header, for example 'bytes=0-1023'
+        size (int): the size of the file in bytes
+
+    Raises:
+        ValueError: if the range cannot be satisfied
+
+    Returns:
+        tuple[int, int] | None: the first and the last byte of the range, None if the header is not a single byte range
+    """
+    unit, _, byte_range = header.partition("=")
+    if unit.strip() != "bytes" or "," in byte_range:
+        return None
+    first, _, last = byte_range.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            stop = min(int(last), size - 1) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            stop = size - 1
+    except ValueError:
+        return None
+    if start > stop or start >= size:
+        raise ValueError(f"{header} cannot be satisfied for {size} bytes")
+    return start, stop
+
+
+def iter_file(path: str, start: int, stop: int) -> Iterator[bytes]:
+    """Reads the bytes of a file from start to stop inclusive, in blocks"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start + 1
+        while remaining > 0:
+            data = f.read(min(READ_BUFFER_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
@@ -0,0 +1,138 @@
+"""
+This file contains the country and nationality lookup tables.
+
+The tables are built from demonyms.csv and pycountry, so that the country and
+nationality of a whole batch can be produced by vectorized indexing rather than by
+a pycountry query and a np.random.choice call per person. They are built on first
+use rather than at import, as reading the file and importing pycountry would
+otherwise slow down the start of every server process and management command.
+The tables remain available as module attributes, such as DEMONYMS.
+"""
+import os
+import csv
+from functools import cache
+
+from django.conf import settings
+import numpy as np
+
+# The tables that are accessible as module attributes
+TABLE_NAMES = (
+    "DEMONYMS",
+    "NATIONALITY_CODES",
+    "PLACE_DEMONYM_CODES",
+    "ALPHA_2_COUNTRIES",
+)
+
+
+class LookupTables:
+    """The lookup tables, built from demonyms.csv and pycountry"""
+
+    def __init__(self):
+        import pycountry
+
+        csv_path = os.path.join(settings.BASE_DIR, "demonyms.csv")
+        with open(csv_path, "r") as f:
+            contents = csv.reader(f)
+            nationalities = {x[1]: x[0] for x in contents}
+        list_nationalities = list(nationalities.values())
+
+        # The distinct demonyms, every other table refers to a demonym by its index in here
+        self.demonyms = np.array(sorted(set(list_nationalities)), dtype=object)
+
+        demonym_indices = {
+            demonym: index for index, demonym in enumerate(self.demonyms)
+        }
+
+        # The demonym of every place in demonyms.csv, random nationalities are drawn from these
+        self.nationality_codes = np.array(
+            [demonym_indices[demonym] for demonym in list_nationalities],
+            dtype=np.int32,
+        )
+
+        # The demonym of each place name, places without a demonym are absent
+        self.place_demonym_codes = {
+            place: demonym_indices[demonym] for place, demonym in nationalities.items()
+        }
+
+        # The name of each country keyed by its two letter code
+        self.alpha_2_countries = {
+            country.alpha_2: country.name for country in pycountry.countries
+        }
+
+
+@cache
+def tables() -> LookupTables:
+    """Returns the lookup tables, built on first use"""
+    return LookupTables()
+
+
+def __getattr__(name: str):
+    """Builds the tables when one of them is first accessed as a module attribute"""
+    if name in TABLE_NAMES:
+        return getattr(tables(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def country_of_address(address: str) -> str | None:
+    """Deduces a country name from the two letter code found in an address,
+    None where the token before the postcode is not a two letter country code
+    """
+    tokens = address.split()
+    return tables().alpha_2_countries.get(tokens[-2]) if len(tokens) > 1 else None
+
+
+def locale_countries(locales: list[str]) -> np.ndarray:
+    """Maps faker locales to the name of the country of their region, such as
+    'United Kingdom' for 'en_GB', None where a locale has no recognised region
+
+    Args:
+        locales (list[str]): faker locales
+
+    Returns:
+        np.ndarray: an object array of country names aligned with locales
+    """
+    alpha_2_countries = tables().alpha_2_countries
+    return np.array(
+        [
+            alpha_2_countries.get(locale.split("_")[-1]) if "_" in locale else None
+            for locale in locales
+        ],
+        dtype=object,
+    )
+
+
+def demonym_codes(countries: np.ndarray) -> np.ndarray:
+    """Maps an array of country names to demonym indices, -1 where a country has no demonym
+
+    Args:
+        countries (np.ndarray): an object array of country names, which may contain None
+
+    Returns:
+        np.ndarray: an integer array of indices into DEMONYMS
+    """
+    place_demonym_codes = tables().place_demonym_codes
+    return np.array(
+        [place_demonym_codes.get(country, -1) for country in countries],
+        dtype=np.int32,
+    )
+
+
+def draw_nationalities(
+    country_codes: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """Draws the nationality of every person of a batch, a person holds the nationality
+    of their country of residence with a probability of 0.7 and a random one otherwise
+
+    Args:
+        country_codes (np.ndarray): the demonym index of each person's country, or -1
+        rng (np.random.Generator): the generator the nationalities are drawn from
+
+    Returns:
+        np.ndarray: an object array of demonyms
+    """
+    lookup_tables = tables()
+    nationality_codes = lookup_tables.nationality_codes
+    number = len(country_codes)
+    random_codes = nationality_codes[rng.integers(0, len(nationality_codes), number)]
+    use_country = (rng.random(number) < 0.7) & (country_codes >= 0)
+    return lookup_tables.demonyms[np.where(use_country, country_codes, random_codes)]
@@ -0,0 +1,97 @@
+"""
+This file contains the benchmark command, which runs the suite of people.benchmarks,
+writes its results as JSON and fails when they regress from a stored baseline.
+
+    python manage.py benchmark
+    python manage.py benchmark --update-baseline
+"""
+import os
+
+import ujson
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from people.benchmarks import STARTUP_TOLERANCE, compare_results, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Benchmarks generation, serialization and request latency against a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=os.path.join(settings.BASE_DIR, "benchmarks", "results.json"),
+            help="The file the results are written to",
+        )
+        parser.add_argument(
+            "--baseline",
+            default=os.path.join(settings.BASE_DIR, "benchmarks", "baseline.json"),
+            help="The file of the results that are compared against",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="The allowed relative increase of time and peak memory",
+        )
+        parser.add_argument(
+            "--startup-tolerance",
+            type=float,
+            default=STARTUP_TOLERANCE,
+            help="The allowed relative increase of the startup benchmarks, which run in a fresh process",
+        )
+        parser.add_argument(
+            "--repeats",
+            type=int,
+            default=3,
+            help="The number of timed runs per benchmark, the fastest is kept",
+        )
+        parser.add_argument(
+            "--quick", action="store_true", help="Skips the largest sizes"
+        )
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="Stores the results as the new baseline instead of comparing",
+        )
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(quick=options["quick"], repeats=options["repeats"])
+        for name, result in results["benchmarks"].items():
+            self.stdout.write(
+                f"{name:<32} {result['seconds'] * 1000:>10.2f} ms {result['peak_bytes'] / 2**20:>10.2f} MiB"
+            )
+
+        write_json(options["output"], results)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options["update_baseline"]:
+            write_json(options["baseline"], results)
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+            return
+
+        if not os.path.exists(options["baseline"]):
+            self.stdout.write(
+                self.style.WARNING(
+                    f"There is no baseline at {options['baseline']}, run with --update-baseline to store one"
+                )
+            )
+            return
+        with open(options["baseline"]) as f:
+            baseline = ujson.load(f)
+
+        regressions = compare_results(
+            results, baseline, options["tolerance"], options["startup_tolerance"]
+        )
+        if regressions:
+            raise CommandError(
+                "Benchmarks regressed from the baseline:\n" + "\n".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions from the baseline"))
+
+
+def write_json(path: str, content: dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        ujson.dump(content, f, indent=2, escape_forward_slashes=False)
+        f.write("\n")
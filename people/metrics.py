@@ -0,0 +1,228 @@
+"""
+This file contains the opt-in timing instrumentation of requests.
+
+When settings.PERSON_METRICS is enabled, the time spent in every stage of a request
+(parse, validate, generate, serialize and encode) and in every field provider is
+recorded into histograms, and the rows generated per field are counted. They are
+exposed in the Prometheus text format by the /metrics route, together with the
+statistics of the shared pools and of the response cache. When
+settings.PERSON_SERVER_TIMING is enabled, the stages of each request are also
+reported in a Server-Timing response header.
+
+When both are disabled a stage costs a single settings lookup and no timer is read.
+Field timings are exclusive, the time a provider spends computing the columns it
+depends on is attributed to those columns. Shards generated by the process pool are
+timed within the worker processes, whose metrics are not collected.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+NOT_TIMED = nullcontext()
+
+metrics = None
+
+# The stage timings of the request being handled, None unless Server-Timing is enabled
+request_timings = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, as a Prometheus histogram
+
+    Args:
+        buckets (tuple[float]): the upper bounds of the buckets, in ascending order
+    """
+
+    def __init__(self, buckets: tuple[float] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str) -> list[str]:
+        """Returns the lines of the histogram in the Prometheus text format"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """The timings of the stages and field providers of this process"""
+
+    def __init__(self):
+        self.stages = defaultdict(Histogram)
+        self.fields = defaultdict(Histogram)
+        self.rows = Counter()
+        self.lock = threading.Lock()
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.stages[stage].observe(seconds)
+
+    def observe_field(self, field: str, seconds: float, rows: int) -> None:
+        with self.lock:
+            self.fields[field].observe(seconds)
+            self.rows[field] += rows
+
+    def samples(self) -> list[str]:
+        """Returns the lines of every metric in the Prometheus text format"""
+        lines = [
+            "# HELP person_stage_seconds Time spent in each stage of a request",
+            "# TYPE person_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.stages.items()):
+                lines.extend(
+                    histogram.samples("person_stage_seconds", f'stage="{stage}"')
+                )
+            lines.extend(
+                [
+                    "# HELP person_field_seconds Time spent generating each column of a batch",
+                    "# TYPE person_field_seconds histogram",
+                ]
+            )
+            for field, histogram in sorted(self.fields.items()):
+                lines.extend(
+                    histogram.samples("person_field_seconds", f'field="{field}"')
+                )
+            lines.extend(
+                [
+                    "# HELP person_field_rows_total Rows generated for each field",
+                    "# TYPE person_field_rows_total counter",
+                ]
+            )
+            for field, rows in sorted(self.rows.items()):
+                lines.append(f'person_field_rows_total{{field="{field}"}} {rows}')
+        return lines
+
+
+def get_metrics() -> Metrics | None:
+    """Returns the metrics of this process, created on first use, or None when
+    settings.PERSON_METRICS is disabled
+    """
+    global metrics
+    if not settings.PERSON_METRICS:
+        return None
+    if metrics is None:
+        metrics = Metrics()
+    return metrics
+
+
+def start_request() -> dict[str, float] | None:
+    """Starts collecting the stage timings of the current request for its
+    Server-Timing header
+
+    Returns:
+        dict[str, float] | None: the seconds spent per stage, None when the header is disabled
+    """
+    if not settings.PERSON_SERVER_TIMING:
+        return None
+    timings = {}
+    request_timings.set(timings)
+    return timings
+
+
+def stage(name: str):
+    """Returns a context manager timing a stage of the current request
+
+    Args:
+        name (str): either 'parse', 'validate', 'generate', 'serialize' or 'encode'
+    """
+    registry = get_metrics()
+    timings = request_timings.get()
+    if registry is None and timings is None:
+        return NOT_TIMED
+    return timed_stage(name, registry, timings)
+
+
+@contextmanager
+def timed_stage(name: str, registry: Metrics | None, timings: dict | None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if registry is not None:
+            registry.observe_stage(name, seconds)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """Formats the stage timings of a request as the value of a Server-Timing header"""
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()
+    )
+
+
+def render(shared_pools=None, response_cache=None) -> str:
+    """Renders the metrics of this process in the Prometheus text format
+
+    Args:
+        shared_pools (SharedPools, optional): the shared pools whose statistics are included. Defaults to None.
+        response_cache (ResponseCache, optional): the response cache whose statistics are included. Defaults to None.
+
+    Returns:
+        str: the exposition of every metric
+    """
+    registry = get_metrics()
+    lines = registry.samples() if registry is not None else []
+
+    if shared_pools is not None:
+        pool_stats = shared_pools.stats()
+        for key, kind, description in (
+            ("hits", "counter", "Requests served by a shared pool"),
+            ("misses", "counter", "Requests that sampled their own pool"),
+            ("size", "gauge", "Values held by a shared pool"),
+            ("bytes", "gauge", "Approximate memory held by a shared pool"),
+        ):
+            name = f"person_shared_pool_{key}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for provider_name, stats in pool_stats.items():
+                lines.append(f'{name}{{provider="{provider_name}"}} {stats[key]}')
+
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        for key in ("hits", "misses", "not_modified"):
+            name = f"person_response_cache_{key}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {cache_stats[key]}")
+        lines.append("# TYPE person_response_cache_hit_ratio gauge")
+        lines.append(f"person_response_cache_hit_ratio {cache_stats['hit_ratio']}")
+
+    return "\n".join(lines) + "\n"
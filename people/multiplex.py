@@ -0,0 +1,211 @@
+"""
+This file contains the generation of the many request bodies of a batch request.
+
+Unseeded specs of a batch that request the same fields, ages, age distribution,
+reference date and locales are compatible, as their entries are drawn from the same distribution. Each
+group of compatible specs shares its value pools, and consecutive specs of a group
+are generated together in passes of up to CHUNK_SIZE rows that are then split
+between them, so that many small specs cost about as much as one large request.
+Seeded specs are generated on their own, so that their entries are those of the
+same request to /api/persons/.
+
+The results are written either as newline delimited JSON, one line per spec, or as
+the parts of a multipart/mixed body. Results are written as soon as their group has
+been generated, so both identify each result by the index of its spec. Like any
+streamed body, they are produced a result at a time on the CPU executor rather than
+on the event loop, see OffloadedStream in people/concurrency.py.
+"""
+import secrets
+from typing import Iterable, Iterator, NamedTuple
+
+import numpy as np
+import ujson
+
+from people.batch import PersonBatch, generate_batch
+from people.concurrency import check_cancelled
+from people.context import CHUNK_SIZE, GeneratorContext
+from people.encoders import SchemaError, encode_batches
+from people.pools import ValuePools, request_pools
+
+BATCH_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "multipart": "multipart/mixed",
+}
+
+# The fields of a request body that do not apply to a spec of a batch
+UNSUPPORTED_SPEC_FIELDS = ("stream", "format", "strict", "offset", "limit", "cursor")
+
+SERIALIZATION_ERROR = {
+    "error": "An error was encountered whilst serializing the person data"
+}
+
+
+class BatchSpec(NamedTuple):
+    """A validated spec of a batch request
+
+    Args:
+        index (int): the position of the spec within the batch
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The random state of the spec
+    """
+
+    index: int
+    number: int
+    input_fields: list[str]
+    age_list: np.ndarray
+    context: GeneratorContext
+
+
+def group_key(spec: BatchSpec) -> tuple:
+    """The key shared by compatible specs, seeded specs are only compatible with themselves"""
+    if spec.context.seeded:
+        return ("seeded", spec.index)
+    age_list = spec.age_list
+    return (
+        tuple(sorted(spec.input_fields)),
+        (int(age_list.min()), int(age_list.max()))
+        if isinstance(age_list, np.ndarray) and len(age_list)
+        else None,
+        spec.context.today,
+        tuple((spec.context.locales or {}).items()),
+        spec.context.ages.key if spec.context.ages is not None else None,
+    )
+
+
+def group_specs(specs: list[BatchSpec]) -> list[list[BatchSpec]]:
+    """Groups compatible specs, in order of their first spec"""
+    groups = {}
+    for spec in specs:
+        groups.setdefault(group_key(spec), []).append(spec)
+    return list(groups.values())
+
+
+def plan_passes(group: list[BatchSpec]) -> list[list[BatchSpec]]:
+    """Splits a group into passes of consecutive specs of at most CHUNK_SIZE rows in
+    total, a spec of more than CHUNK_SIZE rows is a pass of its own
+    """
+    passes, current, rows = [], [], 0
+    for spec in group:
+        if current and rows + spec.number > CHUNK_SIZE:
+            passes.append(current)
+            current, rows = [], 0
+        current.append(spec)
+        rows += spec.number
+    if current:
+        passes.append(current)
+    return passes
+
+
+def iter_rows(
+    spec: BatchSpec, pools: ValuePools, context: GeneratorContext
+) -> Iterator[PersonBatch]:
+    """Generates the entries of a spec chunk by chunk from the given rows of a context"""
+    for start in range(0, spec.number, CHUNK_SIZE):
+        check_cancelled()
+        yield generate_batch(
+            min(CHUNK_SIZE, spec.number - start),
+            spec.input_fields,
+            spec.age_list,
+            pools,
+            context.at(start),
+        )
+
+
+def generate_group(
+    group: list[BatchSpec],
+) -> Iterator[tuple[BatchSpec, Iterable[PersonBatch]]]:
+    """Generates the entries of a group of compatible specs, pass by pass
+
+    Args:
+        group (list[BatchSpec]): compatible specs, see group_specs
+
+    Yields:
+        tuple[BatchSpec, Iterable[PersonBatch]]: each spec with its entries, which must be consumed before the next spec is yielded
+    """
+    context = group[0].context
+    pools = request_pools(context)
+    offset = 0
+    for specs in plan_passes(group):
+        rows = sum(spec.number for spec in specs)
+        if len(specs) == 1:
+            yield specs[0], iter_rows(specs[0], pools, context.at(offset))
+        else:
+            check_cancelled()
+            first = specs[0]
+            batch = generate_batch(
+                rows, first.input_fields, first.age_list, pools, context.at(offset)
+            )
+            start = 0
+            for spec in specs:
+                yield spec, [batch.slice(start, start + spec.number)]
+                start += spec.number
+        offset += rows
+
+
+def iter_results(
+    specs: list[BatchSpec], errors: list[tuple[int, int, dict]]
+) -> Iterator[tuple[int, int, bytes]]:
+    """Generates and encodes the result of every spec of a batch, starting with the
+    specs that failed validation
+
+    Args:
+        specs (list[BatchSpec]): the valid specs of the batch
+        errors (list[tuple[int, int, dict]]): the index, status and error of every invalid spec
+
+    Yields:
+        tuple[int, int, bytes]: the index, status and encoded JSON body of each spec
+    """
+    for index, status, content in errors:
+        yield index, status, ujson.dumps(content).encode("utf-8")
+    for group in group_specs(specs):
+        for spec, batches in generate_group(group):
+            try:
+                yield spec.index, 201, encode_batches(batches)
+            except SchemaError:
+                yield spec.index, 500, ujson.dumps(SERIALIZATION_ERROR).encode("utf-8")
+
+
+def frame_ndjson(results: Iterable[tuple[int, int, bytes]]) -> Iterator[bytes]:
+    """Writes each result as a line holding the index, status and body of its spec"""
+    for index, status, body in results:
+        yield b'{"index":%d,"status":%d,"body":%s}\n' % (index, status, body)
+
+
+def frame_multipart(
+    results: Iterable[tuple[int, int, bytes]], boundary: str
+) -> Iterator[bytes]:
+    """Writes each result as a part of a multipart/mixed body, whose Content-ID is
+    the index of its spec and whose X-Status is the status of its spec
+    """
+    delimiter = b"--" + boundary.encode("ascii")
+    for index, status, body in results:
+        yield b"%s\r\nContent-Type: application/json\r\nContent-ID: <%d>\r\nX-Status: %d\r\n\r\n%s\r\n" % (
+            delimiter,
+            index,
+            status,
+            body,
+        )
+    yield delimiter + b"--\r\n"
+
+
+def encode_results(
+    results: Iterable[tuple[int, int, bytes]], batch_format: str
+) -> tuple[Iterator[bytes], str]:
+    """Frames the results of a batch in the requested format
+
+    Args:
+        results (Iterable[tuple[int, int, bytes]]): as yielded by iter_results
+        batch_format (str): either 'ndjson' or 'multipart'
+
+    Returns:
+        tuple[Iterator[bytes], str]: the streamed body and its content type
+    """
+    if batch_format == "multipart":
+        boundary = secrets.token_hex(16)
+        return (
+            frame_multipart(results, boundary),
+            f'{BATCH_CONTENT_TYPES["multipart"]}; boundary="{boundary}"',
+        )
+    return frame_ndjson(results), BATCH_CONTENT_TYPES["ndjson"]
@@ -0,0 +1,102 @@
+"""
+This file contains the pagination of virtual datasets.
+
+A seeded request defines a virtual dataset of `number` people that is never
+generated as a whole. A page of it is requested by an offset or by the cursor of a
+previous page, and only the rows of the page are generated. Every row only depends
+on the seed and its index (see people/context.py), so the cost of a page does not
+depend on the size of the dataset, and the people of a page are the people found
+at the same rows of the full, unpaginated response.
+"""
+import base64
+import binascii
+from typing import Iterator
+
+import numpy as np
+import ujson
+
+from people.batch import PersonBatch, generate_batch
+from people.concurrency import check_cancelled
+from people.context import CHUNK_SIZE, GeneratorContext
+from people.pools import ValuePools
+
+PAGE_FIELDS = ("offset", "limit", "cursor")
+
+
+def encode_cursor(offset: int) -> str:
+    """Encodes the offset of a page as an opaque cursor"""
+    return base64.urlsafe_b64encode(f"o={offset}".encode("ascii")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Decodes the offset of a page from its cursor
+
+    Raises:
+        ValueError: if the cursor was not returned by encode_cursor
+    """
+    try:
+        decoded = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii")
+    except (AttributeError, UnicodeError, binascii.Error):
+        raise ValueError(cursor) from None
+    if not decoded.startswith("o=") or not decoded[2:].isdigit():
+        raise ValueError(cursor)
+    return int(decoded[2:])
+
+
+def iter_page(
+    number: int,
+    offset: int,
+    limit: int,
+    input_fields: list[str],
+    age_list: np.ndarray,
+    context: GeneratorContext,
+) -> Iterator[PersonBatch]:
+    """Generates the people of a page of a virtual dataset, chunk by chunk
+
+    Args:
+        number (int): The number of entries of the whole dataset
+        offset (int): The row of the dataset the page starts at
+        limit (int): The maximum number of entries of the page
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The seeded random state of the dataset
+
+    Yields:
+        PersonBatch: the people of the page, in chunks of at most CHUNK_SIZE
+    """
+    stop = min(number, offset + limit)
+    if offset >= stop:
+        return
+    pools = ValuePools()
+    for start in range(offset, stop, CHUNK_SIZE):
+        check_cancelled()
+        yield generate_batch(
+            min(CHUNK_SIZE, stop - start),
+            input_fields,
+            age_list,
+            pools,
+            context.at(start),
+        )
+
+
+def encode_page(number: int, offset: int, limit: int, results: bytes) -> bytes:
+    """Wraps the encoded people of a page with the size of the dataset and the
+    cursors of the next and previous pages, None where there is no such page
+
+    Args:
+        number (int): The number of entries of the whole dataset
+        offset (int): The row of the dataset the page starts at
+        limit (int): The maximum number of entries of the page
+        results (bytes): the encoded JSON array of the people of the page
+
+    Returns:
+        bytes: the encoded JSON object of the page
+    """
+    header = ujson.dumps(
+        {
+            "count": number,
+            "next": encode_cursor(offset + limit) if offset + limit < number else None,
+            "previous": encode_cursor(max(offset - limit, 0)) if offset > 0 else None,
+        }
+    )
+    return header[:-1].encode("utf-8") + b',"results":' + results + b"}"
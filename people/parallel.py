@@ -0,0 +1,200 @@
+"""
+This file contains the multi-process generation backend for large requests.
+
+Large requests are split into shards of whole chunks, each shard is generated and
+encoded by a worker process of a pool that is started once when the server starts.
+As every chunk only depends on the seed of the request and the index of the chunk,
+the merged output is identical to that of a single process. This module is imported
+by freshly spawned workers before django is set up, so the generation modules are
+only imported within the functions that need them.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator
+
+import numpy as np
+from django.conf import settings
+
+from people.context import CHUNK_SIZE, GeneratorContext
+
+executor = None
+executor_workers = 0
+
+
+def start_pool(workers: int = None) -> ProcessPoolExecutor:
+    """Starts the process pool used for large requests, workers are spawned rather
+    than forked as the parent process runs an event loop and threads
+
+    Args:
+        workers (int, optional): the number of worker processes. Defaults to settings.PERSON_GENERATION_WORKERS.
+
+    Returns:
+        ProcessPoolExecutor: the started pool, an already started pool is reused
+    """
+    global executor, executor_workers
+    if executor is None:
+        executor_workers = (
+            workers or settings.PERSON_GENERATION_WORKERS or os.cpu_count()
+        )
+        executor = ProcessPoolExecutor(
+            max_workers=executor_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initialise_worker,
+        )
+    return executor
+
+
+def stop_pool() -> None:
+    """Shuts down the process pool, if it was started"""
+    global executor
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
+
+
+def initialise_worker() -> None:
+    """Sets up django within a newly spawned worker process"""
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "synthetic.settings")
+    django.setup()
+
+
+def should_parallelise(number: int) -> bool:
+    """Whether a request is large enough to be split over the started process pool"""
+    return executor is not None and number >= settings.PERSON_PARALLEL_THRESHOLD
+
+
+def generate_shard(
+    chunk_indices: range,
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray,
+    context: GeneratorContext,
+    stream_format: str,
+) -> bytes:
+    """Generates and encodes a shard of a request within a worker process
+
+    Args:
+        chunk_indices (range): the indices of the chunks that make up the shard
+        number (int): The number of entries of the whole request
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The random state of the whole request
+        stream_format (str): either 'json' or 'ndjson'
+
+    Returns:
+        bytes: the shard encoded as a fragment, see encode_elements
+    """
+    from people.dataclass import generate_chunk
+    from people.encoders import encode_elements
+    from people.pools import ValuePools
+
+    pools = ValuePools()
+    fragments = [
+        encode_elements(
+            generate_chunk(index, number, input_fields, age_list, pools, context),
+            stream_format,
+        )
+        for index in chunk_indices
+    ]
+    separator = b"" if stream_format == "ndjson" else b","
+    return separator.join(fragment for fragment in fragments if fragment)
+
+
+def shard_chunks(number: int, shard_size: int = 1) -> list[range]:
+    """Splits the chunks of a request into contiguous shards of shard_size chunks"""
+    number_of_chunks = -(-number // CHUNK_SIZE)
+    return [
+        range(start, min(start + shard_size, number_of_chunks))
+        for start in range(0, number_of_chunks, shard_size)
+    ]
+
+
+def submit_shard(
+    chunk_indices: range,
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray,
+    context: GeneratorContext,
+    stream_format: str,
+) -> Future:
+    """Submits a shard to the process pool, see generate_shard"""
+    return executor.submit(
+        generate_shard,
+        chunk_indices,
+        number,
+        input_fields,
+        age_list,
+        context,
+        stream_format,
+    )
+
+
+async def generate_encoded(
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray,
+    context: GeneratorContext,
+) -> bytes:
+    """Generates a request over the process pool and merges the shards in order,
+    the event loop is free to serve other requests whilst the shards are generated
+
+    Args:
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The random state of the request
+
+    Returns:
+        bytes: the encoded JSON array
+    """
+    from people.encoders import frame_elements
+
+    shards = shard_chunks(number)
+    futures = [
+        submit_shard(shard, number, input_fields, age_list, context, "json")
+        for shard in shards
+    ]
+    fragments = await asyncio.gather(*map(asyncio.wrap_future, futures))
+    return b"".join(frame_elements(fragments, "json"))
+
+
+def iter_encoded(
+    number: int,
+    input_fields: list[str],
+    age_list: np.ndarray,
+    context: GeneratorContext,
+    stream_format: str,
+) -> Iterator[bytes]:
+    """Lazily generates a request over the process pool, at most twice as many
+    shards as there are workers are in flight so that memory stays bounded
+
+    Args:
+        number (int): The number of entries generated
+        input_fields (list[str]): A list of desired fields as specified by the user input
+        age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+        context (GeneratorContext): The random state of the request
+        stream_format (str): either 'json' or 'ndjson'
+
+    Yields:
+        bytes: the encoded fragment of each shard, in order
+    """
+    in_flight = []
+    window = 2 * executor_workers
+    try:
+        for shard in shard_chunks(number):
+            in_flight.append(
+                submit_shard(
+                    shard, number, input_fields, age_list, context, stream_format
+                )
+            )
+            if len(in_flight) >= window:
+                yield in_flight.pop(0).result()
+        while in_flight:
+            yield in_flight.pop(0).result()
+    finally:
+        for future in in_flight:
+            future.cancel()
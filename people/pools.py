@@ -0,0 +1,581 @@
+"""
+This file contains the pools of pre-sampled faker values that string fields are drawn from.
+
+Calling faker for every person is slow, so each provider is sampled once per process
+and locale into a pool of POOL_SIZE values, with a seed derived from the name of the
+pool so that a pool holds the same values in every process. The values of every row
+are drawn from the pools with vectorized random indices, which are all that depends
+on the seed of a request, so requests do not call faker once the pools are sampled.
+
+Values drawn from a pool with replacement repeat, which is fine for jobs or
+countries but not for values that people rarely share. The pools of
+TEMPLATE_PROVIDERS, such as phone numbers and addresses, therefore hold faker's
+formats with their digit placeholders left in place, and the digits of every row are
+drawn with the row, see fill_placeholders. User names are composed from the user name
+formats of faker instead, every name they contain being drawn from its own pool, see
+compose and provide_user_name in people/providers.py.
+
+Unseeded requests can instead draw from process wide pools, ring buffers that a
+background thread keeps filled and rotates so that the variety of values stays high.
+Seeded requests always draw from the sampled pools, as the shared pools change over
+time and would not be reproducible.
+
+Requests with locales draw from a pool per provider and locale, which the shared
+pools do not hold as they only hold values of faker's default locale.
+"""
+import re
+import string
+import sys
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from functools import cache
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+from django.conf import settings
+
+from people.context import GeneratorContext, thread_faker
+from people.lookups import country_of_address
+
+if TYPE_CHECKING:
+    from faker import Faker
+
+POOL_SIZE = 1024
+
+# The faker providers whose pools hold formats with digit placeholders, see fill_placeholders
+TEMPLATE_PROVIDERS = ("phone_number", "address")
+
+# The placeholders of faker's numerify that are replaced by any digit and by a non
+# zero digit, the placeholders that faker may also replace by nothing are always
+# replaced by a digit
+DIGIT_PLACEHOLDERS = np.frombuffer(b"#!", dtype=np.uint8)
+NON_ZERO_DIGIT_PLACEHOLDERS = np.frombuffer(b"%@", dtype=np.uint8)
+
+# Splits a user name format into the names it contains and the placeholders of
+# faker's bothify, '#' standing for a digit and '?' for a letter
+USER_NAME_PARTS = re.compile(r"{{\s*(\w+)\s*}}|([#?])")
+
+DIGITS = np.array(list(string.digits), dtype=object)
+LETTERS = np.array(list(string.ascii_lowercase), dtype=object)
+
+# The faker providers the batch engine draws from, the shared pools are filled with
+# these from the start whilst other providers are added on their first miss
+SHARED_POOL_PROVIDERS = (
+    "first_name_female",
+    "first_name_male",
+    "last_name",
+    "first_name",
+    "free_email_domain",
+    "phone_number",
+    "job",
+    "address",
+    "country",
+)
+
+sampled_pools = {}
+sampled_pools_lock = threading.Lock()
+
+shared_pools = None
+
+
+@contextmanager
+def placeholders_kept(faker: "Faker"):
+    """Makes faker's numerify return its format unchanged, so that the values sampled
+    within the context keep their digit placeholders. Postcodes that faker draws as
+    random numbers rather than from a format have their digits replaced by
+    placeholders as well
+    """
+    providers = faker.providers
+    generator = providers[0].generator
+    postcode = generator.postcode
+    for provider in providers:
+        provider.numerify = lambda text="###": text
+    generator.postcode = lambda: re.sub("[0-9]", "#", postcode())
+    try:
+        yield
+    finally:
+        for provider in providers:
+            del provider.numerify
+        generator.postcode = postcode
+
+
+def sample_values(faker: "Faker", provider_name: str, size: int) -> np.ndarray:
+    """Samples values from a faker provider, the values of TEMPLATE_PROVIDERS are
+    sampled with their digit placeholders
+
+    Returns:
+        np.ndarray: an object array of size values
+    """
+    provider = getattr(faker, provider_name)
+    values = np.empty(size, dtype=object)
+    if provider_name in TEMPLATE_PROVIDERS:
+        with placeholders_kept(faker):
+            values[:] = [provider() for _ in range(size)]
+    else:
+        values[:] = [provider() for _ in range(size)]
+    return values
+
+
+def sampled_pool(provider_name: str, locale: str = None) -> tuple[np.ndarray, dict]:
+    """Returns the pool of a provider and locale together with the arrays derived
+    from it, the pool is sampled on first use with a seed derived from its name
+    """
+    key = (provider_name, locale)
+    entry = sampled_pools.get(key)
+    if entry is None:
+        pool_name = provider_name if locale is None else f"{locale}:{provider_name}"
+        faker = thread_faker(locale)
+        faker.seed_instance(zlib.crc32(pool_name.encode("utf-8")))
+        pool = sample_values(faker, provider_name, POOL_SIZE)
+        with sampled_pools_lock:
+            entry = sampled_pools.setdefault(key, (pool, {}))
+    return entry
+
+
+def draw_uniforms(rng: np.random.Generator, number: int, count: int) -> np.ndarray:
+    """Draws count uniform numbers per row, one draw of the row generator per column
+
+    Returns:
+        np.ndarray: an array of number rows and count columns
+    """
+    uniforms = np.empty((number, count))
+    for column in range(count):
+        uniforms[:, column] = rng.random(number)
+    return uniforms
+
+
+def encode_templates(pool: np.ndarray) -> np.ndarray:
+    """Encodes the templates of a pool as a fixed width array of UTF-8 bytes"""
+    return np.array([template.encode("utf-8") for template in pool], dtype=bytes)
+
+
+def placeholder_masks(
+    templates: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Locates the placeholders of encoded templates
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: the bytes of every template, one template per row, and where they hold a placeholder of any digit and of a non zero digit
+    """
+    chars = templates.view(np.uint8).reshape(len(templates), templates.dtype.itemsize)
+    return (
+        chars,
+        np.isin(chars, DIGIT_PLACEHOLDERS),
+        np.isin(chars, NON_ZERO_DIGIT_PLACEHOLDERS),
+    )
+
+
+def count_placeholders(templates: np.ndarray) -> int:
+    """The largest number of placeholders of an encoded template"""
+    _, digits, non_zero_digits = placeholder_masks(templates)
+    return int((digits | non_zero_digits).sum(axis=1).max(initial=0))
+
+
+def fill_placeholders(templates: np.ndarray, uniforms: np.ndarray) -> np.ndarray:
+    """Replaces the digit placeholders of templates, placeholder j of a template is
+    replaced by the digit drawn from column j of the uniforms of its row. The
+    templates are handled as a matrix of bytes, so every row is filled at once
+
+    Args:
+        templates (np.ndarray): encoded templates, see encode_templates
+        uniforms (np.ndarray): a row of uniforms per template with a column per placeholder
+
+    Returns:
+        np.ndarray: an object array of the filled values
+    """
+    chars, digits, non_zero_digits = placeholder_masks(templates)
+    placeholders = digits | non_zero_digits
+    if placeholders.any():
+        ordinals = np.maximum(np.cumsum(placeholders, axis=1) - 1, 0)
+        drawn = np.take_along_axis(uniforms, ordinals, axis=1)
+        chars = np.where(digits, ord("0") + (drawn * 10).astype(np.uint8), chars)
+        chars = np.where(
+            non_zero_digits, ord("1") + (drawn * 9).astype(np.uint8), chars
+        )
+    filled = np.ascontiguousarray(chars, dtype=np.uint8).view(templates.dtype)
+    return np.char.decode(filled.ravel(), "utf-8").astype(object)
+
+
+def user_name_slug(locale: str = None) -> Callable[[str], str]:
+    """Returns the function faker turns user names into ascii slugs with for a locale"""
+    from faker.utils.text import slugify
+
+    internet = thread_faker(locale).user_name.__self__
+    return lambda value: slugify(internet._to_ascii(value.lower()), allow_unicode=True)
+
+
+@cache
+def user_name_formats(locale: str = None) -> tuple[tuple[tuple[str, str], ...], ...]:
+    """Splits the user name formats of faker for a locale into their parts
+
+    Args:
+        locale (str, optional): a faker locale. Defaults to faker's default locale.
+
+    Returns:
+        tuple[tuple[tuple[str, str], ...], ...]: the parts of each format, a ('name', provider name) part for every name, a ('#', '') part for every digit, a ('?', '') part for every letter and a ('text', slug) part for the text in between
+    """
+    slug = user_name_slug(locale)
+    formats = []
+    for user_name_format in thread_faker(locale).user_name.__self__.user_name_formats:
+        parts, position = [], 0
+        for match in USER_NAME_PARTS.finditer(user_name_format):
+            text = slug(user_name_format[position : match.start()])
+            if text:
+                parts.append(("text", text))
+            if match.group(1):
+                parts.append(("name", match.group(1)))
+            else:
+                parts.append((match.group(2), ""))
+            position = match.end()
+        text = slug(user_name_format[position:])
+        if text:
+            parts.append(("text", text))
+        formats.append(tuple(parts))
+    return tuple(formats)
+
+
+class ValuePools:
+    """The pools of faker values a request draws from, pools are looked up once per
+    request so that every chunk of a request and every dependent batch share them
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def entry(self, provider_name: str, locale: str = None) -> tuple[np.ndarray, dict]:
+        """Returns the pool of a provider together with the arrays derived from it"""
+        key = (provider_name, locale)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = sampled_pool(provider_name, locale)
+        return entry
+
+    def pool(self, provider_name: str, locale: str = None) -> np.ndarray:
+        """Returns the pool of values for a faker provider method, for example 'job'
+
+        Returns:
+            np.ndarray: an object array of values, the templates of TEMPLATE_PROVIDERS
+        """
+        return self.entry(provider_name, locale)[0]
+
+    def placeholders(self, provider_name: str, locale: str = None) -> int:
+        """The largest number of placeholders of a template of a pool, 0 for the
+        pools of providers that are not TEMPLATE_PROVIDERS
+        """
+        if provider_name not in TEMPLATE_PROVIDERS:
+            return 0
+        return self.derived(
+            provider_name,
+            "placeholders",
+            lambda pool: count_placeholders(self.templates(provider_name, locale)),
+            locale,
+        )
+
+    def templates(self, provider_name: str, locale: str = None) -> np.ndarray:
+        """Returns the templates of a pool encoded as UTF-8, see encode_templates"""
+        return self.derived(provider_name, "templates", encode_templates, locale)
+
+    def values(
+        self,
+        provider_name: str,
+        indices: np.ndarray,
+        uniforms: np.ndarray,
+        locale: str = None,
+    ) -> np.ndarray:
+        """Returns the values of a pool at the given indices, templates being filled
+        with the digits drawn from uniforms
+
+        Args:
+            provider_name (str): the faker provider method backing the pool
+            indices (np.ndarray): an index into the pool per row
+            uniforms (np.ndarray): the uniforms of each row, with a column per placeholder, see placeholders
+            locale (str, optional): the locale of the pool. Defaults to faker's default locale.
+
+        Returns:
+            np.ndarray: an object array of a value per row
+        """
+        if provider_name not in TEMPLATE_PROVIDERS:
+            return self.pool(provider_name, locale)[indices]
+        templates = self.templates(provider_name, locale)
+        return fill_placeholders(templates[indices], uniforms)
+
+    def draw(
+        self,
+        provider_name: str,
+        number: int,
+        rng: np.random.Generator,
+        locale: str = None,
+    ) -> np.ndarray:
+        """Draws a column of values from a pool with vectorized random indices
+
+        Args:
+            provider_name (str): the faker provider method backing the pool
+            number (int): the length of the column
+            rng (np.random.Generator): the generator the indices and digits are drawn from
+            locale (str, optional): the locale of the pool. Defaults to faker's default locale.
+
+        Returns:
+            np.ndarray: an object array of length number
+        """
+        pool = self.pool(provider_name, locale)
+        indices = rng.integers(0, len(pool), size=number)
+        uniforms = draw_uniforms(rng, number, self.placeholders(provider_name, locale))
+        return self.values(provider_name, indices, uniforms, locale)
+
+    def compose(
+        self,
+        parts: tuple[tuple[str, str], ...],
+        uniforms: np.ndarray,
+        locale: str = None,
+    ) -> np.ndarray:
+        """Composes a user name per row from the parts of a user name format, see
+        user_name_formats, part j of a row being drawn with column j of its uniforms
+
+        Args:
+            parts (tuple[tuple[str, str], ...]): the parts of a user name format
+            uniforms (np.ndarray): the uniforms of each row, with a column per part
+            locale (str, optional): the locale of the name pools. Defaults to faker's default locale.
+
+        Returns:
+            np.ndarray: an object array of a user name per row
+        """
+        user_names = np.full(len(uniforms), "", dtype=object)
+        for position, (kind, value) in enumerate(parts):
+            drawn = uniforms[:, position]
+            if kind == "name":
+                slugs = self.derived(
+                    value,
+                    "slugs",
+                    lambda pool: np.array(
+                        list(map(user_name_slug(locale), pool)), dtype=object
+                    ),
+                    locale,
+                )
+                user_names = user_names + slugs[(drawn * len(slugs)).astype(np.int64)]
+            elif kind == "#":
+                user_names = user_names + DIGITS[(drawn * 10).astype(np.int64)]
+            elif kind == "?":
+                user_names = user_names + LETTERS[(drawn * 26).astype(np.int64)]
+            else:
+                user_names = user_names + value
+        return user_names
+
+    def derived(
+        self, provider_name: str, name: str, derive, locale: str = None
+    ) -> np.ndarray | int:
+        """Returns an array derived from a pool, such as the demonym of each
+        country of the country pool, the array is computed once per pool
+
+        Args:
+            provider_name (str): the faker provider method backing the pool
+            name (str): the name the derived array is cached under
+            derive (callable): computes the derived array from the pool
+            locale (str, optional): the locale of the pool. Defaults to faker's default locale.
+
+        Returns:
+            np.ndarray | int: an array aligned with the pool it was derived from, or a property of the pool
+        """
+        pool, derived_values = self.entry(provider_name, locale)
+        value = derived_values.get(name)
+        if value is None:
+            value = derived_values[name] = derive(pool)
+        return value
+
+    def countries_of_addresses(self) -> np.ndarray:
+        """Returns the country deduced from each entry of the address pool,
+        None where the address does not contain a recognised two letter code
+        """
+        return self.derived(
+            "address",
+            "countries",
+            lambda addresses: np.array(
+                [country_of_address(address) for address in addresses], dtype=object
+            ),
+        )
+
+
+class SharedPools:
+    """Process wide ring buffers of pre-generated faker values, a pool grows by
+    refill_size values per refill until it holds capacity values or max_bytes,
+    from then on every refill overwrites its oldest refill_size values
+
+    Args:
+        capacity (int): the maximum number of values per pool
+        max_bytes (int): the maximum approximate memory held by the values of a pool
+        refill_size (int): the number of values sampled per pool and refill
+    """
+
+    def __init__(self, capacity: int, max_bytes: int, refill_size: int):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.refill_size = refill_size
+        self.entries = {}
+        self.cursors = Counter()
+        self.sizes_in_bytes = Counter()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.wanted = set(SHARED_POOL_PROVIDERS)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get(self, provider_name: str, size: int) -> tuple[np.ndarray, dict] | None:
+        """Returns the current pool of a provider and the arrays derived from it,
+        or None when the pool holds fewer than size values. Pools are replaced
+        rather than modified by a refill, so the returned pool never changes
+
+        Args:
+            provider_name (str): the faker provider method backing the pool
+            size (int): the minimum number of values the pool must hold
+
+        Returns:
+            tuple[np.ndarray, dict] | None: the pool and its derived arrays
+        """
+        with self.lock:
+            entry = self.entries.get(provider_name)
+            if entry is None or len(entry[0]) < size:
+                self.misses[provider_name] += 1
+                self.wanted.add(provider_name)
+                return None
+            self.hits[provider_name] += 1
+            return entry
+
+    def refill(self, provider_name: str) -> None:
+        """Samples refill_size new values into the pool of a provider, the values of
+        TEMPLATE_PROVIDERS are sampled with their digit placeholders like the values
+        of the sampled pools
+        """
+        fresh = sample_values(thread_faker(), provider_name, self.refill_size)
+
+        with self.lock:
+            entry = self.entries.get(provider_name)
+        pool = entry[0] if entry else np.empty(0, dtype=object)
+        size_in_bytes = self.sizes_in_bytes[provider_name]
+
+        if len(pool) < self.capacity and size_in_bytes < self.max_bytes:
+            fresh = fresh[: self.capacity - len(pool)]
+            pool = np.concatenate((pool, fresh))
+            size_in_bytes += sum(map(sys.getsizeof, fresh))
+        else:
+            pool = pool.copy()
+            positions = (self.cursors[provider_name] + np.arange(len(fresh))) % len(
+                pool
+            )
+            size_in_bytes += sum(map(sys.getsizeof, fresh)) - sum(
+                map(sys.getsizeof, pool[positions])
+            )
+            pool[positions] = fresh
+            self.cursors[provider_name] = int(positions[-1] + 1) % len(pool)
+
+        with self.lock:
+            self.entries[provider_name] = (pool, {})
+            self.sizes_in_bytes[provider_name] = size_in_bytes
+
+    def refill_all(self) -> None:
+        """Refills the pool of every provider that has been filled or missed"""
+        with self.lock:
+            wanted = sorted(self.wanted)
+        for provider_name in wanted:
+            self.refill(provider_name)
+
+    def run(self, interval: float) -> None:
+        """Refills the pools every interval seconds until stopped"""
+        self.refill_all()
+        while not self.stopped.wait(interval):
+            self.refill_all()
+
+    def start(self, interval: float) -> None:
+        """Starts the background thread that refills the pools"""
+        self.thread = threading.Thread(
+            target=self.run, args=(interval,), name="shared-pools", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stops the background thread, waiting for a refill in progress"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Returns the number of hits, misses, values and approximate bytes per pool"""
+        with self.lock:
+            return {
+                provider_name: {
+                    "hits": self.hits[provider_name],
+                    "misses": self.misses[provider_name],
+                    "size": len(self.entries[provider_name][0])
+                    if provider_name in self.entries
+                    else 0,
+                    "bytes": self.sizes_in_bytes[provider_name],
+                }
+                for provider_name in sorted(self.wanted)
+            }
+
+
+class SharedValuePools(ValuePools):
+    """The value pools of an unseeded request, pools are taken from the shared pools
+    once they hold at least POOL_SIZE values and from the sampled pools otherwise
+
+    Args:
+        shared (SharedPools): the process wide pools
+    """
+
+    def __init__(self, shared: SharedPools):
+        super().__init__()
+        self.shared = shared
+
+    def entry(self, provider_name: str, locale: str = None) -> tuple[np.ndarray, dict]:
+        if locale is not None:
+            return super().entry(provider_name, locale)
+        key = (provider_name, locale)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.shared.get(provider_name, POOL_SIZE) or sampled_pool(
+                provider_name
+            )
+            self.entries[key] = entry
+        return entry
+
+
+def start_shared_pools() -> SharedPools | None:
+    """Starts the shared pools and their refill thread if settings.PERSON_SHARED_POOLS
+    is enabled, an already started instance is reused
+
+    Returns:
+        SharedPools | None: the started shared pools, None when disabled
+    """
+    global shared_pools
+    if shared_pools is None and settings.PERSON_SHARED_POOLS:
+        shared_pools = SharedPools(
+            settings.PERSON_SHARED_POOL_CAPACITY,
+            settings.PERSON_SHARED_POOL_MAX_BYTES,
+            settings.PERSON_SHARED_POOL_REFILL_SIZE,
+        )
+        shared_pools.start(settings.PERSON_SHARED_POOL_REFILL_INTERVAL)
+    return shared_pools
+
+
+def stop_shared_pools() -> None:
+    """Stops the shared pools, if they were started"""
+    global shared_pools
+    if shared_pools is not None:
+        shared_pools.stop()
+        shared_pools = None
+
+
+def request_pools(context: GeneratorContext) -> ValuePools:
+    """Returns the value pools of a request, unseeded requests use the shared pools
+    when they have been started
+
+    Args:
+        context (GeneratorContext): the random state of the request
+
+    Returns:
+        ValuePools: the value pools of the request
+    """
+    if shared_pools is not None and not context.seeded:
+        return SharedValuePools(shared_pools)
+    return ValuePools()
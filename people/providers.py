@@ -0,0 +1,348 @@
+"""
+This file contains the registry of field providers used by the batch engine.
+
+Every field that can be requested maps to exactly one provider, a function that
+generates the column of that field for a whole batch. Providers ask the batch for
+the columns they depend on, such as the gender of each row for its name, so a column
+is only ever computed when it is output or needed by another output column.
+While a provider runs, batch.rng is the row generator of its field, see
+RowGenerator in people/context.py, so a column does not depend on which other
+columns were computed.
+
+When a request has locales, every row is assigned one of them and its string
+columns are drawn from the pools of its locale, one vectorized draw per locale. The
+country of such a row is the country of its locale, its nationality follows from it.
+
+Phone numbers, addresses and the user names of emails get digits and names drawn for
+every row, rather than whole values drawn from a pool, so that they are about as
+varied as the values of faker itself, see people/pools.py.
+"""
+import time
+from typing import Callable
+
+import numpy as np
+
+from people import metrics
+from people.concurrency import check_cancelled
+from people.context import DEPENDENT_STRIDE, GeneratorContext
+from people.derivations import (
+    ages_from_birthdates,
+    birthdates_within_ages,
+    deceased_from_ages,
+    occupations_from_ages,
+    random_birthdates,
+)
+from people.distributions import age_distribution
+from people.lookups import demonym_codes, draw_nationalities, locale_countries
+from people.pools import ValuePools, draw_uniforms, user_name_formats
+
+GENDERS = ("F", "M")
+
+FIELD_PROVIDERS = {}
+
+
+def register_provider(*fields: str) -> Callable:
+    """Registers the decorated function as the provider of the given fields
+
+    Args:
+        fields (str): the names of the columns the function provides
+
+    Returns:
+        Callable: a decorator returning the function unchanged
+    """
+
+    def decorator(provider: Callable) -> Callable:
+        for field in fields:
+            FIELD_PROVIDERS[field] = provider
+        return provider
+
+    return decorator
+
+
+class BatchBuilder:
+    """Lazily computes the columns of a batch, each column is computed at most once
+
+    Args:
+        number (int): the number of rows in the batch
+        input_fields (list[str]): the fields requested for the batch
+        age_list (np.ndarray): the potential ages as specified by the user, or None
+        pools (ValuePools): the pools string fields are drawn from
+        context (GeneratorContext): the random state of the batch
+    """
+
+    def __init__(
+        self,
+        number: int,
+        input_fields: list[str],
+        age_list: np.ndarray,
+        pools: ValuePools,
+        context: GeneratorContext,
+    ):
+        self.number = number
+        self.input_fields = input_fields
+        self.age_list = age_list if isinstance(age_list, np.ndarray) else None
+        self.ages = age_distribution(context.ages, self.age_list)
+        self.pools = pools
+        self.context = context
+        self.rng = None
+        self.today = context.today
+        self.requested = set(input_fields)
+        self.locales = list(context.locales) if context.locales else None
+        self.columns = {}
+        self.metrics = metrics.get_metrics()
+        self.nested_seconds = 0.0
+
+    def column(self, field: str) -> np.ndarray:
+        """Returns the column of a field, computing it with its provider on first use
+
+        Args:
+            field (str): the name of a registered field, or of an internal column
+
+        Returns:
+            np.ndarray: a column of length number
+        """
+        column = self.columns.get(field)
+        if column is None:
+            check_cancelled()
+            outer_rng = self.rng
+            self.rng = self.context.row_generator(field, self.number)
+            try:
+                if self.metrics is None:
+                    column = FIELD_PROVIDERS[field](self)
+                else:
+                    column = self.timed_column(field)
+            finally:
+                self.rng = outer_rng
+            self.columns[field] = column
+        return column
+
+    def timed_column(self, field: str) -> np.ndarray:
+        """Computes the column of a field and records the time spent by its provider,
+        excluding the time spent computing the columns it depends on
+        """
+        outer_nested_seconds = self.nested_seconds
+        self.nested_seconds = 0.0
+        start = time.perf_counter()
+        column = FIELD_PROVIDERS[field](self)
+        seconds = time.perf_counter() - start
+        self.metrics.observe_field(field, seconds - self.nested_seconds, len(column))
+        self.nested_seconds = outer_nested_seconds + seconds
+        return column
+
+    def draw(self, provider_name: str) -> np.ndarray:
+        """Draws a column of the batch from the named value pool, with locales the
+        rows of each locale are drawn from the pool of that locale
+        """
+        if self.locales is None:
+            return self.pools.draw(provider_name, self.number, self.rng)
+        uniforms = self.rng.random(self.number)
+        placeholders = draw_uniforms(
+            self.rng,
+            self.number,
+            max(
+                self.pools.placeholders(provider_name, locale)
+                for locale in self.locales
+            ),
+        )
+        column = np.empty(self.number, dtype=object)
+        for locale, rows in self.locale_rows():
+            pool = self.pools.pool(provider_name, locale)
+            column[rows] = self.pools.values(
+                provider_name,
+                (uniforms[rows] * len(pool)).astype(np.int64),
+                placeholders[rows],
+                locale,
+            )
+        return column
+
+    def locale_rows(self) -> list[tuple[str | None, np.ndarray]]:
+        """Returns the indices of the rows of each locale of the batch, all of the
+        rows being of faker's default locale when the request has no locales
+        """
+        if self.locales is None:
+            return [(None, np.arange(self.number))]
+        locale_indices = self.column("_locale")
+        return [
+            (locale, rows)
+            for locale, rows in (
+                (locale, np.flatnonzero(locale_indices == index))
+                for index, locale in enumerate(self.locales)
+            )
+            if len(rows)
+        ]
+
+
+@register_provider("_locale")
+def provide_locale(batch: BatchBuilder) -> np.ndarray:
+    """The index into batch.locales of the locale of each row"""
+    weights = np.fromiter(batch.context.locales.values(), dtype=float)
+    return batch.rng.choice(len(weights), size=batch.number, p=weights)
+
+
+@register_provider("_locale_country")
+def provide_locale_country(batch: BatchBuilder) -> np.ndarray:
+    """The country of the locale of each row, None where the locale has no region"""
+    return locale_countries(batch.locales)[batch.column("_locale")]
+
+
+@register_provider("gender")
+def provide_gender(batch: BatchBuilder) -> np.ndarray:
+    return np.array(GENDERS)[batch.rng.integers(0, len(GENDERS), size=batch.number)]
+
+
+@register_provider("name")
+def provide_name(batch: BatchBuilder) -> np.ndarray:
+    first_names = np.where(
+        batch.column("gender") == "F",
+        batch.draw("first_name_female"),
+        batch.draw("first_name_male"),
+    )
+    return first_names + " " + batch.draw("last_name")
+
+
+@register_provider("_user_name")
+def provide_user_name(batch: BatchBuilder) -> np.ndarray:
+    """Composes the user name of each row from one of the user name formats of its
+    locale, every part of the format being drawn with the row, see ValuePools.compose
+    """
+    formats = {locale: user_name_formats(locale) for locale in batch.locales or [None]}
+    choices = batch.rng.random(batch.number)
+    uniforms = draw_uniforms(
+        batch.rng,
+        batch.number,
+        max(
+            len(parts)
+            for parts_of_locale in formats.values()
+            for parts in parts_of_locale
+        ),
+    )
+    column = np.empty(batch.number, dtype=object)
+    for locale, rows in batch.locale_rows():
+        chosen = (choices[rows] * len(formats[locale])).astype(np.int64)
+        for index, parts in enumerate(formats[locale]):
+            format_rows = rows[chosen == index]
+            column[format_rows] = batch.pools.compose(
+                parts, uniforms[format_rows], locale
+            )
+    return column
+
+
+@register_provider("email")
+def provide_email(batch: BatchBuilder) -> np.ndarray:
+    return batch.column("_user_name") + "@" + batch.draw("free_email_domain")
+
+
+@register_provider("birthdate")
+def provide_birthdate(batch: BatchBuilder) -> np.ndarray:
+    if batch.ages is not None:
+        return birthdates_within_ages(batch.column("age"), batch.today, batch.rng)
+    return random_birthdates(batch.number, batch.today, batch.rng)
+
+
+@register_provider("age")
+def provide_age(batch: BatchBuilder) -> np.ndarray:
+    if batch.ages is not None:
+        return batch.ages.sample(batch.number, batch.rng)
+    return ages_from_birthdates(batch.column("birthdate"), batch.today)
+
+
+@register_provider("deceased")
+def provide_deceased(batch: BatchBuilder) -> np.ndarray:
+    return deceased_from_ages(batch.column("age"), batch.rng)
+
+
+@register_provider("phone")
+def provide_phone(batch: BatchBuilder) -> np.ndarray:
+    return batch.draw("phone_number")
+
+
+@register_provider("occupation")
+def provide_occupation(batch: BatchBuilder) -> np.ndarray:
+    return occupations_from_ages(batch.column("age"), batch.draw("job"), batch.rng)
+
+
+@register_provider("_address_index")
+def provide_address_index(batch: BatchBuilder) -> np.ndarray:
+    return batch.rng.integers(0, len(batch.pools.pool("address")), size=batch.number)
+
+
+@register_provider("address")
+def provide_address(batch: BatchBuilder) -> np.ndarray:
+    if batch.locales is not None:
+        return batch.draw("address")
+    uniforms = draw_uniforms(
+        batch.rng, batch.number, batch.pools.placeholders("address")
+    )
+    return batch.pools.values("address", batch.column("_address_index"), uniforms)
+
+
+@register_provider("_country_index")
+def provide_country_index(batch: BatchBuilder) -> np.ndarray:
+    return batch.rng.integers(0, len(batch.pools.pool("country")), size=batch.number)
+
+
+@register_provider("_address_deduced")
+def provide_address_deduced(batch: BatchBuilder) -> np.ndarray:
+    """Whether the country of each row is deduced from its address, which is only
+    the case where the address was requested and contains a country code.
+    Addresses of locales are not deduced from, their rows take the country of their locale
+    """
+    if "address" not in batch.requested or batch.locales is not None:
+        return np.zeros(batch.number, dtype=bool)
+    address_countries = batch.pools.countries_of_addresses()
+    deduced = batch.pools.derived(
+        "address", "deduced", lambda addresses: address_countries != None
+    )
+    return deduced[batch.column("_address_index")]
+
+
+@register_provider("country")
+def provide_country(batch: BatchBuilder) -> np.ndarray:
+    countries = batch.pools.pool("country")[batch.column("_country_index")]
+    if batch.locales is not None:
+        locale_country = batch.column("_locale_country")
+        return np.where(locale_country != None, locale_country, countries)
+    deduced = batch.column("_address_deduced")
+    if not deduced.any():
+        return countries
+    address_countries = batch.pools.countries_of_addresses()
+    return np.where(
+        deduced, address_countries[batch.column("_address_index")], countries
+    )
+
+
+@register_provider("_country_code")
+def provide_country_code(batch: BatchBuilder) -> np.ndarray:
+    """The demonym index of the country of each row, see lookups.demonym_codes"""
+    pools = batch.pools
+    codes = pools.derived("country", "codes", demonym_codes)[
+        batch.column("_country_index")
+    ]
+    if batch.locales is not None:
+        locale_country = batch.column("_locale_country")
+        locale_codes = demonym_codes(locale_countries(batch.locales))
+        return np.where(
+            locale_country != None, locale_codes[batch.column("_locale")], codes
+        )
+    deduced = batch.column("_address_deduced")
+    if not deduced.any():
+        return codes
+    address_countries = pools.countries_of_addresses()
+    address_codes = pools.derived(
+        "address", "country_codes", lambda addresses: demonym_codes(address_countries)
+    )
+    return np.where(deduced, address_codes[batch.column("_address_index")], codes)
+
+
+@register_provider("nationality")
+def provide_nationality(batch: BatchBuilder) -> np.ndarray:
+    return draw_nationalities(batch.column("_country_code"), batch.rng)
+
+
+@register_provider("dependents")
+def provide_dependent_counts(batch: BatchBuilder) -> np.ndarray:
+    """Draws the number of dependents of each row, the dependents themselves are
+    generated by generate_batch in people/batch.py once every other column of the
+    parents is known
+    """
+    return batch.rng.integers(0, DEPENDENT_STRIDE, size=batch.number)
@@ -0,0 +1,82 @@
+"""
+This file contains the sending of streamed response bodies off the event loop.
+
+The ASGI handler of Django 4.1 sends a StreamingHttpResponse by iterating its body
+synchronously on the event loop, so every chunk of a streamed response would be
+generated and encoded there, stalling every other connection meanwhile.
+OffloadedASGIHandler instead iterates the body of an OffloadedStreamingHttpResponse
+asynchronously, every chunk being produced on the CPU executor by OffloadedStream,
+see people/concurrency.py. Other responses are sent as Django sends them, and
+the synchronous iteration of the body remains available to the test client.
+"""
+from typing import AsyncIterator
+
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.http.response import StreamingHttpResponse
+from asgiref.sync import sync_to_async
+
+from people.concurrency import OffloadedStream
+
+
+class OffloadedStreamingHttpResponse(StreamingHttpResponse):
+    """A streaming response whose chunks are produced on the CPU executor when it is
+    sent by OffloadedASGIHandler
+
+    Args:
+        streaming_content (OffloadedStream): the streamed body
+    """
+
+    def __init__(self, streaming_content: OffloadedStream, *args, **kwargs):
+        super().__init__(streaming_content, *args, **kwargs)
+        self.stream = streaming_content
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield self.make_bytes(chunk)
+
+
+class OffloadedASGIHandler(ASGIHandler):
+    """The ASGI handler of Django, sending the body of an
+    OffloadedStreamingHttpResponse asynchronously
+    """
+
+    async def send_response(self, response, send):
+        if not isinstance(response, OffloadedStreamingHttpResponse):
+            return await super().send_response(response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            response_headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            response_headers.append(
+                (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": response_headers,
+            }
+        )
+        try:
+            async for part in response:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            await send({"type": "http.response.body"})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def get_asgi_application() -> OffloadedASGIHandler:
+    """Sets up Django and returns its ASGI application, as
+    django.core.asgi.get_asgi_application does
+    """
+    django.setup(set_prefix=False)
+    return OffloadedASGIHandler()
@@ -0,0 +1,127 @@
+"""
+This file contains the validation of requested field names and the suggestion of
+a valid field for a mistyped one.
+
+Rather than spell checking against an English dictionary, suggestions are looked up
+in an index of the deletions of every field name, built once at import. A mistyped
+field and a field name within MAX_DISTANCE edits of one another share a deletion,
+so only the few fields found through the index are compared by edit distance.
+The validation of a list of fields is memoized, so repeated requests with the same
+typos are answered from a bounded LRU cache.
+"""
+from collections import defaultdict
+from functools import lru_cache
+from itertools import combinations
+
+from people.fields import OUTPUT_TO_INPUT_FIELD_MAPPING, USER_QUERY_FIELDS
+
+MAX_DISTANCE = 2
+
+VALIDATION_CACHE_SIZE = 1024
+
+
+def deletions(word: str, max_distance: int) -> set[str]:
+    """Returns every string obtained by deleting up to max_distance characters of a word"""
+    return {
+        "".join(word[i] for i in range(len(word)) if i not in deleted)
+        for count in range(min(max_distance, len(word)) + 1)
+        for deleted in combinations(range(len(word)), count)
+    }
+
+
+def edit_distance(source: str, target: str) -> int:
+    """Computes the optimal string alignment distance of two strings, the number
+    of insertions, deletions, substitutions and adjacent transpositions needed to
+    turn source into target
+    """
+    previous_previous = None
+    previous = list(range(len(target) + 1))
+    for i, source_character in enumerate(source, start=1):
+        current = [i] + [0] * len(target)
+        for j, target_character in enumerate(target, start=1):
+            cost = source_character != target_character
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if (
+                previous_previous is not None
+                and i > 1
+                and j > 1
+                and source_character == target[j - 2]
+                and source[i - 2] == target_character
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def allowed_distance(word: str) -> int:
+    """The edit distance within which a field is suggested for a word, short words
+    allow fewer edits so that unrelated words are not matched
+    """
+    return min(MAX_DISTANCE, max(1, len(word) // 3))
+
+
+class FieldSuggester:
+    """Suggests the closest of a set of field names for a mistyped field
+
+    Args:
+        fields (set[str]): the valid field names
+        max_distance (int, optional): the largest edit distance of a suggestion. Defaults to MAX_DISTANCE.
+    """
+
+    def __init__(self, fields: set[str], max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.max_length = max(map(len, fields)) + max_distance
+        self.index = defaultdict(set)
+        for field in fields:
+            for variant in deletions(field, max_distance):
+                self.index[variant].add(field)
+
+    def suggest(self, word: str) -> str | None:
+        """Returns the field closest to a word, ties are broken alphabetically.
+        The output name of a field, such as 'sex', suggests its input name
+
+        Args:
+            word (str): a field name that is not valid
+
+        Returns:
+            str | None: the suggested field, None if no field is close enough
+        """
+        word = word.lower()
+        if word in OUTPUT_TO_INPUT_FIELD_MAPPING:
+            return OUTPUT_TO_INPUT_FIELD_MAPPING[word]
+        if len(word) > self.max_length:
+            return None
+
+        candidates = set()
+        for variant in deletions(word, self.max_distance):
+            candidates.update(self.index.get(variant, ()))
+
+        distance = allowed_distance(word)
+        suggestions = [
+            (edit_distance(word, candidate), candidate) for candidate in candidates
+        ]
+        suggestions = [
+            suggestion for suggestion in suggestions if suggestion[0] <= distance
+        ]
+        return min(suggestions)[1] if suggestions else None
+
+
+field_suggester = FieldSuggester(USER_QUERY_FIELDS)
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def validate_fields(fields: tuple[str]) -> tuple[bool, str | None, str | None]:
+    """Validates requested field names, the result is memoized per tuple of fields
+
+    Args:
+        fields (tuple[str]): the requested field names
+
+    Returns:
+        3 element tuple: whether the fields are valid, the first erroneous field and a suggestion for it, or None
+    """
+    for field in fields:
+        if field not in USER_QUERY_FIELDS:
+            return False, field, field_suggester.suggest(field)
+    return True, None, None
@@ -1,21 +1,97 @@
 from django.test import TestCase
-from django.test import AsyncClient
+from django.test import AsyncClient, override_settings
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
 
 from unittest.mock import patch, Mock
 from copy import copy, deepcopy
 from asgiref.sync import async_to_sync
 from pprint import pprint
+from datetime import date
+import os
+import re
+import asyncio
+import threading
+import time
+import csv
+import io
+import tempfile
+import itertools
+import zipfile
+import gzip
+import zlib
+import brotli
+import msgpack
+from dateutil.relativedelta import relativedelta
 import ujson
 import numpy as np
-from faker import Faker
 
+from people import (
+    benchmarks,
+    cache,
+    compression,
+    concurrency,
+    distributions,
+    exporters,
+    jobs,
+    metrics,
+    multiplex,
+    pages,
+    parallel,
+    streaming,
+)
+from people import views
 from people.views import PersonAPIClass, RaisedResponse
-from people.dataclass import Person, generate_persons
-from people.fields import INPUT_TO_OUTPUT_FIELD_MAPPING
+from people.dataclass import generate_persons, iter_persons
+from people.context import CHUNK_SIZE, GeneratorContext
+from people.batch import (
+    OUTPUT_FIELD_ORDER,
+    dependent_offsets,
+    generate_batch,
+    generate_columns,
+    generate_dependents,
+    generate_records,
+)
+from people import pools
+from people.pools import (
+    POOL_SIZE,
+    SharedPools,
+    SharedValuePools,
+    ValuePools,
+    fill_placeholders,
+)
+from people.providers import FIELD_PROVIDERS, BatchBuilder
+from people.fields import USER_QUERY_FIELDS
+from people import suggestions
+from people.suggestions import edit_distance, field_suggester, validate_fields
+from people.derivations import (
+    ages_from_birthdates,
+    birthdates_from_ages,
+    birthdates_within_ages,
+    deceased_from_ages,
+    occupations_from_ages,
+)
+from people import lookups
+from people.lookups import (
+    DEMONYMS,
+    PLACE_DEMONYM_CODES,
+    country_of_address,
+    demonym_codes,
+    draw_nationalities,
+)
+from people.serializers import PersonSerializer
+from people.encoders import (
+    SchemaError,
+    encode_batches,
+    encode_ndjson,
+    encode_people,
+    validate_schema,
+)
 
 
 class PersonAPIClassTests(TestCase):
     content_tested_dict = {"content": "tested"}
+    strict_request_body = {"strict": True}
     input_and_output_queries = (
         ["email", "gender", "birthdate", "name"],
         ["mail", "sex", "birthdate", "name"],
@@ -46,6 +122,441 @@ class PersonAPIClassTests(TestCase):
         self.assertEqual(response.content, formatted_content)
         self.assertEqual(response.status_code, 200)
 
+    async def test_get_streamed(self):
+        for stream_format in ("ndjson", "json"):
+            request_data = ujson.dumps({"number": 25, "stream": stream_format})
+            response = await self.client.generic("GET", "/api/persons/", request_data)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.streaming, True)
+
+            body = b"".join(response.streaming_content).decode("utf-8")
+            if stream_format == "ndjson":
+                people = [ujson.loads(line) for line in body.splitlines()]
+            else:
+                people = ujson.loads(body)
+            self.assertEqual(len(people), 25)
+            self.assertEqual(
+                sorted(people[0].keys()), sorted(self.input_and_output_queries[0])
+            )
+
+        request_data = ujson.dumps({"number": 1, "stream": "xml"})
+        response = await self.client.generic("GET", "/api/persons/", request_data)
+        self.assertEqual(response.status_code, 412)
+
+    async def test_get_seeded(self):
+        request_body = {
+            "number": 30,
+            "seed": 117,
+            "reference_date": "2022-12-25",
+            "fields": ["name", "email", "gender", "birthdate", "age", "address"],
+        }
+        first = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        second = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.content, second.content)
+
+        request_body["stream"] = "json"
+        streamed = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(b"".join(streamed.streaming_content), first.content)
+
+        request_body["seed"] = 118
+        different = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertNotEqual(b"".join(different.streaming_content), first.content)
+
+    async def test_get_cached(self):
+        request_body = ujson.dumps(
+            {
+                "number": 5,
+                "seed": 117,
+                "fields": ["name", "email", "gender", "birthdate"],
+            }
+        )
+        with self.settings(PERSON_RESPONSE_CACHE_BACKEND="memory"):
+            response_cache = cache.get_response_cache()
+            first = await self.client.generic("GET", "/api/persons/", request_body)
+            second = await self.client.generic("GET", "/api/persons/", request_body)
+            revalidated = await self.client.generic(
+                "GET", "/api/persons/", request_body, **{"If-None-Match": first["ETag"]}
+            )
+            unseeded = await self.client.generic(
+                "GET", "/api/persons/", ujson.dumps({"number": 5})
+            )
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+        self.assertEqual(unseeded.has_header("ETag"), False)
+        self.assertEqual(response_cache.stats()["not_modified"] >= 1, True)
+
+    async def test_get_exported_uncached(self):
+        request_body = {"number": 3, "seed": 1}
+        with self.settings(PERSON_RESPONSE_CACHE_BACKEND="memory"):
+            cached = await self.client.generic(
+                "GET", "/api/persons/", ujson.dumps(request_body)
+            )
+            request_body["format"] = "csv"
+            exported = await self.client.generic(
+                "GET", "/api/persons/", ujson.dumps(request_body)
+            )
+            revalidated = await self.client.generic(
+                "GET",
+                "/api/persons/",
+                ujson.dumps(request_body),
+                **{"If-None-Match": cached["ETag"]},
+            )
+
+        self.assertEqual(cached.status_code, 201)
+        for response in (exported, revalidated):
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response["Content-Type"], "text/csv")
+            self.assertEqual(response.has_header("X-Cache"), False)
+            content = b"".join(response.streaming_content).decode()
+            people = list(csv.DictReader(io.StringIO(content)))
+            self.assertEqual(
+                [person["name"] for person in people],
+                [person["name"] for person in ujson.loads(cached.content)],
+            )
+
+    async def test_get_exported(self):
+        request_body = {
+            "number": 12,
+            "fields": ["name", "email", "gender", "birthdate", "dependents"],
+            "format": "csv",
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        people = list(csv.DictReader(io.StringIO(archive.read("people.csv").decode())))
+        self.assertEqual(len(people), 12)
+        self.assertEqual(
+            list(people[0]), ["id", "name", "email", "gender", "birthdate"]
+        )
+
+        request_body["format"] = "xlsx"
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 412)
+
+        request_body.update({"format": "csv", "stream": "json"})
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 412)
+
+    def test_handle_seed(self):
+        context = self.view.handle_seed(
+            self.view, {"seed": 5, "reference_date": "2020-02-29"}
+        )
+        self.assertEqual(context.today, date(2020, 2, 29))
+
+        with patch.object(
+            self.view, "raise_response", side_effect=RaisedResponse({}, 412)
+        ) as raiser:
+            self.assert_response(self.view.handle_seed, 412, {"seed": -1})
+            self.assert_response(self.view.handle_seed, 412, {"seed": "five"})
+            self.assert_response(
+                self.view.handle_seed, 412, {"reference_date": "25/12/2022"}
+            )
+
+    def test_handle_locales(self):
+        self.assertEqual(self.view.handle_locales(self.view, {}), None)
+        locales = self.view.handle_locales(
+            self.view, {"locales": {"en_GB": 3, "de_DE": 1}}
+        )
+        self.assertEqual(locales, {"de_DE": 0.25, "en_GB": 0.75})
+
+        with patch.object(
+            self.view, "raise_response", side_effect=RaisedResponse({}, 412)
+        ):
+            for locales in (
+                ["en_GB"],
+                {},
+                {"xx_XX": 1},
+                {"en_GB": 0},
+                {"en_GB": "half"},
+                {"en_GB": True},
+            ):
+                self.assert_response(
+                    self.view.handle_locales, 412, {"locales": locales}
+                )
+
+    async def test_get_locales(self):
+        request_body = {
+            "number": 40,
+            "seed": 117,
+            "fields": [
+                "name",
+                "email",
+                "gender",
+                "birthdate",
+                "address",
+                "country",
+                "nationality",
+            ],
+            "locales": {"en_GB": 0.5, "de_DE": 0.5},
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        people = ujson.loads(response.content)
+        self.assertEqual(
+            {person["country"] for person in people}, {"Germany", "United Kingdom"}
+        )
+        again = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(again.content, response.content)
+
+        request_body["locales"] = {"xx_XX": 1}
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 412)
+
+    async def test_get_age_distribution(self):
+        request_body = {
+            "number": 200,
+            "fields": ["name", "email", "gender", "birthdate", "age"],
+            "age_distribution": {"edges": [20, 30, 60], "weights": [1, 0]},
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        ages = [person["age"] for person in ujson.loads(response.content)]
+        self.assertEqual(all(20 <= age < 30 for age in ages), True)
+
+        for distribution, status_code in (
+            ("world", 201),
+            ("census", 412),
+            ({"edges": [0, 200], "weights": [1]}, 412),
+            ({"edges": [30, 20], "weights": [1]}, 412),
+            ({"edges": [0, 20, 40], "weights": [1]}, 412),
+            ({"edges": [0, 20], "weights": [0]}, 412),
+        ):
+            response = await self.client.generic(
+                "GET",
+                "/api/persons/",
+                ujson.dumps({**request_body, "age_distribution": distribution}),
+            )
+            self.assertEqual(response.status_code, status_code)
+
+        response = await self.client.generic(
+            "GET",
+            "/api/persons/",
+            ujson.dumps({**request_body, "age_lower_limit": 40}),
+        )
+        self.assertEqual(response.status_code, 416)
+
+    async def test_get_page(self):
+        request_body = {
+            "number": 25000,
+            "seed": 117,
+            "reference_date": "2022-12-25",
+            "fields": ["name", "email", "gender", "birthdate", "dependents"],
+            "offset": 9995,
+            "limit": 10,
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        page = ujson.loads(response.content)
+        self.assertEqual(page["count"], 25000)
+        self.assertEqual(pages.decode_cursor(page["next"]), 10005)
+        self.assertEqual(pages.decode_cursor(page["previous"]), 9985)
+
+        context = GeneratorContext(seed=117, today=date(2022, 12, 25))
+        people = ujson.loads(
+            encode_batches(
+                iter_persons(
+                    25000,
+                    ["name", "email", "gender", "birthdate", "dependents"],
+                    context=context,
+                )
+            )
+        )
+        self.assertEqual(page["results"], people[9995:10005])
+
+        del request_body["offset"]
+        request_body["cursor"] = page["next"]
+        following = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(
+            ujson.loads(following.content)["results"],
+            people[10005:10015],
+        )
+
+        for body in (
+            {"cursor": "invalid"},
+            {"offset": -1},
+            {"limit": 0},
+            {"limit": 10**6},
+            {"seed": None},
+            {"stream": "ndjson"},
+        ):
+            response = await self.client.generic(
+                "GET", "/api/persons/", ujson.dumps({**request_body, **body})
+            )
+            self.assertEqual(response.status_code, 412)
+
+        request_body["number"] = 10**12
+        request_body["cursor"] = pages.encode_cursor(10**12 - 5)
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        page = ujson.loads(response.content)
+        self.assertEqual(len(page["results"]), 5)
+        self.assertEqual(page["next"], None)
+
+    async def test_get_msgpack(self):
+        request_body = {
+            "number": 30,
+            "seed": 117,
+            "reference_date": "2022-12-25",
+            "fields": ["name", "email", "gender", "birthdate", "dependents"],
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        people = ujson.loads(response.content)
+
+        packed = await self.client.generic(
+            "GET",
+            "/api/persons/",
+            ujson.dumps(request_body),
+            **{"Accept": "application/msgpack"},
+        )
+        self.assertEqual(packed.status_code, 201)
+        self.assertEqual(packed["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(packed.content), people)
+
+        for stream in (None, "json"):
+            body = {**request_body, "compact": True}
+            if stream is not None:
+                body["stream"] = stream
+            for accept, decode in (
+                ("application/json", ujson.loads),
+                ("application/msgpack", msgpack.unpackb),
+            ):
+                response = await self.client.generic(
+                    "GET", "/api/persons/", ujson.dumps(body), **{"Accept": accept}
+                )
+                self.assertEqual(response.status_code, 201)
+                compact = decode(b"".join(response) if stream else response.content)
+                keys = compact["keys"]
+                self.assertEqual(keys[-1], "dependents")
+                rows = [dict(zip(keys, row)) for row in compact["rows"]]
+                for row in rows:
+                    row["dependents"] = [
+                        dict(zip(compact["dependent_keys"], dependent))
+                        for dependent in row["dependents"]
+                    ]
+                self.assertEqual(rows, people)
+
+        for body in ({"compact": "yes"}, {"compact": True, "stream": "ndjson"}):
+            response = await self.client.generic(
+                "GET", "/api/persons/", ujson.dumps({**request_body, **body})
+            )
+            self.assertEqual(response.status_code, 412)
+
+    async def test_get_compressed(self):
+        request_body = {
+            "number": 200,
+            "seed": 117,
+            "reference_date": "2022-12-25",
+            "fields": ["name", "email", "gender", "birthdate"],
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+        for encoding, decompress in (
+            ("gzip", gzip.decompress),
+            ("br", brotli.decompress),
+        ):
+            compressed = await self.client.generic(
+                "GET",
+                "/api/persons/",
+                ujson.dumps(request_body),
+                **{"Accept-Encoding": f"{encoding}, identity"},
+            )
+            self.assertEqual(compressed["Content-Encoding"], encoding)
+            self.assertEqual(decompress(compressed.content), response.content)
+            self.assertTrue(compressed["ETag"].startswith("W/"))
+
+            streamed = await self.client.generic(
+                "GET",
+                "/api/persons/",
+                ujson.dumps({**request_body, "stream": "json"}),
+                **{"Accept-Encoding": encoding},
+            )
+            self.assertEqual(streamed["Content-Encoding"], encoding)
+            self.assertEqual(
+                ujson.loads(decompress(b"".join(streamed))),
+                ujson.loads(response.content),
+            )
+
+        with override_settings(PERSON_COMPRESSION=False):
+            response = await self.client.generic(
+                "GET",
+                "/api/persons/",
+                ujson.dumps(request_body),
+                **{"Accept-Encoding": "gzip"},
+            )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    async def test_get_parallel(self):
+        request_body = {
+            "number": 25000,
+            "seed": 117,
+            "reference_date": "2022-12-25",
+            "fields": ["name", "email", "gender", "birthdate", "age", "nationality"],
+        }
+        in_process = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+
+        parallel.start_pool(workers=2)
+        try:
+            with self.settings(
+                PERSON_PARALLEL_THRESHOLD=20000, PERSON_RESPONSE_CACHE_BACKEND=None
+            ):
+                pooled = await self.client.generic(
+                    "GET", "/api/persons/", ujson.dumps(request_body)
+                )
+                request_body["stream"] = "ndjson"
+                streamed = await self.client.generic(
+                    "GET", "/api/persons/", ujson.dumps(request_body)
+                )
+                lines = b"".join(streamed.streaming_content).splitlines()
+        finally:
+            parallel.stop_pool()
+
+        self.assertEqual(pooled.status_code, 201)
+        self.assertEqual(pooled.content, in_process.content)
+        self.assertEqual(list(map(ujson.loads, lines)), ujson.loads(in_process.content))
+
     def test_raise_response(self):
         self.assert_response(
             self.view.raise_response, 200, self.content_tested_dict, 200
@@ -97,6 +608,17 @@ class PersonAPIClassTests(TestCase):
             patch.object(
                 self.view, "handle_age_restrictions", return_value=np.arange(10)
             ) as array,
+            patch.object(self.view, "handle_stream", return_value=None) as stream,
+            patch.object(self.view, "handle_format", return_value=None) as export,
+            patch.object(
+                self.view, "handle_seed", return_value=GeneratorContext()
+            ) as seed,
+            patch.object(self.view, "handle_locales", return_value=None),
+            patch.object(self.view, "handle_age_distribution", return_value=None),
+            patch.object(self.view, "handle_page", return_value=None),
+            patch.object(
+                self.view, "handle_representation", return_value=("json", False)
+            ),
             patch.object(
                 self.view,
                 "raise_response",
@@ -111,15 +633,46 @@ class PersonAPIClassTests(TestCase):
             ) as serializer,
         ):
             self.assert_response(
-                self.view.process_get_request, 201, self.content_tested_dict
+                self.view.process_get_request, 201, self.strict_request_body
             )
 
             fields.return_value = deepcopy(self.input_and_output_queries)
 
             self.assert_response(
-                self.view.process_get_request, 500, self.content_tested_dict
+                self.view.process_get_request, 500, self.strict_request_body
             )
 
+    def test_process_get_request_encoded(self):
+        with (
+            patch.object(self.view, "get_number_of_people", return_value=3) as number,
+            patch.object(
+                self.view,
+                "handle_fields",
+                return_value=deepcopy(self.input_and_output_queries),
+            ) as fields,
+            patch.object(
+                self.view, "handle_age_restrictions", return_value=None
+            ) as array,
+            patch.object(self.view, "handle_stream", return_value=None) as stream,
+            patch.object(
+                self.view, "handle_representation", return_value=("json", False)
+            ),
+            patch("people.views.PersonSerializer") as serializer,
+        ):
+            with self.assertRaises(RaisedResponse) as raised:
+                self.view().process_get_request(self.content_tested_dict)
+            self.assertEqual(raised.exception.status, 201)
+            self.assertEqual(len(ujson.loads(raised.exception.content)), 3)
+            serializer.assert_not_called()
+
+            with patch(
+                "people.views.encode_batches", side_effect=SchemaError("invalid")
+            ) as encoder:
+                fields.return_value = deepcopy(self.input_and_output_queries)
+                with self.assertRaises(RaisedResponse) as raised:
+                    self.view().process_get_request(self.content_tested_dict)
+                self.assertEqual(raised.exception.status, 500)
+
     def test_handle_fields(self):
         fields = self.view.handle_fields(self.view, self.content_tested_dict)
         for tup in zip(fields, self.input_and_output_queries):
@@ -176,6 +729,18 @@ class PersonAPIClassTests(TestCase):
                 self.view.handle_age_restrictions, 416, lower_bigger_than_upper
             )
 
+        # A negative lower limit would wrap around to the oldest ages
+        for negative_lower_limit in (
+            {"age_lower_limit": -5, "fields": ["age"]},
+            {"age_lower_limit": -5, "age_upper_limit": 10, "fields": ["age"]},
+        ):
+            with self.assertRaises(RaisedResponse) as raised:
+                PersonAPIClass().handle_age_restrictions(negative_lower_limit)
+            self.assertEqual(raised.exception.status, 416)
+            self.assertEqual(
+                "lower age limit" in raised.exception.content["error"], True
+            )
+
         only_upper = {"age_upper_limit": 15, "fields": ["age"]}
         array_from_zero = self.view.handle_age_restrictions(self.view, only_upper)
         self.assertEqual(isinstance(array_from_zero, np.ndarray), True)
@@ -209,23 +774,1170 @@ class PersonDataClassTests(TestCase):
         "dependents",
     ]
 
-    def setUp(self):
-        Faker.seed(117)
-
     def test_person_generation(self):
-        output_fields = []
-        for field in self.fields:
-            potential = INPUT_TO_OUTPUT_FIELD_MAPPING.get(field)
-            if potential is None:
-                potential = field
-            output_fields.append(potential)
-
-        person = generate_persons(1, self.fields, output_fields)
+        person = generate_persons(1, self.fields)
 
         student_fields = copy(self.fields)
         student_fields.remove("age")
-        output_fields.remove("age")
         student_age_range = np.arange(16)
         no_age_specified_student = generate_persons(
-            1, student_fields, output_fields, student_age_range
+            1, student_fields, age_list=student_age_range
+        )
+
+    def test_field_shapes(self):
+        def baseline_keys(fields: set[str], age_list: np.ndarray = None) -> set[str]:
+            # The keys the per person dataclass returned for the requested fields
+            keys = set(fields)
+            if keys & {"deceased", "occupation"}:
+                keys.add("age")
+            if "nationality" in keys:
+                keys.add("country")
+            if age_list is not None:
+                keys.update(("age", "birthdate"))
+            return keys
+
+        mandatory = ["name", "email", "gender", "birthdate"]
+        optional = [field for field in self.fields if field not in mandatory]
+        for size in range(len(optional) + 1):
+            for combination in itertools.combinations(optional, size):
+                for age_list in (None, np.arange(20, 30)):
+                    fields = mandatory + list(combination)
+                    if age_list is not None:
+                        fields.remove("birthdate")
+                    people = generate_persons(3, fields, age_list=age_list)
+                    keys = baseline_keys(fields, age_list)
+                    for person in people:
+                        self.assertEqual(set(person), keys)
+                        dependent_fields = (keys - {"dependents"}) | {"birthdate"}
+                        for dependent in person.get("dependents", []):
+                            self.assertEqual(
+                                set(dependent), baseline_keys(dependent_fields)
+                            )
+
+    def test_batch_generation(self):
+        people = generate_persons(50, self.fields, age_list=np.arange(16, 24))
+        self.assertEqual(len(people), 50)
+        for person in people:
+            self.assertEqual(list(person.keys()), list(OUTPUT_FIELD_ORDER))
+            self.assertEqual(16 <= person["age"] < 24, True)
+            self.assertEqual(
+                date.today() - relativedelta(years=person["age"] + 1)
+                < person["birthdate"]
+                <= date.today() - relativedelta(years=person["age"]),
+                True,
+            )
+            for dependent in person["dependents"]:
+                self.assertEqual("dependents" in dependent, False)
+                self.assertEqual("birthdate" in dependent, True)
+
+        serialized = PersonSerializer(data=people, many=True)
+        self.assertEqual(serialized.is_valid(), True)
+
+        minimal = generate_persons(10, ["name", "email", "gender", "birthdate"])
+        self.assertEqual(
+            list(minimal[0].keys()), ["name", "email", "gender", "birthdate"]
+        )
+
+    def test_field_providers(self):
+        self.assertEqual(USER_QUERY_FIELDS.issubset(FIELD_PROVIDERS), True)
+
+        context = GeneratorContext(seed=117)
+        with patch.object(
+            BatchBuilder, "column", autospec=True, side_effect=BatchBuilder.column
+        ) as column:
+            columns = generate_columns(10, ["name", "phone"], context=context)
+        computed = {call.args[1] for call in column.call_args_list}
+        self.assertEqual(list(columns), ["name", "phone"])
+        self.assertEqual(computed, {"name", "gender", "phone"})
+
+        columns = generate_columns(10, ["country"], context=context)
+        self.assertEqual(list(columns), ["country"])
+
+    def test_locales(self):
+        context = GeneratorContext(seed=117, locales={"de_DE": 0.5, "en_GB": 0.5})
+        builder = BatchBuilder(200, ["name", "country"], None, ValuePools(), context)
+        locales = builder.column("_locale")
+        countries = builder.column("country")
+        self.assertEqual(
+            set(countries[locales == 0]) | set(countries[locales == 1]),
+            {"Germany", "United Kingdom"},
+        )
+        self.assertEqual(set(countries[locales == 0]), {"Germany"})
+        self.assertEqual(
+            set(builder.column("_country_code")[locales == 1]),
+            {PLACE_DEMONYM_CODES["United Kingdom"]},
+        )
+        # German phone numbers are filled in from the German phone number formats
+        german_formats = {
+            re.sub("[0-9%]", "#", phone_format)
+            for phone_format in ValuePools().pool("phone_number", "de_DE")
+        }
+        german_phones = {
+            re.sub("[0-9]", "#", phone)
+            for phone in builder.column("phone")[locales == 0]
+        }
+        self.assertEqual(german_phones <= german_formats, True)
+
+    def test_slice(self):
+        context = GeneratorContext(seed=117)
+        batch = generate_batch(20, ["name", "dependents"], None, ValuePools(), context)
+        records = batch.to_records()
+        self.assertEqual(batch.slice(5, 12).to_records(), records[5:12])
+        self.assertEqual(batch.slice(0, 0).to_records(), [])
+
+    def test_generate_dependents(self):
+        fields = ["name", "email", "gender", "phone", "dependents"]
+        context = GeneratorContext(seed=117)
+        pools = ValuePools()
+        counts = np.array([0, 3, 1, 0, 2])
+        columns = generate_columns(5, fields, None, pools, context)
+        dependents = generate_dependents(counts, fields, columns, pools, context)
+        offsets = dependent_offsets(counts)
+        self.assertEqual(len(dependents), counts.sum())
+        self.assertEqual(offsets.tolist(), [0, 0, 3, 4, 4, 6])
+
+        # The dependents of each parent only depend on the row of the parent
+        children = dependents.to_records()
+        for index, count in enumerate(counts.tolist()):
+            alone = generate_dependents(
+                counts[index : index + 1], fields, {}, pools, context.at(index)
+            )
+            self.assertEqual(
+                alone.to_records(), children[offsets[index] : offsets[index + 1]]
+            )
+
+        batch = generate_batch(30, fields, None, pools, context)
+        self.assertEqual(len(batch.dependents), batch.offsets[-1])
+        for index, person in enumerate(batch.to_records()):
+            self.assertEqual(
+                len(person["dependents"]),
+                batch.offsets[index + 1] - batch.offsets[index],
+            )
+            for dependent in person["dependents"]:
+                self.assertEqual(
+                    list(dependent), ["name", "email", "gender", "birthdate", "phone"]
+                )
+
+    def test_person_batch(self):
+        batch = generate_batch(20, self.fields, context=GeneratorContext(seed=117))
+        self.assertEqual(batch.keys(), list(OUTPUT_FIELD_ORDER))
+        self.assertEqual(len(batch.offsets), 21)
+        self.assertEqual(len(batch.dependents), batch.offsets[-1])
+
+        records = batch.to_records()
+        dependents = batch.dependents.to_records()
+        for index, person in enumerate(records):
+            start, stop = batch.offsets[index], batch.offsets[index + 1]
+            self.assertEqual(person["dependents"], dependents[start:stop])
+        self.assertEqual(encode_people(batch), encode_people(records))
+
+    def test_output_order_matches_serializer(self):
+        self.assertEqual(list(OUTPUT_FIELD_ORDER), list(PersonSerializer().fields))
+
+    def test_encode_people(self):
+        people = generate_persons(20, self.fields)
+        strict = PersonSerializer(data=people, many=True)
+        self.assertEqual(strict.is_valid(), True)
+        self.assertEqual(encode_people(people), ujson.dumps(strict.data).encode())
+
+        ndjson = encode_ndjson(people).decode("utf-8").splitlines()
+        self.assertEqual(len(ndjson), 20)
+
+        with self.assertRaises(SchemaError):
+            encode_people([{"name": "Missing Fields"}])
+        with self.assertRaises(SchemaError):
+            validate_schema(
+                ["name", "email", "gender", "birthdate", "height"], PersonSerializer()
+            )
+
+    def test_age_derivations(self):
+        rng = np.random.default_rng(117)
+        ages = np.repeat([0, 15, 20, 40, 120], 1000)
+
+        deceased = deceased_from_ages(ages, rng).reshape(5, 1000).mean(axis=1)
+        self.assertEqual(deceased[0], 0)
+        self.assertEqual(0.45 < deceased[3] < 0.55, True)
+        self.assertEqual(deceased[4], 1)
+
+        jobs = np.full(len(ages), "Astronomer", dtype=object)
+        occupations = occupations_from_ages(ages, jobs, rng).reshape(5, 1000)
+        self.assertEqual(set(occupations[1]), {"Student"})
+        self.assertEqual(0.65 < (occupations[2] == "Student").mean() < 0.75, True)
+        self.assertEqual(set(occupations[3]), {"Astronomer"})
+
+    def test_iter_persons(self):
+        fields = ["name", "email", "gender", "birthdate"]
+        chunks = list(iter_persons(25, fields, chunk_size=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+
+    def test_seeded_generation(self):
+        context = GeneratorContext(seed=117)
+        people = generate_persons(25, self.fields, context=context)
+        self.assertEqual(
+            generate_persons(25, self.fields, context=GeneratorContext(seed=117)),
+            people,
         )
+
+        chunks = list(iter_persons(25, self.fields, context=context, chunk_size=10))
+        out_of_order = [
+            generate_records(
+                len(chunk),
+                self.fields,
+                pools=ValuePools(),
+                context=context.at(index * 10),
+            )
+            for index, chunk in reversed(list(enumerate(chunks)))
+        ]
+        self.assertEqual(out_of_order[::-1], [chunk.to_records() for chunk in chunks])
+
+    def test_row_generation(self):
+        context = GeneratorContext(seed=117)
+        fields = self.fields + ["dependents", "nationality", "occupation"]
+        people = generate_persons(25, fields, context=context)
+        self.assertEqual(
+            generate_records(12, fields, pools=ValuePools(), context=context.at(7)),
+            people[7:19],
+        )
+
+        generator = context.row_generator("age", 10)
+        values = generator.random(10)
+        self.assertEqual(generator.draws, 1)
+        self.assertEqual(
+            context.at(5).row_generator("age", 3).random(3).tolist(),
+            values[5:8].tolist(),
+        )
+        integers = context.row_generator("gender", 1000).integers(3, 7, size=1000)
+        self.assertEqual(set(integers.tolist()), {3, 4, 5, 6})
+        with self.assertRaises(ValueError):
+            generator.random(5)
+
+    def test_birthdate_age_conversions(self):
+        today = date(2024, 2, 29)
+        birthdates = birthdates_from_ages(np.array([0, 1, 4, 30]), today)
+        self.assertEqual(
+            birthdates.tolist(),
+            [today - relativedelta(years=age) for age in (0, 1, 4, 30)],
+        )
+        ages = ages_from_birthdates(
+            np.array(["2000-02-29", "2000-03-01", "2023-02-28"], dtype="datetime64[D]"),
+            today,
+        )
+        self.assertEqual(ages.tolist(), [24, 23, 1])
+
+        rng = np.random.default_rng(117)
+        ages = rng.integers(0, 115, size=2000)
+        for today in (date(2024, 2, 29), date(2023, 3, 1), date(2022, 12, 31)):
+            birthdates = birthdates_within_ages(ages, today, rng)
+            self.assertEqual(
+                ages_from_birthdates(birthdates, today).tolist(), ages.tolist()
+            )
+        self.assertEqual(len(set(birthdates[ages == ages[0]].tolist())) > 1, True)
+
+    def test_age_distributions(self):
+        rng = np.random.default_rng(117)
+        world = distributions.named_distribution("world")
+        ages = world.sample(100000, rng)
+        self.assertAlmostEqual(np.mean(ages < 15), 0.253, delta=0.01)
+        self.assertEqual(ages.max() < 115, True)
+
+        restricted = world.restrict(np.arange(30, 40))
+        self.assertEqual(set(restricted.sample(1000, rng).tolist()), set(range(30, 40)))
+
+        bands = distributions.histogram([0, 18, 65, 100], [1, 0, 1], ("histogram",))
+        ages = bands.sample(10000, rng)
+        self.assertEqual(((ages >= 18) & (ages < 65)).any(), False)
+        self.assertEqual(ages.max() < 100, True)
+        with self.assertRaises(ValueError):
+            bands.restrict(np.arange(20, 60))
+
+        context = GeneratorContext(
+            seed=117, ages=distributions.named_distribution("europe")
+        )
+        batch = generate_batch(
+            100, ["age", "birthdate", "dependents"], None, None, context
+        )
+        self.assertEqual(
+            generate_batch(5, ["age"], None, None, context.at(10))
+            .columns["age"]
+            .tolist(),
+            batch.columns["age"][10:15].tolist(),
+        )
+        self.assertEqual(
+            ages_from_birthdates(batch.columns["birthdate"], context.today).tolist(),
+            batch.columns["age"].tolist(),
+        )
+
+
+class ValuePoolTests(TestCase):
+    def test_fill_placeholders(self):
+        templates = np.array([b"(###) ###-####", b"%## Main St."], dtype=bytes)
+        uniforms = np.tile(np.linspace(0, 0.99, 10), (2, 1))
+        self.assertEqual(
+            fill_placeholders(templates, uniforms).tolist(),
+            ["(012) 345-6789", "112 Main St."],
+        )
+
+    def test_distinct_values(self):
+        # Pools are drawn with replacement, phone numbers and addresses get their
+        # digits and emails their names drawn per row so that they rarely repeat
+        people = generate_persons(
+            1000,
+            ["email", "phone", "address"],
+            context=GeneratorContext(seed=117),
+        )
+        for field in ("email", "phone", "address"):
+            values = {person[field] for person in people}
+            self.assertGreaterEqual(len(values), 990, field)
+
+
+class SharedPoolTests(TestCase):
+    def test_refill(self):
+        shared = SharedPools(capacity=6, max_bytes=2**20, refill_size=4)
+        self.assertEqual(shared.get("job", 1), None)
+        self.assertEqual(shared.stats()["job"]["misses"], 1)
+
+        shared.refill("job")
+        self.assertEqual(shared.get("job", 5), None)
+        shared.refill("job")
+        jobs, _ = shared.get("job", 6)
+        self.assertEqual(len(jobs), 6)
+
+        shared.refill("job")
+        rotated, _ = shared.get("job", 6)
+        self.assertEqual(len(rotated), 6)
+        self.assertEqual(list(rotated[4:]), list(jobs[4:]))
+        self.assertEqual(shared.stats()["job"]["hits"], 2)
+
+        capped = SharedPools(capacity=100, max_bytes=1, refill_size=4)
+        capped.refill("job")
+        capped.refill("job")
+        self.assertEqual(capped.stats()["job"]["size"], 4)
+
+    def test_request_pools(self):
+        shared = SharedPools(
+            capacity=POOL_SIZE, max_bytes=2**24, refill_size=POOL_SIZE
+        )
+        for provider_name in ("first_name_female", "first_name_male", "last_name"):
+            shared.refill(provider_name)
+
+        with patch.object(pools, "shared_pools", shared):
+            seeded = pools.request_pools(GeneratorContext(seed=117))
+            unseeded = pools.request_pools(GeneratorContext())
+        self.assertEqual(type(seeded), ValuePools)
+        self.assertEqual(type(unseeded), SharedValuePools)
+
+        names = generate_records(10, ["name"], pools=unseeded)
+        self.assertEqual(len(names), 10)
+        self.assertEqual(shared.stats()["last_name"]["hits"], 1)
+        self.assertEqual(
+            unseeded.pool("last_name") is shared.get("last_name", POOL_SIZE)[0], True
+        )
+
+        generate_records(10, ["phone"], pools=unseeded)
+        self.assertEqual(shared.stats()["phone_number"]["misses"], 1)
+
+    def test_shared_distinct_values(self):
+        shared = SharedPools(
+            capacity=POOL_SIZE, max_bytes=2**24, refill_size=POOL_SIZE
+        )
+        for provider_name in pools.SHARED_POOL_PROVIDERS:
+            shared.refill(provider_name)
+        phones, _ = shared.get("phone_number", POOL_SIZE)
+        self.assertEqual(all("#" in phone for phone in phones), True)
+
+        # Unseeded requests fill in the digits and compose the user names of
+        # every row just like seeded requests
+        people = generate_records(
+            1000, ["email", "phone", "address"], pools=SharedValuePools(shared)
+        )
+        self.assertEqual(shared.stats()["phone_number"]["hits"], 2)
+        for field in ("email", "phone", "address"):
+            values = {person[field] for person in people}
+            self.assertGreaterEqual(len(values), 990, field)
+
+
+class ResponseCacheTests(TestCase):
+    def test_memory_backend(self):
+        backend = cache.MemoryBackend(max_bytes=10)
+        backend.set("a", b"aaaa")
+        backend.set("b", b"bbbb")
+        backend.get("a")
+        backend.set("c", b"cccc")
+        self.assertEqual(backend.get("b"), None)
+        self.assertEqual(backend.get("a"), b"aaaa")
+        backend.set("d", b"d" * 11)
+        self.assertEqual(backend.get("d"), None)
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = cache.FileBackend(directory, max_bytes=10)
+            backend.set("a", b"aaaa")
+            os.utime(os.path.join(directory, "a"), (0, 0))
+            backend.set("b", b"bbbb")
+            backend.set("c", b"cccc")
+            self.assertEqual(backend.get("a"), None)
+            self.assertEqual(backend.get("c"), b"cccc")
+
+    def test_request_key(self):
+        context = GeneratorContext(seed=117, today=date(2022, 12, 25))
+        key = cache.request_key(10, ["name", "age"], np.arange(5, 10), context)
+        self.assertEqual(
+            cache.request_key(10, ["age", "name"], np.arange(5, 10), context), key
+        )
+        self.assertNotEqual(
+            cache.request_key(10, ["age", "name"], np.arange(5, 11), context), key
+        )
+        self.assertNotEqual(
+            cache.request_key(
+                10, ["age", "name"], np.arange(5, 10), GeneratorContext(seed=118)
+            ),
+            key,
+        )
+
+        response_cache = cache.ResponseCache(cache.MemoryBackend(max_bytes=100))
+        response_cache.get(key)
+        response_cache.set(key, b"[]")
+        self.assertEqual(response_cache.get(key), b"[]")
+        self.assertEqual(response_cache.stats()["hit_ratio"], 0.5)
+
+
+class ExportTests(TestCase):
+    fields = ["name", "email", "gender", "birthdate", "age", "dependents"]
+
+    def chunks(self, fields: list[str]):
+        return iter_persons(
+            25, fields, context=GeneratorContext(seed=117), chunk_size=10
+        )
+
+    def export(self, export_format: str, fields: list[str]) -> tuple[bytes, str]:
+        body, content_type, _ = exporters.export_batches(
+            self.chunks(fields), export_format
+        )
+        return b"".join(body), content_type
+
+    def test_csv(self):
+        body, content_type = self.export("csv", self.fields[:4])
+        self.assertEqual(content_type, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(body.decode("utf-8"))))
+        self.assertEqual([row["id"] for row in rows], [str(i) for i in range(25)])
+
+        people = [
+            person
+            for chunk in self.chunks(self.fields)
+            for person in chunk.to_records()
+        ]
+        body, content_type = self.export("csv", self.fields)
+        self.assertEqual(content_type, "application/zip")
+        archive = zipfile.ZipFile(io.BytesIO(body))
+        dependents = list(
+            csv.DictReader(io.StringIO(archive.read("dependents.csv").decode("utf-8")))
+        )
+        self.assertEqual(len(dependents), sum(len(p["dependents"]) for p in people))
+        for dependent in dependents:
+            parent = people[int(dependent["parent_id"])]
+            self.assertEqual(
+                dependent["name"] in [d["name"] for d in parent["dependents"]], True
+            )
+
+    def test_arrow(self):
+        import pyarrow
+
+        body, content_type = self.export("arrow", self.fields[:5])
+        self.assertEqual(content_type, "application/vnd.apache.arrow.file")
+        table = pyarrow.ipc.open_file(pyarrow.py_buffer(body)).read_all()
+        self.assertEqual(table.column_names, ["id"] + self.fields[:5])
+        self.assertEqual(table.num_rows, 25)
+
+    def test_npz(self):
+        people = [
+            person
+            for chunk in self.chunks(self.fields)
+            for person in chunk.to_records()
+        ]
+        body, _ = self.export("npz", self.fields)
+        arrays = np.load(io.BytesIO(body))
+        self.assertEqual(arrays["name"].tolist(), [p["name"] for p in people])
+        self.assertEqual(arrays["birthdate"].tolist(), [p["birthdate"] for p in people])
+        self.assertEqual(
+            len(arrays["dependents/parent_id"]),
+            sum(len(p["dependents"]) for p in people),
+        )
+
+        sink = exporters.ChunkSink()
+        writer = exporters.NpzWriter(sink)
+        writer.write({"name": np.array(["Al", "Bo"], dtype=object)})
+        writer.write({"name": np.array(["Christopher"], dtype=object)})
+        self.assertEqual(len(writer.columns["name"]), 3)
+        writer.close()
+        self.assertEqual(
+            np.load(io.BytesIO(sink.drain()))["name"].tolist(),
+            ["Al", "Bo", "Christopher"],
+        )
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.registry = jobs.JobRegistry(
+            self.directory.name, ttl=60, workers=1, max_active=2
+        )
+        self.client = AsyncClient()
+        self.patcher = patch.object(jobs, "job_registry", self.registry)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.registry.executor.shutdown(cancel_futures=True)
+        self.directory.cleanup()
+
+    async def test_job(self):
+        request_body = {
+            "number": 250,
+            "fields": ["name", "email", "gender", "birthdate", "phone"],
+            "seed": 3,
+        }
+        response = await self.client.post(
+            "/api/jobs/", ujson.dumps(request_body), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = ujson.loads(response.content)["id"]
+        self.registry.get(job_id).wait()
+
+        response = await self.client.get(f"/api/jobs/{job_id}/")
+        state = ujson.loads(response.content)
+        self.assertEqual(state["status"], "finished")
+        self.assertEqual(state["progress"], 1.0)
+
+        response = await self.client.get(f"/api/jobs/{job_id}/download/")
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        self.assertEqual(len(content), state["bytes_written"])
+        people = [ujson.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(people), 250)
+        self.assertEqual(
+            [person["name"] for person in people],
+            [
+                person["name"]
+                for person in generate_persons(
+                    250,
+                    ["name", "email", "gender", "birthdate", "phone"],
+                    context=GeneratorContext(3),
+                )
+            ],
+        )
+
+        response = await self.client.get(
+            f"/api/jobs/{job_id}/download/", **{"Range": "bytes=10-19"}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(content)}")
+        self.assertEqual(b"".join(response.streaming_content), content[10:20])
+
+        response = await self.client.get(
+            f"/api/jobs/{job_id}/download/", **{"Range": f"bytes={len(content)}-"}
+        )
+        self.assertEqual(response.status_code, 416)
+
+        response = await self.client.delete(f"/api/jobs/{job_id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        response = await self.client.get(f"/api/jobs/{job_id}/")
+        self.assertEqual(response.status_code, 404)
+
+        request_body["format"] = "csv"
+        response = await self.client.post(
+            "/api/jobs/", ujson.dumps(request_body), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 412)
+
+    async def test_job_number(self):
+        with self.settings(PERSON_JOB_MAX_NUMBER=100):
+            for number in ("x", True, -1, 101, None):
+                response = await self.client.post(
+                    "/api/jobs/",
+                    ujson.dumps({"number": number}),
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 412)
+        response = await self.client.get("/api/jobs/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ujson.loads(response.content), [])
+
+    async def test_job_limit(self):
+        release = threading.Event()
+        threads = []
+
+        def write_output(job):
+            threads.append(threading.current_thread().name)
+            release.wait(5)
+
+        request_body = ujson.dumps({"number": 10, "seed": 1})
+        with patch.object(jobs.Job, "write_output", write_output):
+            running, queued = [
+                await self.client.post(
+                    "/api/jobs/", request_body, content_type="application/json"
+                )
+                for _ in range(2)
+            ]
+            refused = await self.client.post(
+                "/api/jobs/", request_body, content_type="application/json"
+            )
+            self.assertEqual(running.status_code, 202)
+            self.assertEqual(queued.status_code, 202)
+            self.assertEqual(refused.status_code, 429)
+            self.assertEqual(refused["Retry-After"], "5")
+
+            queued = self.registry.get(ujson.loads(queued.content)["id"])
+            self.assertEqual(queued.status, "queued")
+            self.assertEqual(self.registry.delete(queued.id), queued)
+            self.assertEqual(queued.status, "cancelled")
+
+            release.set()
+            running = self.registry.get(ujson.loads(running.content)["id"])
+            self.assertEqual(running.wait(5), True)
+            self.assertEqual(running.status, "finished")
+            self.assertEqual(threads, ["job_0"])
+
+    def test_json_job(self):
+        job = self.registry.create(
+            30,
+            ["name", "email", "gender", "birthdate"],
+            None,
+            GeneratorContext(1),
+            "json",
+        )
+        job.wait()
+        with open(job.path, "rb") as f:
+            people = ujson.loads(f.read())
+        self.assertEqual(len(people), 30)
+
+        job.ended_at -= 61
+        self.assertEqual(self.registry.get(job.id), None)
+        self.assertEqual(os.path.exists(job.path), False)
+
+    def test_mapped_output(self):
+        path = os.path.join(self.directory.name, "output")
+        output = jobs.MappedOutput(path, size=4)
+        output.write(b"abc")
+        output.write(b"defgh")
+        self.assertEqual(output.size, 8)
+        output.write(b"i")
+        output.close()
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"abcdefghi")
+
+    def test_parse_range(self):
+        self.assertEqual(jobs.parse_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(jobs.parse_range("bytes=90-", 100), (90, 99))
+        self.assertEqual(jobs.parse_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(jobs.parse_range("bytes=50-500", 100), (50, 99))
+        self.assertEqual(jobs.parse_range("bytes=0-1,5-6", 100), None)
+        self.assertEqual(jobs.parse_range("", 100), None)
+        with self.assertRaises(ValueError):
+            jobs.parse_range("bytes=100-", 100)
+
+
+class BenchmarkTests(TestCase):
+    def test_measure(self):
+        result = benchmarks.measure(lambda: np.zeros(1024 * 1024), repeats=2)
+        self.assertEqual(result["seconds"] > 0, True)
+        self.assertEqual(result["peak_bytes"] >= 8 * 1024 * 1024, True)
+
+    def test_compare_results(self):
+        baseline = {
+            "benchmarks": {
+                "generate/minimal/100": {"seconds": 1.0, "peak_bytes": 100},
+                "encode/minimal/100": {"seconds": 1.0, "peak_bytes": 100},
+                "startup/boot": {"seconds": 1.0, "peak_bytes": 100},
+            }
+        }
+        results = {
+            "benchmarks": {
+                "generate/minimal/100": {"seconds": 1.2, "peak_bytes": 200},
+                "encode/minimal/100": {"seconds": 0.5, "peak_bytes": 100},
+                "latency/minimal/10": {"seconds": 9.0, "peak_bytes": 100},
+                "startup/boot": {"seconds": 1.8, "peak_bytes": 100},
+            }
+        }
+        regressions = benchmarks.compare_results(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(
+            regressions[0].startswith("generate/minimal/100 peak_bytes"), True
+        )
+        self.assertEqual(benchmarks.compare_results(results, baseline, 1.0), [])
+
+        # The startup benchmarks only regress beyond the startup tolerance
+        regressions = benchmarks.compare_results(
+            results, baseline, tolerance=0.25, startup_tolerance=0.5
+        )
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(regressions[1].startswith("startup/boot seconds"), True)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = AsyncClient()
+        self.patcher = patch.object(metrics, "metrics", None)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    @override_settings(
+        PERSON_METRICS=True,
+        PERSON_SERVER_TIMING=True,
+        PERSON_RESPONSE_CACHE_BACKEND=None,
+    )
+    async def test_metrics(self):
+        request_body = {
+            "number": 20,
+            "fields": ["name", "email", "gender", "birthdate", "nationality"],
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        stages = [
+            timing.split(";")[0] for timing in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(stages, ["parse", "validate", "generate", "encode"])
+
+        response = await self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        exposition = response.content.decode()
+        self.assertIn('person_stage_seconds_count{stage="generate"} 1', exposition)
+        self.assertIn('person_field_rows_total{field="name"} 20', exposition)
+        self.assertIn('person_field_rows_total{field="nationality"} 20', exposition)
+        self.assertIn(
+            'person_field_seconds_bucket{field="name",le="+Inf"} 1', exposition
+        )
+
+    async def test_metrics_disabled(self):
+        request_body = {"number": 5}
+        response = await self.client.generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.has_header("Server-Timing"), False)
+        self.assertEqual(metrics.metrics, None)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(
+            histogram.samples("seconds", 'stage="generate"'),
+            [
+                'seconds_bucket{stage="generate",le="0.1"} 2',
+                'seconds_bucket{stage="generate",le="1.0"} 3',
+                'seconds_bucket{stage="generate",le="+Inf"} 4',
+                'seconds_sum{stage="generate"} 2.65',
+                'seconds_count{stage="generate"} 4',
+            ],
+        )
+
+
+class SuggestionTests(TestCase):
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance("kitten", "sitting"), 3)
+        self.assertEqual(edit_distance("emial", "email"), 1)
+        self.assertEqual(edit_distance("", "age"), 3)
+
+    def test_suggest(self):
+        self.assertEqual(field_suggester.suggest("adress"), "address")
+        self.assertEqual(field_suggester.suggest("Nationalty"), "nationality")
+        self.assertEqual(field_suggester.suggest("dependant"), "dependents")
+        self.assertEqual(field_suggester.suggest("sex"), "gender")
+        self.assertEqual(field_suggester.suggest("green"), None)
+        self.assertEqual(field_suggester.suggest("n" * 10000), None)
+
+    def test_validate_fields(self):
+        validate_fields.cache_clear()
+        self.assertEqual(validate_fields(("name", "emial")), (False, "emial", "email"))
+        self.assertEqual(validate_fields(("name", "emial")), (False, "emial", "email"))
+        self.assertEqual(validate_fields.cache_info().hits, 1)
+        self.assertEqual(
+            validate_fields.cache_info().maxsize, suggestions.VALIDATION_CACHE_SIZE
+        )
+
+
+class ConcurrencyTests(TestCase):
+    async def test_admission(self):
+        admission = concurrency.RowAdmission(
+            capacity=100, max_waiting=1, timeout=0.2, retry_after=3
+        )
+        self.assertEqual(await admission.acquire(60), 60)
+        self.assertEqual(await admission.acquire(40), 40)
+
+        waiting = asyncio.ensure_future(admission.acquire(50))
+        await asyncio.sleep(0)
+        self.assertEqual(admission.stats(), {"in_flight_rows": 100, "waiting": 1})
+        with self.assertRaises(concurrency.Overloaded) as overloaded:
+            await admission.acquire(1)
+        self.assertEqual(overloaded.exception.status, 429)
+
+        admission.release(60)
+        self.assertEqual(await waiting, 50)
+        self.assertEqual(admission.stats(), {"in_flight_rows": 90, "waiting": 0})
+
+        with self.assertRaises(concurrency.Overloaded) as overloaded:
+            await admission.acquire(20)
+        self.assertEqual(overloaded.exception.status, 503)
+        self.assertEqual(overloaded.exception.retry_after, 3)
+        self.assertEqual(admission.stats(), {"in_flight_rows": 90, "waiting": 0})
+
+        admission.release(90)
+        self.assertEqual(await admission.acquire(1000), 100)
+
+    async def test_overloaded_request(self):
+        admission = concurrency.RowAdmission(
+            capacity=10, max_waiting=0, timeout=1, retry_after=7
+        )
+        await admission.acquire(10)
+        with patch.object(concurrency, "admission", admission):
+            response = await AsyncClient().generic(
+                "GET", "/api/persons/", ujson.dumps({"number": 5})
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+
+    async def test_run_cpu_cancelled(self):
+        started = threading.Event()
+        stopped = threading.Event()
+
+        def generate():
+            started.set()
+            while True:
+                try:
+                    concurrency.check_cancelled()
+                except concurrency.GenerationCancelled:
+                    stopped.set()
+                    raise
+                time.sleep(0.01)
+
+        task = asyncio.ensure_future(concurrency.run_cpu(generate))
+        await asyncio.to_thread(started.wait)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(await asyncio.to_thread(stopped.wait, 5), True)
+
+    async def test_cancel_on_disconnect(self):
+        cancelled = asyncio.Event()
+
+        async def application(scope, receive, send):
+            await receive()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        messages = asyncio.Queue()
+        messages.put_nowait({"type": "http.request", "body": b"{}"})
+        messages.put_nowait({"type": "http.disconnect"})
+        middleware = concurrency.CancelOnDisconnect(application)
+        await asyncio.wait_for(middleware({"type": "http"}, messages.get, None), 5)
+        self.assertEqual(cancelled.is_set(), True)
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+
+    def tearDown(self):
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+
+    async def serve(
+        self,
+        request_body: dict,
+        send,
+        messages: asyncio.Queue = None,
+        path: str = "/api/persons/",
+    ) -> None:
+        """Serves a GET request to the path through the ASGI application"""
+        messages = messages or asyncio.Queue()
+        messages.put_nowait(
+            {"type": "http.request", "body": ujson.dumps(request_body).encode()}
+        )
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", b"testserver")],
+        }
+        application = concurrency.CancelOnDisconnect(streaming.OffloadedASGIHandler())
+        await application(scope, messages.get, send)
+
+    async def test_offloaded_stream(self):
+        request_body = {
+            "number": 25,
+            "seed": 117,
+            "reference_date": "2022-12-25",
+            "fields": ["name", "email", "gender", "birthdate", "dependents"],
+            "stream": "ndjson",
+        }
+        response = await AsyncClient().generic(
+            "GET", "/api/persons/", ujson.dumps(request_body)
+        )
+        threads = []
+        encode_elements = views.encode_elements
+
+        def encode_on_thread(*args):
+            threads.append(threading.current_thread().name)
+            return encode_elements(*args)
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        with patch("people.views.encode_elements", side_effect=encode_on_thread):
+            await self.serve(request_body, send)
+        self.assertEqual(messages[0]["status"], 201)
+        self.assertEqual(
+            b"".join(message.get("body", b"") for message in messages[1:]),
+            b"".join(response),
+        )
+        self.assertEqual(messages[-1].get("more_body", False), False)
+        self.assertEqual(len(threads) > 0, True)
+        self.assertEqual(all(name.startswith("generation") for name in threads), True)
+
+    async def test_offloaded_batch(self):
+        fields = ["name", "email", "gender", "birthdate"]
+        request_body = {
+            "requests": [
+                {"number": 3, "fields": fields},
+                {"number": 4, "fields": fields, "seed": 117},
+                {"number": 5, "fields": fields + ["dependents"]},
+            ]
+        }
+        threads = []
+        generate_batch = multiplex.generate_batch
+
+        def generate_on_thread(*args):
+            threads.append(threading.current_thread().name)
+            return generate_batch(*args)
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        with patch("people.multiplex.generate_batch", side_effect=generate_on_thread):
+            await self.serve(request_body, send, path="/api/persons/batch/")
+        self.assertEqual(messages[0]["status"], 201)
+        lines = b"".join(message.get("body", b"") for message in messages[1:])
+        results = [ujson.loads(line) for line in lines.splitlines()]
+        self.assertEqual(sorted(result["index"] for result in results), [0, 1, 2])
+        self.assertEqual(all(result["status"] == 201 for result in results), True)
+        self.assertEqual(len(threads) > 0, True)
+        self.assertEqual(all(name.startswith("generation") for name in threads), True)
+
+    async def test_stream_cancelled_on_disconnect(self):
+        produced = []
+        stopped = threading.Event()
+
+        def slow_body():
+            try:
+                for _ in range(100):
+                    time.sleep(0.05)
+                    concurrency.check_cancelled()
+                    produced.append(threading.current_thread().name)
+                    yield b"{}\n"
+            except concurrency.GenerationCancelled:
+                stopped.set()
+                raise
+
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        messages = asyncio.Queue()
+        bodies = []
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                bodies.append(message)
+                if len(bodies) == 5:
+                    messages.put_nowait({"type": "http.disconnect"})
+
+        request_body = {
+            "number": 10,
+            "fields": ["name", "email", "gender", "birthdate"],
+            "stream": "ndjson",
+        }
+        in_flight = concurrency.get_admission().stats()["in_flight_rows"]
+        ticker = asyncio.ensure_future(tick())
+        with patch.object(PersonAPIClass, "encode_stream", lambda *args: slow_body()):
+            await asyncio.wait_for(self.serve(request_body, send, messages), 10)
+        ticker.cancel()
+
+        # The loop kept running whilst the chunks were produced
+        self.assertEqual(ticks >= 20, True)
+        self.assertEqual(await asyncio.to_thread(stopped.wait, 5), True)
+        self.assertEqual(len(produced) < 100, True)
+        self.assertEqual(all(name.startswith("generation") for name in produced), True)
+        self.assertEqual(
+            concurrency.get_admission().stats()["in_flight_rows"], in_flight
+        )
+
+
+class LookupTests(TestCase):
+    def test_country_of_address(self):
+        self.assertEqual(
+            country_of_address(
+                "48900 Natalie Harbors Apt. 006\nWest Stephen, TN 20112"
+            ),
+            "Tunisia",
+        )
+        self.assertEqual(country_of_address("USNS Smith\nFPO XX 12345"), None)
+
+    def test_draw_nationalities(self):
+        countries = np.array(["France", None, "Qwertyland"], dtype=object)
+        codes = demonym_codes(countries)
+        self.assertEqual(codes[0], PLACE_DEMONYM_CODES["France"])
+        self.assertEqual(codes[1:].tolist(), [-1, -1])
+
+        rng = np.random.default_rng(117)
+        drawn = draw_nationalities(np.repeat(codes[:1], 1000), rng)
+        self.assertEqual(set(drawn).issubset(DEMONYMS), True)
+        self.assertEqual(600 < (drawn == DEMONYMS[codes[0]]).sum() < 800, True)
+
+    def test_lazy_tables(self):
+        self.assertEqual(lookups.DEMONYMS is lookups.tables().demonyms, True)
+        self.assertEqual(lookups.tables() is lookups.tables(), True)
+        with self.assertRaises(AttributeError):
+            lookups.COUNTRIES
+
+
+class MultiplexTests(TestCase):
+    fields = ["name", "email", "gender", "birthdate"]
+
+    def setUp(self):
+        self.client = AsyncClient()
+
+    async def test_batch(self):
+        seeded = {"number": 5, "fields": self.fields, "seed": 117}
+        request_body = {
+            "requests": [
+                seeded,
+                {"number": 3, "fields": self.fields + ["dependents"]},
+                {"number": 4, "fields": self.fields},
+                {"fields": self.fields},
+                {"number": 2, "fields": self.fields, "stream": "ndjson"},
+                {"number": 6, "fields": ["dependents"] + self.fields},
+            ]
+        }
+        response = await self.client.generic(
+            "GET", "/api/persons/batch/", ujson.dumps(request_body)
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [
+            ujson.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        results = {line["index"]: line for line in lines}
+        self.assertEqual(sorted(results), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(
+            [results[index]["status"] for index in range(6)],
+            [201, 201, 201, 412, 412, 201],
+        )
+        self.assertEqual(
+            [len(results[index]["body"]) for index in (1, 2, 5)], [3, 4, 6]
+        )
+        self.assertEqual("dependents" in results[5]["body"][0], True)
+
+        single = await self.client.generic("GET", "/api/persons/", ujson.dumps(seeded))
+        self.assertEqual(results[0]["body"], ujson.loads(single.content))
+
+        request_body["format"] = "multipart"
+        response = await self.client.generic(
+            "GET", "/api/persons/batch/", ujson.dumps(request_body)
+        )
+        content_type = response["Content-Type"]
+        self.assertEqual(content_type.startswith("multipart/mixed; boundary="), True)
+        boundary = content_type.split("boundary=")[1].strip('"').encode("ascii")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(body.endswith(b"--" + boundary + b"--\r\n"), True)
+        parts = body.split(b"--" + boundary)[1:-1]
+        self.assertEqual(len(parts), 6)
+        headers, content = parts[0].split(b"\r\n\r\n", 1)
+        self.assertEqual(b"X-Status: 412" in headers, True)
+
+        for body in ({"requests": []}, {"requests": [seeded], "format": "xml"}):
+            response = await self.client.generic(
+                "GET", "/api/persons/batch/", ujson.dumps(body)
+            )
+            self.assertEqual(response.status_code, 412)
+
+    def test_group_specs(self):
+        def spec(index, number, fields=self.fields, seed=None):
+            return multiplex.BatchSpec(
+                index, number, fields, None, GeneratorContext(seed=seed)
+            )
+
+        specs = [
+            spec(0, 10),
+            spec(1, 10, seed=1),
+            spec(2, 5, ["gender", "name", "email", "birthdate"]),
+            spec(3, CHUNK_SIZE),
+            spec(4, 20, self.fields + ["age"]),
+        ]
+        groups = multiplex.group_specs(specs)
+        self.assertEqual(
+            [[spec.index for spec in group] for group in groups],
+            [[0, 2, 3], [1], [4]],
+        )
+        self.assertEqual(
+            [
+                [spec.index for spec in passed]
+                for passed in multiplex.plan_passes(groups[0])
+            ],
+            [[0, 2], [3]],
+        )
+        generated = [
+            (spec.index, sum(len(batch) for batch in batches))
+            for spec, batches in multiplex.generate_group(groups[0])
+        ]
+        self.assertEqual(generated, [(0, 10), (2, 5), (3, CHUNK_SIZE)])
+
+
+class CompressionTests(TestCase):
+    def test_negotiate_encoding(self):
+        self.assertEqual(compression.negotiate_encoding("gzip, deflate, br"), "br")
+        self.assertEqual(compression.negotiate_encoding("gzip"), "gzip")
+        self.assertEqual(compression.negotiate_encoding("br;q=0.5, gzip"), "gzip")
+        self.assertEqual(compression.negotiate_encoding("*"), "br")
+        self.assertEqual(compression.negotiate_encoding("*, br;q=0"), "gzip")
+        self.assertIsNone(compression.negotiate_encoding("identity"))
+        self.assertIsNone(compression.negotiate_encoding(""))
+
+    def test_compress_stream(self):
+        chunks = [b"[", b'{"a":1}', b",", b'{"a":2}', b"]"]
+        for encoding in compression.ENCODINGS:
+            decompressor = (
+                brotli.Decompressor()
+                if encoding == "br"
+                else zlib.decompressobj(16 + zlib.MAX_WBITS)
+            )
+            received = b""
+            for chunk, compressed in zip(
+                chunks, compression.compress_stream(iter(chunks), encoding)
+            ):
+                # Every chunk is decompressed as soon as it is received
+                received += (
+                    decompressor.process(compressed)
+                    if encoding == "br"
+                    else decompressor.decompress(compressed)
+                )
+                self.assertTrue(received.endswith(chunk))
+            self.assertEqual(received, b"".join(chunks))
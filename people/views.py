@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.shortcuts import render
 from django.views import View
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 from django.utils.decorators import classonlymethod
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
 
 from rest_framework import status, generics
 from rest_framework.response import Response
@@ -10,32 +13,86 @@ from asgiref.sync import sync_to_async
 import os
 
 import asyncio
+import inspect
+from datetime import date
 from pprint import pprint
+from typing import Awaitable, Iterator
 import numpy as np
 import ujson
-import enchant
 
+from people import (
+    cache,
+    compression,
+    concurrency,
+    jobs,
+    metrics,
+    multiplex,
+    pages,
+    parallel,
+    pools,
+)
 from people.serializers import PersonSerializer
-from people.dataclass import generate_persons
+from people.streaming import OffloadedStreamingHttpResponse
+from people.suggestions import validate_fields
+from people.batch import PersonBatch
+from people.context import GeneratorContext
+from people.dataclass import generate_persons, iter_persons
+from people.derivations import EXCLUSIVE_UPPER_AGE_LIMIT
+from people.distributions import (
+    DISTRIBUTION_NAMES,
+    AgeDistribution,
+    histogram,
+    named_distribution,
+)
+from people.encoders import (
+    BODY_CONTENT_TYPES,
+    SchemaError,
+    encode_batches,
+    encode_elements,
+    frame_body,
+    frame_elements,
+)
+from people.exporters import EXPORT_CONTENT_TYPES, export_batches
 from people.fields import (
     MANDATORY_FIELDS,
-    USER_QUERY_FIELDS,
     INPUT_TO_OUTPUT_FIELD_MAPPING,
 )
 
-dictionary = enchant.Dict("en_US")
+# The media types of the Accept header that request a MessagePack body
+MSGPACK_MEDIA_TYPES = {"application/msgpack", "application/x-msgpack"}
+
+# The encoding of the body unless MessagePack or the compact form is requested
+DEFAULT_REPRESENTATION = ("json", False)
+
+STREAM_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
 
 
 class RaisedResponse(Exception):
     """An exception that is raised and propagates up the call stack
 
     Args:
-        Exception : Contains human readable content and a HTTP status code
+        Exception : Contains human readable content, a HTTP status code and optional headers
     """
 
-    def __init__(self, content, status):
+    def __init__(self, content, status, headers=None):
         self.content = content
         self.status = status
+        self.headers = headers
+
+
+class RaisedStreamingResponse(RaisedResponse):
+    """A raised response whose content is streamed to the client
+
+    Args:
+        RaisedResponse : Contains an iterator of encoded chunks, a HTTP status code, a content type and optional headers
+    """
+
+    def __init__(self, content, status, content_type, headers=None):
+        super().__init__(content, status, headers)
+        self.content_type = content_type
 
 
 class PersonAPIClass(View):
@@ -46,7 +103,8 @@ class PersonAPIClass(View):
     """
 
     async def get(self, request, *args, **kwargs) -> HttpResponse:
-        """Handles GET requests asynchronously
+        """Handles GET requests asynchronously, the time spent in each stage of
+        the request is reported in a Server-Timing header when it is enabled
 
         Args:
             request : request metadata
@@ -55,15 +113,110 @@ class PersonAPIClass(View):
             HttpResponse: A response class with a content dictionary
             and a HTTP status code
         """
-        request_body = ujson.loads(request.body)
+        timings = metrics.start_request()
+        with metrics.stage("parse"):
+            request_body = ujson.loads(request.body)
         try:
-            self.process_get_request(request_body)
+            rows = await concurrency.get_admission().acquire(
+                concurrency.requested_rows(request_body)
+            )
+        except concurrency.Overloaded as overloaded:
+            return HttpResponse(
+                content=ujson.dumps(
+                    {"error": "Too many people are being generated, please retry later"}
+                ),
+                status=overloaded.status,
+                headers={"Retry-After": str(overloaded.retry_after)},
+            )
+        response = await self.respond(request_body, rows)
+        if timings:
+            response["Server-Timing"] = metrics.server_timing(timings)
+        return response
+
+    async def respond(self, request_body: dict, rows: int) -> HttpResponse:
+        """Processes the request body on the CPU executor and converts the raised
+        response, the admitted rows are released once the response has been
+        generated, or once a streamed response has been sent
+
+        Args:
+            request_body : request metadata
+            rows (int): the rows the request was admitted with, see people/concurrency.py
+
+        Returns:
+            HttpResponse: A response class with a content dictionary
+            and a HTTP status code
+        """
+        streamed = False
+        encoding = self.content_encoding()
+        try:
+            await concurrency.run_cpu(self.process_get_request, request_body)
+        except RaisedStreamingResponse as resp:
+            streamed = True
+            content, headers = resp.content, dict(resp.headers or {})
+            if encoding is not None:
+                content = compression.compress_stream(content, encoding)
+                headers["Content-Encoding"] = encoding
+            response = OffloadedStreamingHttpResponse(
+                streaming_content=concurrency.OffloadedStream(content, rows),
+                status=resp.status,
+                content_type=resp.content_type,
+                headers=headers,
+            )
+            patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+            return response
         except RaisedResponse as resp:
-            return HttpResponse(content=ujson.dumps(resp.content), status=resp.status)
+            content, response_status = resp.content, resp.status
+            if inspect.isawaitable(content):
+                try:
+                    with metrics.stage("generate"):
+                        content = await content
+                except SchemaError:
+                    content = {
+                        "error": "An error was encountered whilst serializing the person data"
+                    }
+                    response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            if not isinstance(content, bytes):
+                with metrics.stage("encode"):
+                    content = await concurrency.run_cpu(ujson.dumps, content)
+                content = content.encode("utf-8")
+            headers = dict(resp.headers or {})
+            if (
+                encoding is not None
+                and len(content) >= settings.PERSON_COMPRESSION_MIN_BYTES
+            ):
+                with metrics.stage("compress"):
+                    content = await concurrency.run_cpu(
+                        compression.compress, content, encoding
+                    )
+                headers["Content-Encoding"] = encoding
+                if "ETag" in headers:
+                    headers["ETag"] = "W/" + headers["ETag"]
+            response = HttpResponse(
+                content=content, status=response_status, headers=headers
+            )
+            patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+            return response
+        finally:
+            if not streamed:
+                concurrency.get_admission().release(rows)
+
+    def content_encoding(self) -> str | None:
+        """The Content-Encoding of the response, negotiated from the Accept-Encoding
+        header of the request when settings.PERSON_COMPRESSION is enabled
+        """
+        if not settings.PERSON_COMPRESSION:
+            return None
+        return compression.negotiate_encoding(
+            self.request.headers.get("Accept-Encoding", "")
+        )
 
     def process_get_request(self, request_body: dict) -> None:
         """Processes the request body, invokes the creation of data
-        and returns the serialized response
+        and returns the serialized response. The schema of the generated data is
+        validated once and encoded directly, unless 'strict' is requested in which
+        case every person is validated by PersonSerializer. Large requests are
+        generated over the process pool when it has been started and the encoded
+        responses of seeded requests are cached, see handle_cache
 
         Args:
             request_body : request metadata
@@ -71,43 +224,697 @@ class PersonAPIClass(View):
         Raises:
             RaisedResponse
         """
-        number_of_people = self.get_number_of_people(request_body)
+        with metrics.stage("validate"):
+            number_of_people = self.get_number_of_people(request_body)
 
-        input_query_fields, output_query_fields = self.handle_fields(request_body)
+            input_query_fields, _ = self.handle_fields(request_body)
 
-        age_list = self.handle_age_restrictions(request_body)
+            age_list = self.handle_age_restrictions(request_body)
+
+            stream_format = self.handle_stream(request_body)
+
+            export_format = self.handle_format(request_body, stream_format)
+
+            context = self.handle_seed(request_body)
+
+            context.locales = self.handle_locales(request_body)
+
+            context.ages = self.handle_age_distribution(request_body, age_list)
+
+            page = self.handle_page(request_body, number_of_people)
+
+            representation = self.handle_representation(request_body)
+
+        strict = bool(request_body.get("strict"))
+
+        use_pool = not strict and parallel.should_parallelise(number_of_people)
 
         if isinstance(age_list, np.ndarray):
             input_query_fields.remove("birthdate")
-            output_query_fields.remove("birthdate")
+
+        if representation != DEFAULT_REPRESENTATION:
+            if (
+                strict
+                or page is not None
+                or export_format is not None
+                or stream_format == "ndjson"
+            ):
+                self.raise_response(
+                    {
+                        "error": "MessagePack and compact bodies cannot be strict, paginated, downloaded as a table or streamed as ndjson"
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            self.raise_representation(
+                number_of_people,
+                input_query_fields,
+                age_list,
+                context,
+                representation,
+                stream_format is not None,
+            )
+
+        if page is not None:
+            if stream_format is not None or export_format is not None:
+                self.raise_response(
+                    {"error": "Pages cannot be streamed or downloaded as a table"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            if not context.seeded:
+                self.raise_response(
+                    {"error": "Please specify a seed to paginate the entries"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            self.raise_page(
+                number_of_people,
+                page,
+                input_query_fields,
+                age_list,
+                context,
+                strict,
+            )
+
+        # Table exports are zip archives generated as they are sent, they are
+        # neither cached nor answered from the cache of their JSON body
+        cache_key = None
+        if stream_format is None and export_format is None and not strict:
+            cache_key = self.handle_cache(
+                number_of_people, input_query_fields, age_list, context
+            )
+
+        if export_format is not None:
+            self.raise_export(
+                iter_persons(
+                    number=number_of_people,
+                    input_fields=input_query_fields,
+                    age_list=age_list,
+                    context=context,
+                ),
+                export_format,
+            )
+
+        if stream_format is not None and use_pool:
+            fragments = parallel.iter_encoded(
+                number_of_people, input_query_fields, age_list, context, stream_format
+            )
+            self.raise_streaming_response(
+                frame_elements(fragments, stream_format),
+                status=status.HTTP_201_CREATED,
+                content_type=STREAM_CONTENT_TYPES[stream_format],
+            )
+
+        if stream_format is not None:
+            chunks = iter_persons(
+                number=number_of_people,
+                input_fields=input_query_fields,
+                age_list=age_list,
+                context=context,
+            )
+            self.raise_streaming_response(
+                self.encode_stream(chunks, stream_format, strict),
+                status=status.HTTP_201_CREATED,
+                content_type=STREAM_CONTENT_TYPES[stream_format],
+            )
+
+        if use_pool:
+            self.raise_response(
+                self.store_response(
+                    cache_key,
+                    parallel.generate_encoded(
+                        number_of_people, input_query_fields, age_list, context
+                    ),
+                ),
+                status=status.HTTP_201_CREATED,
+                headers=self.cache_headers(cache_key),
+            )
+
+        if not strict:
+            chunks = iter_persons(
+                number=number_of_people,
+                input_fields=input_query_fields,
+                age_list=age_list,
+                context=context,
+            )
+            try:
+                encoded = encode_batches(chunks)
+            except SchemaError:
+                encoded = None
+            if encoded is not None:
+                self.raise_response(
+                    self.store_response(cache_key, encoded),
+                    status=status.HTTP_201_CREATED,
+                    headers=self.cache_headers(cache_key),
+                )
+            self.raise_response(
+                {
+                    "error": "An error was encountered whilst serializing the person data"
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
 
         generated_people = generate_persons(
             number=number_of_people,
             input_fields=input_query_fields,  # This list include email, gender
-            output_fields=output_query_fields,  # This list includes mail, sex
             age_list=age_list,
+            context=context,
         )
 
-        serialized = PersonSerializer(data=generated_people, many=True)
-        if serialized.is_valid():
-            self.raise_response(serialized.data, status=status.HTTP_201_CREATED)
+        with metrics.stage("serialize"):
+            serialized = PersonSerializer(data=generated_people, many=True)
+            valid = serialized.is_valid()
+            if valid:
+                serialized_people = serialized.data
+        if valid:
+            self.raise_response(serialized_people, status=status.HTTP_201_CREATED)
 
         self.raise_response(
             {"error": "An error was encountered whilst serializing the person data"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
 
-    def raise_response(self, content: dict, status: int) -> None:
+    def raise_response(
+        self,
+        content: dict | bytes | Awaitable[bytes],
+        status: int,
+        headers: dict = None,
+    ) -> None:
         """
         A method that raises a custom exception to be propagated up the callstack
         Args:
-            content (dict): an error dictionary or the serialized result
+            content (dict | bytes | Awaitable[bytes]): an error dictionary, the serialized result, the encoded result or an awaitable of it
             status (int): HTTP response code
+            headers (dict, optional): additional response headers. Defaults to None.
 
         Raises:
             RaisedResponse: An exception class
         """
-        raise RaisedResponse(content=content, status=status)
+        raise RaisedResponse(content=content, status=status, headers=headers)
+
+    def raise_streaming_response(
+        self,
+        content: Iterator[bytes],
+        status: int,
+        content_type: str,
+        headers: dict = None,
+    ) -> None:
+        """
+        A method that raises a custom exception carrying a streamed body
+        Args:
+            content (Iterator[bytes]): the encoded chunks of the response
+            status (int): HTTP response code
+            content_type (str): the media type of the streamed body
+            headers (dict, optional): additional response headers. Defaults to None.
+
+        Raises:
+            RaisedStreamingResponse: An exception class
+        """
+        raise RaisedStreamingResponse(
+            content=content, status=status, content_type=content_type, headers=headers
+        )
+
+    def raise_representation(
+        self,
+        number_of_people: int,
+        input_fields: list[str],
+        age_list: np.ndarray,
+        context: GeneratorContext,
+        representation: tuple[str, bool],
+        streamed: bool = False,
+    ) -> None:
+        """Generates a body encoded as MessagePack or in the compact form, see frame_body
+
+        Args:
+            number_of_people (int): The number of entries generated
+            input_fields (list[str]): A list of desired fields as specified by the user input
+            age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+            context (GeneratorContext): The random state of the request
+            representation (tuple[str, bool]): the media type and whether the body is compact, see handle_representation
+            streamed (bool, optional): stream the body as it is generated. Defaults to False.
+
+        Raises:
+            RaisedStreamingResponse: with the streamed body
+            RaisedResponse: with the body, from the response cache when it is cacheable
+        """
+        media, compact = representation
+        content_type = BODY_CONTENT_TYPES[media]
+        cache_key = None
+        if not streamed:
+            cache_key = self.handle_cache(
+                number_of_people,
+                input_fields,
+                age_list,
+                context,
+                representation=representation,
+            )
+
+        chunks = iter_persons(
+            number=number_of_people,
+            input_fields=input_fields,
+            age_list=age_list,
+            context=context,
+        )
+        body = frame_body(chunks, number_of_people, media, compact)
+        if streamed:
+            self.raise_streaming_response(
+                body, status=status.HTTP_201_CREATED, content_type=content_type
+            )
+
+        try:
+            encoded = b"".join(body)
+        except SchemaError:
+            self.raise_response(
+                {
+                    "error": "An error was encountered whilst serializing the person data"
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        self.raise_response(
+            self.store_response(cache_key, encoded),
+            status=status.HTTP_201_CREATED,
+            headers={
+                "Content-Type": content_type,
+                **(self.cache_headers(cache_key) or {}),
+            },
+        )
+
+    def raise_page(
+        self,
+        number_of_people: int,
+        page: tuple[int, int],
+        input_fields: list[str],
+        age_list: np.ndarray,
+        context: GeneratorContext,
+        strict: bool = False,
+    ) -> None:
+        """Generates a page of the virtual dataset of a seeded request, see people/pages.py
+
+        Args:
+            number_of_people (int): The number of entries of the whole dataset
+            page (tuple[int, int]): the offset and limit of the page
+            input_fields (list[str]): A list of desired fields as specified by the user input
+            age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+            context (GeneratorContext): The seeded random state of the dataset
+            strict (bool, optional): validate every person with PersonSerializer. Defaults to False.
+
+        Raises:
+            RaisedResponse: with the page, from the response cache unless strict
+        """
+        offset, limit = page
+        cache_key = None
+        if not strict:
+            cache_key = self.handle_cache(
+                number_of_people, input_fields, age_list, context, page
+            )
+
+        chunks = pages.iter_page(
+            number_of_people, offset, limit, input_fields, age_list, context
+        )
+        results = None
+        if strict:
+            records = [record for chunk in chunks for record in chunk.to_records()]
+            with metrics.stage("serialize"):
+                serialized = PersonSerializer(data=records, many=True)
+                if serialized.is_valid():
+                    results = ujson.dumps(serialized.data).encode("utf-8")
+        else:
+            try:
+                results = encode_batches(chunks)
+            except SchemaError:
+                pass
+        if results is None:
+            self.raise_response(
+                {
+                    "error": "An error was encountered whilst serializing the person data"
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        self.raise_response(
+            self.store_response(
+                cache_key,
+                pages.encode_page(number_of_people, offset, limit, results),
+            ),
+            status=status.HTTP_201_CREATED,
+            headers=self.cache_headers(cache_key),
+        )
+
+    def raise_export(self, chunks: Iterator[PersonBatch], export_format: str) -> None:
+        """Streams chunks of generated people as a tabular file, see people/exporters.py
+
+        Args:
+            chunks (Iterator[PersonBatch]): chunks of generated people
+            export_format (str): either 'csv', 'arrow' or 'npz'
+
+        Raises:
+            RaisedStreamingResponse: with the exported file
+            RaisedResponse: if the people do not conform to PersonSerializer
+        """
+        try:
+            body, content_type, file_name = export_batches(chunks, export_format)
+        except SchemaError:
+            self.raise_response(
+                {
+                    "error": "An error was encountered whilst serializing the person data"
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        self.raise_streaming_response(
+            body,
+            status=status.HTTP_201_CREATED,
+            content_type=content_type,
+            headers={"Content-Disposition": f'attachment; filename="{file_name}"'},
+        )
+
+    def encode_stream(
+        self, chunks: Iterator[list[dict]], stream_format: str, strict: bool = False
+    ) -> Iterator[bytes]:
+        """Serializes and encodes each chunk of generated people as it is produced,
+        either as newline delimited JSON or as the elements of a single JSON array.
+        As the status has already been sent, a serialization error is written
+        into the stream as an error object and the stream is ended
+
+        Args:
+            chunks (Iterator[PersonBatch]): chunks of generated people
+            stream_format (str): either 'ndjson' or 'json'
+            strict (bool, optional): validate every person with PersonSerializer. Defaults to False.
+
+        Returns:
+            Iterator[bytes]: the encoded chunks of the response body
+        """
+
+        def fragments() -> Iterator[bytes]:
+            for chunk in chunks:
+                try:
+                    if strict:
+                        with metrics.stage("serialize"):
+                            serialized = PersonSerializer(
+                                data=chunk.to_records(), many=True
+                            )
+                            if not serialized.is_valid():
+                                raise SchemaError(serialized.errors)
+                            chunk = serialized.data
+                    yield encode_elements(chunk, stream_format)
+                except SchemaError:
+                    error = ujson.dumps(
+                        {
+                            "error": "An error was encountered whilst serializing the person data"
+                        }
+                    )
+                    if stream_format == "ndjson":
+                        error += "\n"
+                    yield error.encode("utf-8")
+                    return
+
+        return frame_elements(fragments(), stream_format)
+
+    def handle_cache(
+        self,
+        number_of_people: int,
+        input_fields: list[str],
+        age_list: np.ndarray,
+        context: GeneratorContext,
+        page: tuple[int, int] = None,
+        representation: tuple[str, bool] = None,
+    ) -> str | None:
+        """Serves seeded requests from the response cache, a request whose
+        If-None-Match header holds the ETag of its response is answered with 304
+
+        Args:
+            number_of_people (int): The number of entries generated
+            input_fields (list[str]): A list of desired fields as specified by the user input
+            age_list (np.ndarray): A numpy 1 dimensional array outlining the potential age range as specified by the user, or None
+            context (GeneratorContext): The random state of the request
+            page (tuple[int, int], optional): the offset and limit of a page of the request. Defaults to None.
+            representation (tuple[str, bool], optional): the encoding of the body, see handle_representation. Defaults to JSON.
+
+        Raises:
+            RaisedResponse: with the cached response or 304
+
+        Returns:
+            str | None: the key the response is to be cached under, None if it is not cacheable
+        """
+        response_cache = cache.get_response_cache()
+        if response_cache is None or not context.seeded:
+            return None
+
+        cache_key = cache.request_key(
+            number_of_people, input_fields, age_list, context, page, representation
+        )
+        etag = quote_etag(cache_key)
+        if_none_match = parse_etags(self.request.headers.get("If-None-Match", ""))
+        if (
+            etag in if_none_match
+            or f"W/{etag}" in if_none_match
+            or "*" in if_none_match
+        ):
+            response_cache.not_modified += 1
+            self.raise_response(
+                b"", status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+            )
+
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            headers = {"ETag": etag, "X-Cache": "HIT"}
+            if representation is not None:
+                headers["Content-Type"] = BODY_CONTENT_TYPES[representation[0]]
+            self.raise_response(cached, status=status.HTTP_201_CREATED, headers=headers)
+        return cache_key
+
+    def store_response(
+        self, cache_key: str | None, content: bytes | Awaitable[bytes]
+    ) -> bytes | Awaitable[bytes]:
+        """Stores an encoded response in the response cache, once it has been
+        generated when it is awaitable
+
+        Args:
+            cache_key (str | None): the key returned by handle_cache
+            content (bytes | Awaitable[bytes]): the encoded response
+
+        Returns:
+            bytes | Awaitable[bytes]: the content, or an awaitable of it
+        """
+        if cache_key is None:
+            return content
+        response_cache = cache.get_response_cache()
+        if inspect.isawaitable(content):
+            return response_cache.set_when_done(cache_key, content)
+        response_cache.set(cache_key, content)
+        return content
+
+    def cache_headers(self, cache_key: str | None) -> dict | None:
+        """The headers of a response that was generated for a cacheable request"""
+        if cache_key is None:
+            return None
+        return {"ETag": quote_etag(cache_key), "X-Cache": "MISS"}
+
+    def handle_format(
+        self, request_body: dict, stream_format: str | None
+    ) -> str | None:
+        """Collects the optional tabular format of the response, exports are always
+        streamed and so cannot be combined with a stream format
+
+        Args:
+            request_body (dict): request body
+            stream_format (str | None): the stream format returned by handle_stream
+
+        Returns:
+            str | None: 'csv', 'arrow' or 'npz' when an export was requested, else None
+        """
+        export_format = request_body.get("format")
+        if export_format is None:
+            return None
+
+        if export_format not in EXPORT_CONTENT_TYPES:
+            self.raise_response(
+                {
+                    "error": f"{export_format} is not a supported format, please use 'csv', 'arrow' or 'npz'"
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+        if stream_format is not None:
+            self.raise_response(
+                {"error": "Please specify either 'format' or 'stream', not both"},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+        return export_format
+
+    def handle_stream(self, request_body: dict) -> str | None:
+        """Collects the optional streaming format of the response
+
+        Args:
+            request_body (dict): request body
+
+        Returns:
+            str | None: 'ndjson' or 'json' when streaming was requested, else None
+        """
+        stream_format = request_body.get("stream")
+        if stream_format is not None and stream_format not in STREAM_CONTENT_TYPES:
+            self.raise_response(
+                {
+                    "error": f"{stream_format} is not a supported stream format, please use 'ndjson' or 'json'"
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        return stream_format
+
+    def handle_seed(self, request_body: dict) -> GeneratorContext:
+        """Handles validation of the optional seed and reference date, which together
+        make the generated data reproducible
+
+        Args:
+            request_body (dict): request body
+
+        Returns:
+            GeneratorContext: the random state of this request
+        """
+        seed = request_body.get("seed")
+        if seed is not None and (
+            not isinstance(seed, int) or isinstance(seed, bool) or seed < 0
+        ):
+            self.raise_response(
+                {"error": f"The seed {seed} should be a non-negative integer"},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        reference_date = request_body.get("reference_date")
+        if reference_date is not None:
+            try:
+                reference_date = date.fromisoformat(reference_date)
+            except (TypeError, ValueError):
+                self.raise_response(
+                    {
+                        "error": f"The reference date {reference_date} should be formatted as YYYY-MM-DD"
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+
+        return GeneratorContext(seed=seed, today=reference_date)
+
+    def handle_locales(self, request_body: dict) -> dict[str, float] | None:
+        """Handles validation of the optional locales, a mapping of faker locales to
+        the relative weight with which a person is generated in each of them
+
+        Args:
+            request_body (dict): request body
+
+        Returns:
+            dict[str, float] | None: the weight of each locale normalized to sum to 1, or None
+        """
+        locales = request_body.get("locales")
+        if locales is None:
+            return None
+        if not isinstance(locales, dict) or not locales:
+            self.raise_response(
+                {
+                    "error": 'The locales should map faker locales to weights, for example {"en_GB": 0.5, "de_DE": 0.5}'
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        from faker.config import AVAILABLE_LOCALES
+
+        for locale, weight in locales.items():
+            if locale not in AVAILABLE_LOCALES:
+                self.raise_response(
+                    {"error": f"{locale} is not a supported locale"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            if (
+                not isinstance(weight, (int, float))
+                or isinstance(weight, bool)
+                or not weight > 0
+                or weight == float("inf")
+            ):
+                self.raise_response(
+                    {
+                        "error": f"The weight {weight} of {locale} should be a positive number"
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+
+        total = sum(locales.values())
+        return {locale: weight / total for locale, weight in sorted(locales.items())}
+
+    def handle_representation(self, request_body: dict) -> tuple[str, bool]:
+        """Negotiates the media type of the body from the Accept header, either JSON
+        or MessagePack, and handles validation of the optional 'compact' flag which
+        sends the keys of the people once rather than with every person
+
+        Args:
+            request_body (dict): request body
+
+        Returns:
+            tuple[str, bool]: either 'json' or 'msgpack' and whether the body is compact
+        """
+        compact = request_body.get("compact", False)
+        if not isinstance(compact, bool):
+            self.raise_response(
+                {"error": f"compact should be either true or false, not {compact}"},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        accepted = {
+            media_type.split(";")[0].strip().lower()
+            for media_type in self.request.headers.get("Accept", "").split(",")
+            if "q=0" not in media_type.replace(" ", "").split(";")[1:]
+        }
+        media = "json"
+        if accepted & MSGPACK_MEDIA_TYPES:
+            media = "msgpack"
+        return media, compact
+
+    def handle_page(
+        self, request_body: dict, number_of_people: int
+    ) -> tuple[int, int] | None:
+        """Handles validation of the optional offset, limit and cursor that request
+        a page of the virtual dataset defined by the request
+
+        Args:
+            request_body (dict): request body
+            number_of_people (int): The number of entries of the whole dataset
+
+        Returns:
+            tuple[int, int] | None: the offset and limit of the page, None when no page is requested
+        """
+        if not any(field in request_body for field in pages.PAGE_FIELDS):
+            return None
+
+        cursor = request_body.get("cursor")
+        offset = request_body.get("offset", 0)
+        if cursor is not None:
+            if "offset" in request_body:
+                self.raise_response(
+                    {"error": "Please specify either an offset or a cursor"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            try:
+                offset = pages.decode_cursor(cursor)
+            except ValueError:
+                self.raise_response(
+                    {"error": f"The cursor {cursor} is not valid"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            self.raise_response(
+                {"error": f"The offset {offset} should be a non-negative integer"},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        limit = request_body.get("limit", settings.REST_FRAMEWORK["PAGE_SIZE"])
+        if (
+            not isinstance(limit, int)
+            or isinstance(limit, bool)
+            or not 0 < limit <= settings.PERSON_PAGE_MAX_SIZE
+        ):
+            self.raise_response(
+                {
+                    "error": f"The limit {limit} should be an integer between 1 and {settings.PERSON_PAGE_MAX_SIZE}"
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        return offset, limit
 
     def get_number_of_people(self, request_body: dict) -> int:
         """
@@ -128,6 +935,37 @@ class PersonAPIClass(View):
 
         return number_of_people
 
+    def handle_number(self, request_body: dict, maximum: int = None) -> int:
+        """Collects the number of entries to be generated and checks that it is a
+        non-negative integer of at most maximum
+
+        Args:
+            request_body (dict): request body
+            maximum (int, optional): the largest number allowed. Defaults to None.
+
+        Returns:
+            int: the number of people
+        """
+        number_of_people = self.get_number_of_people(request_body)
+        if (
+            not isinstance(number_of_people, int)
+            or isinstance(number_of_people, bool)
+            or number_of_people < 0
+        ):
+            self.raise_response(
+                {
+                    "error": f"The number {number_of_people} should be a non-negative integer"
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+        if maximum is not None and number_of_people > maximum:
+            self.raise_response(
+                {"error": f"The number {number_of_people} should be at most {maximum}"},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        return number_of_people
+
     def handle_fields(self, request_body: dict) -> tuple[list, list]:
         """Handles input validation and ensures mandatory
         fields are provided and gives suggestions for mistyped fields
@@ -201,7 +1039,14 @@ class PersonAPIClass(View):
         age_list = None
         lower_age_limit = request_body.get("age_lower_limit")
         upper_age_limit = request_body.get("age_upper_limit")
-        EXCLUSIVE_UPPER_AGE_LIMIT = 115
+
+        if lower_age_limit is not None and lower_age_limit < 0:
+            self.raise_response(
+                {
+                    "error": f"The lower age limit of {lower_age_limit} is not appropriate"
+                },
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            )
 
         if upper_age_limit is not None and upper_age_limit > EXCLUSIVE_UPPER_AGE_LIMIT:
             self.raise_response(
@@ -244,10 +1089,90 @@ class PersonAPIClass(View):
 
         return age_list
 
+    def handle_age_distribution(
+        self, request_body: dict, age_list: np.ndarray | None
+    ) -> AgeDistribution | None:
+        """Handles validation of the optional age distribution, either one of
+        DISTRIBUTION_NAMES or a histogram of the relative weights of age bands, such
+        as {"edges": [0, 18, 65, 115], "weights": [20, 60, 20]}
+
+        Args:
+            request_body (dict): request body
+            age_list (np.ndarray | None): the potential ages, see handle_age_restrictions
+
+        Returns:
+            AgeDistribution | None: the distribution, or None when birthdates are uniformly distributed
+        """
+        distribution = request_body.get(
+            "age_distribution", settings.PERSON_AGE_DISTRIBUTION
+        )
+        if distribution is None:
+            return None
+
+        if isinstance(distribution, str):
+            if distribution not in DISTRIBUTION_NAMES:
+                self.raise_response(
+                    {
+                        "error": f"{distribution} is not a supported age distribution, please use one of {', '.join(DISTRIBUTION_NAMES)} or a histogram"
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            ages = named_distribution(distribution)
+        else:
+            edges = weights = None
+            if isinstance(distribution, dict):
+                edges = distribution.get("edges")
+                weights = distribution.get("weights")
+            if not (
+                isinstance(edges, list)
+                and isinstance(weights, list)
+                and len(edges) == len(weights) + 1
+                and all(
+                    isinstance(edge, int) and not isinstance(edge, bool)
+                    for edge in edges
+                )
+                and all(
+                    isinstance(weight, (int, float))
+                    and not isinstance(weight, bool)
+                    and 0 <= weight < float("inf")
+                    for weight in weights
+                )
+                and edges[0] >= 0
+                and edges[-1] <= EXCLUSIVE_UPPER_AGE_LIMIT
+                and all(lower < upper for lower, upper in zip(edges, edges[1:]))
+                and sum(weights) > 0
+            ):
+                self.raise_response(
+                    {
+                        "error": f'The age distribution should be one of {", ".join(DISTRIBUTION_NAMES)} or a histogram of ages below {EXCLUSIVE_UPPER_AGE_LIMIT}, for example {{"edges": [0, 18, 65, 115], "weights": [20, 60, 20]}}'
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+            total = sum(weights)
+            ages = histogram(
+                edges,
+                weights,
+                (
+                    "histogram",
+                    tuple(edges),
+                    tuple(weight / total for weight in weights),
+                ),
+            )
+
+        if isinstance(age_list, np.ndarray):
+            try:
+                ages.restrict(age_list)
+            except ValueError:
+                self.raise_response(
+                    {"error": "The age distribution has no ages within the age limits"},
+                    status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                )
+        return ages
+
     def validate_inputted_fields(
         self, inputted_fields: list
     ) -> tuple[bool, str | None, str | None]:
-        """Suggests a field name for an erroneous inputted field
+        """Suggests a field name for an erroneous inputted field, see people/suggestions.py
 
         Args:
             inputted_fields (list): user inputted fields
@@ -257,16 +1182,298 @@ class PersonAPIClass(View):
             second element would be the erroneous field and third would be a potential suggestion.
         """
         for field in inputted_fields:
-            if field not in USER_QUERY_FIELDS:
-                suggestions = dictionary.suggest(field)
+            if not isinstance(field, str):
+                return False, field, None
+
+        return validate_fields(tuple(inputted_fields))
+
+
+class PersonJobsClass(PersonAPIClass):
+    """A class based view that is responsible for the /api/jobs/ endpoint, jobs
+    generate requests of millions of entries in the background
+
+    Inherits from:
+        PersonAPIClass: Provides the validation of the request body
+    """
+
+    http_method_names = ["get", "post"]
+
+    async def get(self, request, *args, **kwargs) -> HttpResponse:
+        """Lists the jobs of this process
+
+        Returns:
+            HttpResponse: A response with the state of every job
+        """
+        registry = jobs.get_job_registry()
+        return HttpResponse(
+            content=ujson.dumps([job.to_dict() for job in registry.list()]),
+            status=status.HTTP_200_OK,
+        )
+
+    async def post(self, request, *args, **kwargs) -> HttpResponse:
+        """Queues a job, the body is that of a request to /api/persons/ with an
+        optional 'format' of either 'ndjson' (the default) or 'json'
+
+        Returns:
+            HttpResponse: A response with the state of the queued job
+        """
+        request_body = ujson.loads(request.body)
+        try:
+            self.process_post_request(request_body)
+        except RaisedResponse as resp:
+            return HttpResponse(
+                content=ujson.dumps(resp.content),
+                status=resp.status,
+                headers=resp.headers,
+            )
+
+    def process_post_request(self, request_body: dict) -> None:
+        """Validates the request body and queues a job, a job is refused with 429
+        when too many jobs are already queued or running, see people/jobs.py
+
+        Args:
+            request_body : request metadata
+
+        Raises:
+            RaisedResponse
+        """
+        number_of_people = self.handle_number(
+            request_body, settings.PERSON_JOB_MAX_NUMBER
+        )
+
+        input_query_fields, _ = self.handle_fields(request_body)
+
+        age_list = self.handle_age_restrictions(request_body)
+
+        context = self.handle_seed(request_body)
+
+        context.locales = self.handle_locales(request_body)
+
+        context.ages = self.handle_age_distribution(request_body, age_list)
+
+        job_format = request_body.get("format", "ndjson")
+        if job_format not in jobs.JOB_CONTENT_TYPES:
+            self.raise_response(
+                {
+                    "error": f"{job_format} is not a supported job format, please use 'ndjson' or 'json'"
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+
+        if isinstance(age_list, np.ndarray):
+            input_query_fields.remove("birthdate")
+
+        try:
+            job = jobs.get_job_registry().create(
+                number_of_people, input_query_fields, age_list, context, job_format
+            )
+        except jobs.JobLimitReached:
+            self.raise_response(
+                {"error": "Too many jobs are queued or running, please retry later"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(settings.PERSON_RETRY_AFTER)},
+            )
+        self.raise_response(job.to_dict(), status=status.HTTP_202_ACCEPTED)
+
+
+class PersonBatchClass(PersonAPIClass):
+    """A class based view that is responsible for the /api/persons/batch/ endpoint,
+    which generates the entries of many request bodies in a single response
 
+    Inherits from:
+        PersonAPIClass: Provides the validation of the request bodies
+    """
+
+    http_method_names = ["get"]
+
+    def process_get_request(self, request_body: dict) -> None:
+        """Validates every spec of the batch and streams their results, see
+        people/multiplex.py. A spec that fails validation does not fail the batch,
+        its result holds the status and error it would have been answered with
+
+        Args:
+            request_body : request metadata, with a list of 'requests' and an optional 'format'
+
+        Raises:
+            RaisedResponse
+        """
+        with metrics.stage("validate"):
+            request_specs = request_body.get("requests")
+            if (
+                not isinstance(request_specs, list)
+                or not request_specs
+                or len(request_specs) > settings.PERSON_BATCH_MAX_REQUESTS
+            ):
+                self.raise_response(
+                    {
+                        "error": f"Please specify between 1 and {settings.PERSON_BATCH_MAX_REQUESTS} request bodies in the 'requests' array"
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+
+            batch_format = request_body.get("format", "ndjson")
+            if batch_format not in multiplex.BATCH_CONTENT_TYPES:
+                self.raise_response(
+                    {
+                        "error": f"{batch_format} is not a supported batch format, please use 'ndjson' or 'multipart'"
+                    },
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+
+            specs, errors = [], []
+            for index, request_spec in enumerate(request_specs):
                 try:
-                    string_suggestion = USER_QUERY_FIELDS.intersection(
-                        suggestions
-                    ).pop()
-                except KeyError:
-                    return False, field, None
+                    specs.append(self.handle_spec(index, request_spec))
+                except RaisedResponse as error:
+                    errors.append((index, error.status, error.content))
+
+        content, content_type = multiplex.encode_results(
+            multiplex.iter_results(specs, errors), batch_format
+        )
+        self.raise_streaming_response(
+            content, status=status.HTTP_201_CREATED, content_type=content_type
+        )
+
+    def handle_spec(self, index: int, request_spec: dict) -> multiplex.BatchSpec:
+        """Validates a spec of the batch as the body of a request to /api/persons/
+
+        Args:
+            index (int): the position of the spec within the batch
+            request_spec (dict): the spec
+
+        Raises:
+            RaisedResponse: if the spec is not valid
+
+        Returns:
+            multiplex.BatchSpec: the validated spec
+        """
+        if not isinstance(request_spec, dict):
+            self.raise_response(
+                {"error": "Every request of a batch should be an object"},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+        for field in multiplex.UNSUPPORTED_SPEC_FIELDS:
+            if field in request_spec:
+                self.raise_response(
+                    {"error": f"'{field}' is not supported within a batch"},
+                    status=status.HTTP_412_PRECONDITION_FAILED,
+                )
+
+        number_of_people = self.handle_number(request_spec)
+
+        input_query_fields, _ = self.handle_fields(request_spec)
+
+        age_list = self.handle_age_restrictions(request_spec)
 
-                return False, field, string_suggestion
+        context = self.handle_seed(request_spec)
 
-        return True, None, None
+        context.locales = self.handle_locales(request_spec)
+
+        context.ages = self.handle_age_distribution(request_spec, age_list)
+
+        if isinstance(age_list, np.ndarray):
+            input_query_fields.remove("birthdate")
+
+        return multiplex.BatchSpec(
+            index, number_of_people, input_query_fields, age_list, context
+        )
+
+
+class PersonJobClass(View):
+    """A class based view that is responsible for the /api/jobs/<job_id>/ endpoint
+
+    Inherits from:
+        View (Generic python class): Implements a dispatch-by-method and provides simple sanity checking
+    """
+
+    async def get(self, request, job_id: str, *args, **kwargs) -> HttpResponse:
+        """Returns the state and progress of a job"""
+        job = jobs.get_job_registry().get(job_id)
+        if job is None:
+            return job_not_found(job_id)
+        return HttpResponse(
+            content=ujson.dumps(job.to_dict()), status=status.HTTP_200_OK
+        )
+
+    async def delete(self, request, job_id: str, *args, **kwargs) -> HttpResponse:
+        """Cancels a job if it is running and deletes its output"""
+        job = await sync_to_async(jobs.get_job_registry().delete)(job_id)
+        if job is None:
+            return job_not_found(job_id)
+        return HttpResponse(
+            content=ujson.dumps(job.to_dict()), status=status.HTTP_200_OK
+        )
+
+
+class PersonJobDownloadClass(View):
+    """A class based view that is responsible for the /api/jobs/<job_id>/download/
+    endpoint, a single byte range of the output can be requested with a Range header
+
+    Inherits from:
+        View (Generic python class): Implements a dispatch-by-method and provides simple sanity checking
+    """
+
+    async def get(self, request, job_id: str, *args, **kwargs) -> HttpResponse:
+        """Downloads the output of a finished job, or a byte range of it"""
+        job = jobs.get_job_registry().get(job_id)
+        if job is None:
+            return job_not_found(job_id)
+        if job.status != "finished":
+            return HttpResponse(
+                content=ujson.dumps(
+                    {"error": f"The job {job_id} is {job.status}, not finished"}
+                ),
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        size = job.bytes_written
+        try:
+            byte_range = jobs.parse_range(request.headers.get("Range", ""), size)
+        except ValueError:
+            return HttpResponse(
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f'attachment; filename="{job_id}.{job.format}"',
+        }
+        if byte_range is None or size == 0:
+            start, stop, response_status = 0, size - 1, status.HTTP_200_OK
+        else:
+            start, stop = byte_range
+            response_status = status.HTTP_206_PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {start}-{stop}/{size}"
+        headers["Content-Length"] = str(stop - start + 1)
+        return StreamingHttpResponse(
+            streaming_content=jobs.iter_file(job.path, start, stop),
+            status=response_status,
+            content_type=job.content_type,
+            headers=headers,
+        )
+
+
+def job_not_found(job_id: str) -> HttpResponse:
+    """The response to a request for a job that does not exist or has expired"""
+    return HttpResponse(
+        content=ujson.dumps({"error": f"There is no job {job_id}"}),
+        status=status.HTTP_404_NOT_FOUND,
+    )
+
+
+class MetricsClass(View):
+    """A class based view that is responsible for the /metrics endpoint, it exposes
+    the timings of people.metrics and the statistics of the shared pools and of the
+    response cache in the Prometheus text format
+
+    Inherits from:
+        View (Generic python class): Implements a dispatch-by-method and provides simple sanity checking
+    """
+
+    async def get(self, request, *args, **kwargs) -> HttpResponse:
+        return HttpResponse(
+            content=metrics.render(pools.shared_pools, cache.get_response_cache()),
+            status=status.HTTP_200_OK,
+            content_type=metrics.PROMETHEUS_CONTENT_TYPE,
+        )
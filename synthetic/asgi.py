@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "synthetic.settings")
 
-application = get_asgi_application()
+from people.concurrency import CancelOnDisconnect
+from people.streaming import get_asgi_application
+
+application = CancelOnDisconnect(get_asgi_application())
+
+from people.parallel import start_pool
+from people.pools import start_shared_pools
+
+start_pool()
+start_shared_pools()
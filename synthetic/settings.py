@@ -129,3 +129,126 @@ REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
 }
+
+
+# Synthetic person generation
+# Requests of at least PERSON_PARALLEL_THRESHOLD entries are generated over a pool of
+# PERSON_GENERATION_WORKERS processes (defaulting to the number of CPUs), the pool is
+# started by the ASGI application
+
+PERSON_GENERATION_WORKERS = None
+
+PERSON_PARALLEL_THRESHOLD = 100000
+
+
+# Unseeded requests draw faker values from shared pools of at most
+# PERSON_SHARED_POOL_CAPACITY values or PERSON_SHARED_POOL_MAX_BYTES per provider,
+# a background thread started by the ASGI application samples
+# PERSON_SHARED_POOL_REFILL_SIZE new values into every pool each
+# PERSON_SHARED_POOL_REFILL_INTERVAL seconds
+
+PERSON_SHARED_POOLS = True
+
+PERSON_SHARED_POOL_CAPACITY = 16384
+
+PERSON_SHARED_POOL_MAX_BYTES = 16 * 1024 * 1024
+
+PERSON_SHARED_POOL_REFILL_SIZE = 1024
+
+PERSON_SHARED_POOL_REFILL_INTERVAL = 2.0
+
+
+# The encoded responses of seeded requests are cached by PERSON_RESPONSE_CACHE_BACKEND,
+# which is either "memory" (a per process LRU), "django" (the cache named
+# PERSON_RESPONSE_CACHE_ALIAS in CACHES), "file" (files in
+# PERSON_RESPONSE_CACHE_DIRECTORY) or None to disable caching. At most
+# PERSON_RESPONSE_CACHE_MAX_BYTES of responses are kept by the memory and file backends
+
+PERSON_RESPONSE_CACHE_BACKEND = "memory"
+
+PERSON_RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+PERSON_RESPONSE_CACHE_ALIAS = "default"
+
+PERSON_RESPONSE_CACHE_DIRECTORY = BASE_DIR / "response_cache"
+
+
+# Jobs started through /api/jobs/ write their output to PERSON_JOB_DIRECTORY, the
+# output of a job is deleted PERSON_JOB_TTL seconds after the job has ended
+
+PERSON_JOB_DIRECTORY = BASE_DIR / "jobs"
+
+PERSON_JOB_TTL = 3600
+
+
+# Jobs run on a pool of PERSON_JOB_WORKERS threads, further jobs are queued. A job
+# is refused with 429 when PERSON_JOB_MAX_ACTIVE jobs are already queued or running,
+# and a job generates at most PERSON_JOB_MAX_NUMBER entries
+
+PERSON_JOB_WORKERS = 2
+
+PERSON_JOB_MAX_ACTIVE = 8
+
+PERSON_JOB_MAX_NUMBER = 10000000
+
+
+# When PERSON_METRICS is enabled, the time spent in each stage of a request and in
+# each field provider is recorded and exposed at /metrics in the Prometheus text
+# format. When PERSON_SERVER_TIMING is enabled, the stages of each request are also
+# reported in a Server-Timing response header. Both are disabled by default as
+# they add a few timer reads per chunk of every request
+
+PERSON_METRICS = False
+
+PERSON_SERVER_TIMING = False
+
+
+# Requests are generated on a pool of PERSON_CPU_WORKERS threads, keeping the event
+# loop free. At most PERSON_ADMISSION_ROWS rows are generated at once, further
+# requests wait for admission. When PERSON_ADMISSION_QUEUE requests are already
+# waiting a request is answered with 429, when it waits longer than
+# PERSON_ADMISSION_TIMEOUT seconds with 503, both with a Retry-After of
+# PERSON_RETRY_AFTER seconds
+
+PERSON_CPU_WORKERS = 4
+
+PERSON_ADMISSION_ROWS = 200000
+
+PERSON_ADMISSION_QUEUE = 64
+
+PERSON_ADMISSION_TIMEOUT = 10.0
+
+PERSON_RETRY_AFTER = 5
+
+
+# A seeded request with an "offset", "limit" or "cursor" returns a page of the
+# virtual dataset it defines. Pages hold REST_FRAMEWORK["PAGE_SIZE"] people unless a
+# limit of at most PERSON_PAGE_MAX_SIZE is given
+
+PERSON_PAGE_MAX_SIZE = 1000
+
+
+# A batch request to /api/persons/batch/ holds at most PERSON_BATCH_MAX_REQUESTS
+# request bodies
+
+PERSON_BATCH_MAX_REQUESTS = 1000
+
+
+# Responses are compressed with brotli or gzip when the Accept-Encoding header of a
+# request accepts either and PERSON_COMPRESSION is enabled. Encoded bodies smaller
+# than PERSON_COMPRESSION_MIN_BYTES are sent uncompressed, streamed bodies are
+# compressed chunk by chunk
+
+PERSON_COMPRESSION = True
+
+PERSON_COMPRESSION_MIN_BYTES = 1024
+
+PERSON_GZIP_LEVEL = 6
+
+PERSON_BROTLI_QUALITY = 5
+
+# The distribution the ages of people are drawn from when a request does not
+# specify an "age_distribution", either one of DISTRIBUTION_NAMES in
+# people/distributions.py or None for uniformly distributed birthdates
+
+PERSON_AGE_DISTRIBUTION = None
@@ -24,6 +24,19 @@ router = routers.DefaultRouter()
 urlpatterns = [
     path("api/", include(router.urls)),
     path("api/persons/", views.PersonAPIClass.as_view(), name="persons"),
+    path(
+        "api/persons/batch/",
+        views.PersonBatchClass.as_view(),
+        name="persons-batch",
+    ),
+    path("api/jobs/", views.PersonJobsClass.as_view(), name="jobs"),
+    path("api/jobs/<str:job_id>/", views.PersonJobClass.as_view(), name="job"),
+    path(
+        "api/jobs/<str:job_id>/download/",
+        views.PersonJobDownloadClass.as_view(),
+        name="job-download",
+    ),
+    path("metrics", views.MetricsClass.as_view(), name="metrics"),
     # path('async/', views.AsyncClass.as_view(), name = 'async'),
     path("admin/", admin.site.urls),
 ]